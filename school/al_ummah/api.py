@@ -935,20 +935,9 @@ def get_leave_application_list(student_group, student=None):
     return leave_list
 
 def convert_image_to_base64(image_url):
-    # Check if the URL is relative (doesn't contain a scheme like http:// or https://)
-    if not image_url.startswith('http'):
-        base_url = 'http://edu.school:8000'
-        image_url = base_url + image_url
-    
-    # Now perform the request
-    response = requests.get(image_url)
-    
-    if response.status_code == 200:
-        image_bytes = BytesIO(response.content)
-        base64_image = base64.b64encode(image_bytes.read()).decode('utf-8')
-        return base64_image
-    else:
-        return None
+    from school.al_ummah.files import read_file_base64
+
+    return read_file_base64(image_url)
 
 
 #student_group, student, from_date, to_date, status
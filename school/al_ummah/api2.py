@@ -141,30 +141,19 @@ def get_user_roles():
         return []
 
 def send_push_message(token, title, body, extra=None):
-    headers = {
-        "accept": "application/json",
-        "accept-encoding": "gzip, deflate",
-        "content-type": "application/json",
-    }
-
-    data = {
-        "to": token,                  # ExponentPushToken[...] format
-        "title": title,
-        "body": body,
-    }
+    """Send a single Expo push message; returns the ticket or None on failure.
 
-    if extra:
-        data["data"] = extra  # Optional extra payload
+    Use `school.al_ummah.push.send_push_messages` when sending to many tokens.
+    """
+    from school.al_ummah.push import build_message, send_push_messages
 
-    try:
-        response = requests.post("https://exp.host/--/api/v2/push/send", headers=headers, json=data)
-        response.raise_for_status()  # Raise an exception for HTTP errors
+    ticket = send_push_messages([build_message(token, title, body, extra)])[0]
+    if ticket.get("status") == "ok":
         print("Push notification sent successfully!")
-        print(response.json())
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        print(f"Error sending push notification: {e}")
-        return None
+        return ticket
+
+    print(f"Error sending push notification: {ticket}")
+    return None
 
 
 @frappe.whitelist(allow_guest=True)
@@ -709,9 +698,10 @@ def get_student_guardian_names(student):
     return guardian_list
 
 @frappe.whitelist()
-def update_student_profile_image(student_id, base64_image):
+def update_student_profile_image(student_id, base64_image, thumbnail_size=None):
     """Efficiently update a student's profile image (base64 → File Doctype)."""
     import base64
+    from school.al_ummah.files import get_thumbnail_url
 
     try:
         # Validate inputs
@@ -751,6 +741,7 @@ def update_student_profile_image(student_id, base64_image):
             "content": image_data,
             "attached_to_doctype": "Student",
             "attached_to_name": student_id,
+            "attached_to_field": "image",
             "is_private": 0
         })
         file_doc.insert(ignore_permissions=True)
@@ -759,10 +750,13 @@ def update_student_profile_image(student_id, base64_image):
         frappe.db.set_value("Student", student_id, "image", file_doc.file_url)
         frappe.db.commit()
 
+        # thumbnails are made by the File hook in the background; until then
+        # thumbnail_url is the new photo itself
         return {
             "status": "success",
             "message": "Profile image updated successfully.",
-            "image_url": file_doc.file_url
+            "image_url": file_doc.file_url,
+            "thumbnail_url": get_thumbnail_url(file_doc.file_url, thumbnail_size),
         }
 
     except Exception as e:
@@ -1605,7 +1599,9 @@ def get_student_info():
     return student_info
 
 @frappe.whitelist()
-def get_guardian_app_data(guardian_id):
+def get_guardian_app_data(guardian_id, size=None):
+    from school.al_ummah.files import get_thumbnail_url
+
     guardian = frappe.get_all("Guardian", filters={"user": guardian_id}, limit=1)
     # print("Found Guardian doc:", guardian)
 
@@ -1617,6 +1613,14 @@ def get_guardian_app_data(guardian_id):
 
     # Retrieve students linked to this guardian
     student_list = [student.as_dict() for student in guardian_doc.get("students")]
+    student_images = dict(
+        frappe.get_all(
+            "Student",
+            filters={"name": ["in", [s["student"] for s in student_list]]},
+            fields=["name", "image"],
+            as_list=True,
+        )
+    ) if student_list else {}
 
     # Process each student
     for student in student_list:
@@ -1628,12 +1632,15 @@ def get_guardian_app_data(guardian_id):
 
         student_group = student_groups[0]["label"]
         student["student_group"] = student_group
+        student["img_url"] = student_images.get(student["student"])
+        student["thumbnail_url"] = get_thumbnail_url(student["img_url"], size)
 
     profile = guardian_doc.image
 
     response = {
         "name": guardian_doc.guardian_name,
         "img_url": profile,
+        "thumbnail_url": get_thumbnail_url(profile, size),
         "student_list": student_list,
     }
 
@@ -1723,25 +1730,14 @@ def get_student_app_data(studentID):
             today_attendance[0]["status"] if today_attendance else "No Record"
         )
 
-        # ✅ All attendance records
-        all_attendance = (
-            frappe.qb.from_(StudentAttendance)
-            .select(StudentAttendance.status)
-            .where(
-                (StudentAttendance.student == student.name)
-                & (StudentAttendance.student_group == student_group)
-            )
-        ).run(as_dict=True)
-
-        present_count = sum(1 for record in all_attendance if record["status"] == "Present")
-        absent_count = sum(1 for record in all_attendance if record["status"] == "Absent")
-        leave_count = sum(1 for record in all_attendance if record["status"] == "Leave")
+        # ✅ Attendance counters (maintained per student, group and academic year)
+        counters = get_attendance_summary([student.name], student_group).get(student.name) or {}
 
         # ✅ Update response
         response.update({
-            "present_count": present_count,
-            "absent_count": absent_count,
-            "leave_count": leave_count,
+            "present_count": counters.get("present_count") or 0,
+            "absent_count": counters.get("absent_count") or 0,
+            "leave_count": counters.get("leave_count") or 0,
         })
 
     except Exception as e:
@@ -2075,8 +2071,10 @@ def get_user_details(username=None, role=None):
 #         return
     
 @frappe.whitelist()
-def get_instructor_app_data(teacherID):
+def get_instructor_app_data(teacherID, size=None):
     """Fetch all required static data in one API call."""
+    from school.al_ummah.files import get_thumbnail_url
+
     response = {}
     # user_doc = frappe.get_doc("User", {"email": teacherID})
     emp_doc = frappe.get_doc("Employee", {"user_id": teacherID})
@@ -2094,6 +2092,7 @@ def get_instructor_app_data(teacherID):
     response = {
         "name": instructor_doc.instructor_name,
         "img_url": profile,
+        "thumbnail_url": get_thumbnail_url(profile, size),
         "student_groups": student_groups,
     }
     return response
@@ -2558,10 +2557,11 @@ from frappe.query_builder import DocType
 
 
 @frappe.whitelist()
-def get_basic_student_list(student_group):
-    """Return minimal info — ID, name, roll no, and image URL."""
+def get_basic_student_list(student_group, size=None):
+    """Return minimal info — ID, name, roll no, image and thumbnail URL."""
 
     from frappe.query_builder import DocType
+    from school.al_ummah.files import add_thumbnail_urls
 
     StudentGroupStudent = DocType("Student Group Student")
     Student = DocType("Student")
@@ -2585,12 +2585,13 @@ def get_basic_student_list(student_group):
         .orderby(StudentGroupStudent.group_roll_number)
     ).run(as_dict=True)
 
-    return student_list
+    return add_thumbnail_urls(student_list, "student_image", size)
 
 @frappe.whitelist()
-def get_basic_student_data(student_group):
-    """Return minimal info — ID, name, roll no, image URL, and attendance status flags."""
-    
+def get_basic_student_data(student_group, size=None):
+    """Return minimal info — ID, name, roll no, image/thumbnail URL, and attendance status flags."""
+    from school.al_ummah.files import get_thumbnail_url
+
     # from datetime import date
     # from frappe.query_builder import DocType
 
@@ -2634,12 +2635,14 @@ def get_basic_student_data(student_group):
         # student["img_url"] = student.pop("image", None)
         student["present"] = 1 if student["student"] in present_stud else 0
         student["on_leave"] = 1 if student["student"] in on_leave_stud else 0
+        student["thumbnail_url"] = get_thumbnail_url(student["img_url"], size)
 
     return student_list
 
 
 import frappe
 from frappe.utils import getdate
+from school.al_ummah.attendance import get_attendance_summary, get_group_attendance_overview
 
 @frappe.whitelist()
 def get_detailed_student_data(student_group, date=None, course_schedule=None):
@@ -2694,29 +2697,16 @@ def get_detailed_student_data(student_group, date=None, course_schedule=None):
             )
         ).run(as_dict=True)
 
-    # ✅ Step 3: Today's attendance
-    today_attendance_list = (
-        frappe.qb.from_(StudentAttendance)
-        .select(StudentAttendance.student, StudentAttendance.status)
-        .where(
-            (StudentAttendance.student_group == student_group)
-            & (StudentAttendance.date == date)
-        )
-    ).run(as_dict=True)
+    # ✅ Step 3: Today's status and attendance counters, grouped per student in one query
+    overview = get_group_attendance_overview(student_group, date)
 
-    # ✅ Step 4: All attendance (for summary)
-    all_attendance_list = (
-        frappe.qb.from_(StudentAttendance)
-        .select(StudentAttendance.student, StudentAttendance.status)
-        .where(StudentAttendance.student_group == student_group)
-    ).run(as_dict=True)
-
-    # ✅ Step 5: Enrich each record
+    # ✅ Step 4: Enrich each record
     for s in student_list:
-        s.status = next((a.status for a in today_attendance_list if a.student == s.student), None)
-        s.present_count = sum(1 for a in all_attendance_list if a.student == s.student and a.status == "Present")
-        s.absent_count = sum(1 for a in all_attendance_list if a.student == s.student and a.status == "Absent")
-        s.leave_count = sum(1 for a in all_attendance_list if a.student == s.student and a.status not in ("Present", "Absent"))
+        row = overview.get(s.student) or {}
+        s.status = row.get("status")
+        s.present_count = row.get("present_count") or 0
+        s.absent_count = row.get("absent_count") or 0
+        s.leave_count = row.get("leave_count") or 0
     # print(student_list)
     return student_list
 
@@ -2885,41 +2875,33 @@ def mark_attendance(
     :param student_group: Student Group.
     :param date: Date.
     """
+    from school.al_ummah.attendance import apply_bulk_attendance_to_summary, bulk_mark_attendance
+
     try:
         date = getdate()
-        if student_group:
-            academic_year = frappe.db.get_value("Student Group", student_group, "academic_year")
-            if academic_year:
-                year_start_date, year_end_date = frappe.db.get_value(
-                    "Academic Year", academic_year, ["year_start_date", "year_end_date"]
-                )
-                if getdate(date) < getdate(year_start_date) or getdate(date) > getdate(
-                    year_end_date
-                ):
-                    frappe.throw(
-                        _("Attendance cannot be marked outside of Academic Year {0}").format(academic_year)
-                    )
 
         present = json.loads(students_present)
         absent = json.loads(students_absent)
 
-        for d in present:
-            make_attendance_records(
-                d["student"], d["student_name"], "Present", course_schedule, student_group, date
-            )
+        # Validated once for the group and date, then written in a few multi-row statements
+        records = [
+            {"student": d["student"], "student_name": d["student_name"], "status": "Present"}
+            for d in present
+        ] + [
+            {"student": d["student"], "student_name": d["student_name"], "status": "Absent"}
+            for d in absent
+        ]
+        result = bulk_mark_attendance(records, course_schedule, student_group, date)
+        apply_bulk_attendance_to_summary(result, records)
 
-        student_list = []
-        for d in absent:
-            student_list.append(d["student"])
-            make_attendance_records(
-                d["student"], d["student_name"], "Absent", course_schedule, student_group, date
-            )
-        
-        frappe.db.commit()
-        
-        # Send push notifications to parents of absent students
+        student_list = [d["student"] for d in absent]
+
+        # Queue notifications to parents of absent students; they are committed
+        # with the attendance and sent by a background job
         send_notification_to_app(student_list)
-        
+
+        frappe.db.commit()
+
         # Return structured JSON response instead of using msgprint
         return {
             "message": "Attendance has been marked successfully.",
@@ -2959,41 +2941,48 @@ MSG91_ROUTE = "4"  # Transactional route
 
 @frappe.whitelist()
 def send_notification_to_app(student_list):
-    for student in student_list:
-        guardians = get_student_guardians(student)
+    """Queue push, email and SMS absence alerts in the Notification Outbox.
 
-        student_doc = frappe.get_doc("Student", student)
-        student_name = student_doc.student_name
+    Nothing is sent inline; `school.al_ummah.notifications.process_outbox`
+    drains the outbox in the background and retries failed sends.
+    """
+    from school.al_ummah.notifications import get_guardian_contacts, queue_notifications
 
-        for guardian in guardians:
-            guardian_doc = frappe.get_doc("Guardian", guardian.get("guardian"))
-            guardian_email = guardian_doc.email_address
-            guardian_phone = guardian_doc.mobile_number
+    notifications = []
+    for contact in get_guardian_contacts(student_list):
+        student_name = contact.student_name
+        guardian_email = contact.email
+        guardian_phone = contact.phone
 
-            if not guardian_email:
-                print(f"⚠️ No email found for guardian of student {student_name}")
-                continue
+        if not guardian_email:
+            print(f"⚠️ No email found for guardian of student {student_name}")
+            continue
 
-            msg = _(f"Dear Parent, your child {student_name} is marked absent today. Please check the attendance for further details.")
-            title = _("Al-Ummah Girls High School")
+        msg = _(f"Dear Parent, your child {student_name} is marked absent today. Please check the attendance for further details.")
+        title = _("Al-Ummah Girls High School")
 
-            # Push Notification
-            existing_device = frappe.get_all(
-                "User Device", filters={"user": guardian_email}, fields=["device_id"]
+        # Push Notification
+        for device_id in contact.device_tokens:
+            notifications.append(
+                {"channel": "Push", "recipient": device_id, "subject": title, "message": msg}
             )
-            if existing_device:
-                device_id = existing_device[0].get("device_id")
-                if device_id:
-                    notify_push(device_id, title, msg, email=guardian_email)
 
-            # Email Notification
-            notify_email(guardian_email, "Your child was marked absent", msg)
+        # Email Notification
+        notifications.append(
+            {"channel": "Email", "recipient": guardian_email, "subject": "Your child was marked absent", "message": msg}
+        )
 
-            # SMS Notification
-            if guardian_phone:
-                notify_sms(guardian_phone, student_name)
+        # SMS Notification
+        if guardian_phone:
+            if not guardian_phone.startswith("91"):
+                guardian_phone = "91" + guardian_phone
+            notifications.append(
+                {"channel": "SMS", "recipient": guardian_phone, "payload": {"student_name": student_name}}
+            )
 
-    return {"status": "success", "message": "Notifications sent to guardians of absent students."}
+    queue_notifications(notifications)
+
+    return {"status": "success", "message": "Notifications queued for guardians of absent students."}
 def notify_push(device_id, title, message, email=None):
     try:
         
@@ -3030,40 +3019,17 @@ def notify_sms(phone: str, student_name: str):
 
 
 def send_absence_sms(mobile: str, student_name: str):
-    url = "https://control.msg91.com/api/v5/flow"
-    headers = {
-        "accept": "application/json",
-        "authkey": "440500AhNX5vWp2a67a1d344P1",  # Use your actual MSG91 Auth Key
-        "content-type": "application/json"
-    }
+    """Send the absence template to one number; returns the result or None on failure.
 
-    payload = {
-        "template_id": "67a9cc85d6fc0568b5678ec2",  # Use your actual template ID
-        "short_url": "0",  # Turn off if not needed
-        "realTimeResponse": "1",  # Optional: Real-time response flag
-        "recipients": [
-            {
-                "mobiles": mobile,
-                "var1": student_name  # Replacing ##var1## in the template with the student's name
-            }
-        ]
-    }
+    Use `school.al_ummah.sms.send_absence_sms_batch` for a whole class.
+    """
+    from school.al_ummah.sms import send_absence_sms_batch
 
-    try:
-        # Make the POST request to MSG91 API
-        response = requests.post(url, json=payload, headers=headers)
-        
-        # Check if response is successful
-        if response.status_code == 200:
-            data = response.json()
-            if data.get("type") == "success":
-                print(f"✅ SMS sent successfully to {mobile}")
-            else:
-                print(f"❌ SMS failed: {data}")
-        else:
-            print(f"❌ Error: Status code {response.status_code}. Response: {response.text}")
-    except Exception as e:
-        print(f"❌ Error sending SMS: {e}")
+    result = send_absence_sms_batch([(mobile, student_name)])[0]
+    if result["status"] == "Sent":
+        return result
+
+    return None
 
 
 
@@ -3140,7 +3106,7 @@ def get_student_group():
     student_groups = get_student_groups(student.name, current_program.program)
     x = []
     x.append(student_groups[0]["label"])
-    x.append(convert_image_to_base64(student.image))
+    x.append(get_thumbnail_base64(student.image) or convert_image_to_base64(student.image))
     return x
 
 def get_instructor_group():
@@ -3609,24 +3575,11 @@ from io import BytesIO
 
 
 
-import requests
-import base64
+from school.al_ummah.files import get_thumbnail_base64, read_file_base64
 
 def convert_image_to_base64(image_url):
-    # Replace https with http and append :8000
-    base_url = frappe.utils.get_url().replace("https://", "http://")
-    # print(f"Using base URL: {base_url}")
-
-    if not image_url.startswith('http'):
-        image_url = base_url + image_url
-
-    response = requests.get(image_url)
-
-    if response.status_code == 200:
-        image_bytes = BytesIO(response.content)
-        return base64.b64encode(image_bytes.read()).decode('utf-8')
-
-    return None
+    """Base64 of a site file, read straight from the file store."""
+    return read_file_base64(image_url)
 
 
 @frappe.whitelist()
@@ -3659,23 +3612,20 @@ def approve_leave(name):
 
 @frappe.whitelist(allow_guest=True)
 def submit_notice(notice_heading, notice_message, student_group):
+    """Create the Student Notice and hand guardian notifications off to a background job.
 
+    The notice is committed before anything is sent, so a failed broadcast
+    never loses it; poll `get_notice_broadcast_status` or listen for the
+    `notice_broadcast_progress` realtime event to follow the fan-out.
+    """
     print(student_group)
     if frappe.session.user:
         print(notice_heading, notice_message, student_group)
-        student_list = frappe.get_all(
-            "Student Group Student",
-            fields=["student", "student_name", "group_roll_number"],
-            filters={"parent": student_group, "active": 1},
-            order_by="group_roll_number",
-        )
-        print(student_list)
-        send_notice_notification_to_app(student_list, notice_heading, notice_message)
         try:
             if not notice_heading or not notice_message:
                 return {"status": "error", "message": "Both title and message are required."}
 
-            # Create a new Leave Application document
+            # Create a new Student Notice document
             teacherID = frappe.session.user
             employee = frappe.get_doc("Employee", {"user_id": teacherID})
             teacher = frappe.get_doc("Instructor", {"employee": employee.name})
@@ -3685,20 +3635,91 @@ def submit_notice(notice_heading, notice_message, student_group):
             doc.date = getdate()
             doc.instructor = teacher.instructor_name
             doc.student_group = student_group
+            doc.broadcast_status = "Queued"
 
-            # Insert the document to generate a valid `name` for linking
             doc.insert(ignore_permissions=True)
-            # Save the document after attaching the image
-            doc.save()
-            frappe.db.commit()  # Ensure the changes are committed to the database
+            frappe.db.commit()  # Ensure the notice exists before the fan-out starts
+
+            frappe.enqueue(
+                "school.al_ummah.api2.broadcast_notice",
+                queue="long",
+                notice=doc.name,
+                user=frappe.session.user,
+            )
 
             # Ensure the message is a string
-            return {"status": "success", "message": str("Notice created successfully")}
+            return {"status": "success", "message": str("Notice created successfully"), "notice": doc.name}
         except Exception as e:
             # Return the error message as a string
             return {"status": "error", "message": str(e)}
     else:
         return
+
+
+NOTICE_BROADCAST_CHUNK_SIZE = 50
+
+
+def broadcast_notice(notice, user=None):
+    """Background job: notify the guardians of every student in the notice's group.
+
+    Students are processed in chunks; after each chunk the progress is saved
+    on the notice and published to `user` as `notice_broadcast_progress`.
+    """
+    doc = frappe.get_doc("Student Notice", notice)
+    student_list = frappe.get_all(
+        "Student Group Student",
+        fields=["student", "student_name", "group_roll_number"],
+        filters={"parent": doc.student_group, "active": 1},
+        order_by="group_roll_number",
+    )
+    total = len(student_list)
+
+    def update_progress(status, done, error=None):
+        frappe.db.set_value(
+            "Student Notice",
+            notice,
+            {"broadcast_status": status, "recipients_total": total, "recipients_done": done, "broadcast_error": error},
+            update_modified=False,
+        )
+        frappe.db.commit()
+        frappe.publish_realtime(
+            "notice_broadcast_progress",
+            {"notice": notice, "status": status, "progress": [done, total]},
+            user=user,
+        )
+
+    update_progress("Sending", 0)
+    done = 0
+    try:
+        for i in range(0, total, NOTICE_BROADCAST_CHUNK_SIZE):
+            chunk = student_list[i : i + NOTICE_BROADCAST_CHUNK_SIZE]
+            send_notice_notification_to_app(chunk, doc.notice_heading, doc.notice_message)
+            done += len(chunk)
+            update_progress("Sending", done)
+    except Exception as e:
+        frappe.db.rollback()
+        frappe.log_error(frappe.get_traceback(), "Notice Broadcast Error")
+        update_progress("Failed", done, str(e))
+        return
+
+    update_progress("Sent", done)
+
+
+@frappe.whitelist()
+def get_notice_broadcast_status(name):
+    """Return the fan-out progress of a notice for the app to poll."""
+    frappe.has_permission("Student Notice", "read", doc=name, throw=True)
+    status = frappe.db.get_value(
+        "Student Notice",
+        name,
+        ["name", "broadcast_status", "recipients_total", "recipients_done", "broadcast_error"],
+        as_dict=True,
+    )
+    if not status:
+        frappe.throw(f"Notice {name} not found", frappe.DoesNotExistError)
+
+    status["progress"] = [status.recipients_done or 0, status.recipients_total or 0]
+    return status
     
 
 from frappe import _
@@ -3746,29 +3767,6 @@ from frappe import _
                 print(f"Error sending notifications to {guardian_email}: {e}")
                 continue  # Continue processing the next guardian
 """
-def send_push_notification_to_guardian(guardian_email, student_name, notice_heading, notice_message):
-    existing_device = frappe.get_all(
-        "User Device", filters={"user": guardian_email}, fields=["device_id"]
-    )
-
-    if not existing_device:
-        return
-
-    device_id = existing_device[0].get("device_id")
-    if not device_id:
-        return
-
-    title = _(f"Notice: {notice_heading}")
-    msg = _(f"Dear Parent, a new notice titled '{notice_heading}' has been posted for your child {student_name}. {notice_message}")
-
-    try:
-        
-        send_push_message(device_id, title, msg)
-        print(f"Push notification sent to {guardian_email} ({device_id})")
-    except Exception as e:
-        frappe.log_error(f"Push notification error for {guardian_email}: {e}")
-
-
 def send_email_to_guardian(guardian_email, notice_heading, notice_message, student_name):
     subject = f"Notice: {notice_heading}"
     msg = _(f"Dear Parent, a new notice titled '{notice_heading}' has been posted for your child {student_name}. {notice_message}")
@@ -3786,18 +3784,24 @@ def send_email_to_guardian(guardian_email, notice_heading, notice_message, stude
 
 @frappe.whitelist()
 def send_notice_notification_to_app(student_list, notice_heading, notice_message):
-    for student in student_list:
-        student_doc = frappe.get_doc("Student", student["student"])
-        student_name = student_doc.student_name
-        guardians = get_student_guardians(student["student"])
+    from school.al_ummah.notifications import get_guardian_contacts
+    from school.al_ummah.push import build_message, send_push_messages
 
-        for guardian in guardians:
-            guardian_doc = frappe.get_doc("Guardian", guardian.get("guardian"))
-            guardian_email = guardian_doc.email_address
+    title = _(f"Notice: {notice_heading}")
+    push_messages = []
+    for contact in get_guardian_contacts([student["student"] for student in student_list]):
+        guardian_email = contact.email
 
-            if guardian_email:
-                send_push_notification_to_guardian(guardian_email, student_name, notice_heading, notice_message)
-                send_email_to_guardian(guardian_email, notice_heading, notice_message, student_name)
+        if guardian_email:
+            msg = _(f"Dear Parent, a new notice titled '{notice_heading}' has been posted for your child {contact.student_name}. {notice_message}")
+            push_messages.extend(build_message(token, title, msg) for token in contact.device_tokens)
+            send_email_to_guardian(guardian_email, notice_heading, notice_message, contact.student_name)
+
+    # One Expo request per 100 devices instead of one per guardian
+    tickets = send_push_messages(push_messages)
+    failed = [t for t in tickets if t.get("status") != "ok"]
+    if failed:
+        frappe.log_error(f"Notice push errors: {failed}", "send_notice_notification_to_app")
 
     return {"status": "success", "message": "Push notifications and emails sent for the notice."}
 
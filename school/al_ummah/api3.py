@@ -11,6 +11,15 @@ from frappe.model.document import Document
 from frappe.utils.file_manager import save_file
 from frappe.utils.response import build_response
 from frappe.auth import get_logged_user
+from school.al_ummah.enrollment import (
+    check_enrollment_keys,
+    get_username,
+    load_enrollment_keys,
+    remember_enrollment_keys,
+    validate_enrollment_rows,
+)
+from school.al_ummah.progression import resolve_next_group
+from school.al_ummah.qr import API3_QR_DATA_FORMAT, enqueue_qr_codes
 
 #qdsr itqf nmqx zmni
 import frappe
@@ -149,154 +158,18 @@ def fetch_student_group(current_group_name):
 
 def promote_student_group(group_name):
     """
-    Generate the next level group name and program based on the current group name
-    Returns: {'next_group_base_name': '2nd-A', 'next_program_name': '2nd'}
+    Generate the next level group name and program based on the current group name,
+    from the Program Progression of its level (see school.al_ummah.progression)
+    Returns: {'next_group_base_name': '3rd-A', 'next_program_name': '3rd'}
     """
-    # ---- SCHOOL LEVELS ----
-    school_levels = [
-        "Nursery", "Jr KG", "Sr KG",
-        "1st", "2nd", "3rd", "4th", "5th",
-        "6th", "7th", "8th", "9th", "10th",
-        "11th", "12th"
-    ]
-
-    # ---- COLLEGE LEVELS ----
-    bachelors_levels = ["FY Bachelors", "SY Bachelors", "TY Bachelors", "Final Year Bachelors"]
-    btech_levels = ["FY BTech", "SY BTech", "TY BTech", "Final Year BTech"]
-    masters_levels = ["FY Masters", "SY Masters"]
-    phd_levels = ["PhD Year 1", "PhD Year 2", "PhD Year 3", "PhD Year 4", "PhD Year 5"]
-
-    # ---- DIPLOMA LEVELS (NEW) ----
-    diploma_levels = ["FY Diploma", "SY Diploma", "Final Year Diploma"]
-
-    # Remove academic year from group name for processing
-    base_group_name = group_name
-    if "(" in group_name and ")" in group_name:
-        base_group_name = group_name.split("(")[0].strip()
-
-    # ------------------------------------
-    # SCHOOL LOGIC
-    # ------------------------------------
-    for level in school_levels:
-        if base_group_name.startswith(level):
-            # Handle divisions like "2nd-A", "3rd-B", etc.
-            remaining_part = base_group_name.replace(level, "").strip()
-            division = ""
-            if remaining_part and remaining_part[0] == "-":
-                division = remaining_part
-            elif remaining_part:
-                # Handle cases with space or other separators
-                division = " " + remaining_part
-            
-            idx = school_levels.index(level)
-            if idx == len(school_levels) - 1:
-                return None  # Cannot promote 12th
-            
-            next_level = school_levels[idx+1]
-            next_group_base_name = f"{next_level}{division}"
-            next_program_name = next_level  # For school levels, program is the level name
-            
-            return {
-                'next_group_base_name': next_group_base_name,
-                'next_program_name': next_program_name
-            }
-
-    # ------------------------------------
-    # BACHELORS LOGIC
-    # ------------------------------------
-    for level in bachelors_levels:
-        if base_group_name.startswith(level):
-            suffix = base_group_name.replace(level, "").strip()
-            idx = bachelors_levels.index(level)
-            if idx == len(bachelors_levels) - 1:
-                return None
-            
-            next_level = bachelors_levels[idx+1]
-            next_group_base_name = f"{next_level} {suffix}".strip()
-            next_program_name = "Bachelors"  # Program remains "Bachelors" for all bachelor levels
-            
-            return {
-                'next_group_base_name': next_group_base_name,
-                'next_program_name': next_program_name
-            }
-
-    # ------------------------------------
-    # BTECH LOGIC
-    # ------------------------------------
-    for level in btech_levels:
-        if base_group_name.startswith(level):
-            suffix = base_group_name.replace(level, "").strip()
-            idx = btech_levels.index(level)
-            if idx == len(btech_levels) - 1:
-                return None
-            
-            next_level = btech_levels[idx+1]
-            next_group_base_name = f"{next_level} {suffix}".strip()
-            next_program_name = "BTech"  # Program remains "BTech" for all BTech levels
-            
-            return {
-                'next_group_base_name': next_group_base_name,
-                'next_program_name': next_program_name
-            }
-
-    # ------------------------------------
-    # MASTERS LOGIC
-    # ------------------------------------
-    for level in masters_levels:
-        if base_group_name.startswith(level):
-            suffix = base_group_name.replace(level, "").strip()
-            idx = masters_levels.index(level)
-            if idx == len(masters_levels) - 1:
-                return None
-            
-            next_level = masters_levels[idx+1]
-            next_group_base_name = f"{next_level} {suffix}".strip()
-            next_program_name = "Masters"  # Program remains "Masters" for all master levels
-            
-            return {
-                'next_group_base_name': next_group_base_name,
-                'next_program_name': next_program_name
-            }
-
-    # ------------------------------------
-    # PhD LOGIC
-    # ------------------------------------
-    for level in phd_levels:
-        if base_group_name.startswith(level):
-            suffix = base_group_name.replace(level, "").strip()
-            idx = phd_levels.index(level)
-            if idx == len(phd_levels) - 1:
-                return None
-            
-            next_level = phd_levels[idx+1]
-            next_group_base_name = f"{next_level} {suffix}".strip()
-            next_program_name = "PhD"  # Program remains "PhD" for all PhD levels
-            
-            return {
-                'next_group_base_name': next_group_base_name,
-                'next_program_name': next_program_name
-            }
+    next_group = resolve_next_group(group_name)
+    if not next_group:
+        return None  # Final level, or no Program Progression matches
 
-    # ------------------------------------
-    # DIPLOMA LOGIC (NEW)
-    # ------------------------------------
-    for level in diploma_levels:
-        if base_group_name.startswith(level):
-            suffix = base_group_name.replace(level, "").strip()
-            idx = diploma_levels.index(level)
-            if idx == len(diploma_levels) - 1:
-                return None
-            
-            next_level = diploma_levels[idx+1]
-            next_group_base_name = f"{next_level} {suffix}".strip()
-            next_program_name = "Diploma"  # Program remains "Diploma" for all diploma levels
-            
-            return {
-                'next_group_base_name': next_group_base_name,
-                'next_program_name': next_program_name
-            }
-
-    return None  # Not matched
+    return {
+        'next_group_base_name': next_group['next_group_base_name'],
+        'next_program_name': next_group['next_program_name']
+    }
     
 @frappe.whitelist()
 def fetch_admin_settings():
@@ -1002,25 +875,31 @@ def safe_int(val):
         return float('inf')
 
 
-def generate_unique_email(first_name, last_name, name):
+def generate_unique_email(first_name, last_name, name, taken=None):
+    """`taken` is an optional set of emails already in use, checked instead of the database."""
     base_name = f"{first_name}.{last_name}".replace(" ", ".").lower()
     gr = str(name).strip().lower().replace(" ", "")
     base = re.sub(r'\.+', '.', f"{base_name}.{gr}").strip('.')
 
-    while True:
-        email = f"{base}@codedaddy.io"
-        if not frappe.db.exists("User", {"email": email}):
-            return email
+    def is_free(email):
+        if taken is not None:
+            return email not in taken
+        return not frappe.db.exists("User", {"email": email})
 
+    email = f"{base}@codedaddy.io"
+    while not is_free(email):
         email = f"{base}.{random.randint(1000, 9999)}@codedaddy.io"
-        if not frappe.db.exists("User", {"email": email}):
-            return email
+    return email
 
 
-def generate_unique_phone():
+def generate_unique_phone(taken=None):
+    """`taken` is an optional set of mobile numbers already in use, checked instead of the database."""
     while True:
         phone = f"9{''.join(random.choices(string.digits, k=9))}"
-        if not frappe.db.exists("User", {"mobile_no": phone}):
+        if taken is not None:
+            if phone not in taken:
+                return phone
+        elif not frappe.db.exists("User", {"mobile_no": phone}):
             return phone
 
 def convert_to_ddmmyyyy(d): 
@@ -1154,6 +1033,18 @@ def bulk_enroll_students(className, divisionName, generateQRCode, students):
     # --- Sort by Roll No ---
     valid_students.sort(key=lambda s: safe_int(s.get("Roll No")))
 
+    # --- Pre-flight: report every problem before writing anything ---
+    keys = load_enrollment_keys()
+    validation = validate_enrollment_rows(
+        students, gr_prefix="", required_fields=("First Name", "Last Name", "Aadhar Number"), keys=keys
+    )
+    if not validation["valid"]:
+        return {
+            "status": "error",
+            "message": f"{len(validation['errors'])} problem(s) found in {len(students)} rows, nothing was enrolled",
+            "validation": validation,
+        }
+
     try:
         # --- Get existing Student Group ---
         student_group = frappe.get_doc("Student Group", {"program": className, "batch": divisionName})
@@ -1166,15 +1057,19 @@ def bulk_enroll_students(className, divisionName, generateQRCode, students):
 
         # --- Single loop: Enroll & add to group ---
         added_count = 0
+        enrolled_ids = []
         for student in valid_students:
             full_name = f"{student.get('First Name', '').strip()} {student.get('Middle Name', '').strip()} {student.get('Last Name', '').strip()}".strip()
             print(f">>> Enrolling student: {full_name} | Roll No: {student.get('Roll No')}")
 
             # Enroll student
-            enroll_student(student, className, divisionName, year, term, generateQRCode)
+            # QR codes are generated for the whole upload after the commit
+            enroll_student(student, className, divisionName, year, term, False, keys=keys)
 
             # Get enrolled student ID
             student_id = frappe.db.get_value("Student", {"name": student.get("GR Number")}, "name")
+            if generateQRCode and student_id:
+                enrolled_ids.append(student_id)
 
             # Add to Student Group if not already there
             if student_id and student_id not in existing_student_ids:
@@ -1184,6 +1079,7 @@ def bulk_enroll_students(className, divisionName, generateQRCode, students):
                 added_count += 1
 
         # --- Save group once at end ---
+        enqueue_qr_codes(enrolled_ids, API3_QR_DATA_FORMAT)
         if added_count > 0:
             student_group.save(ignore_permissions=True)
             frappe.db.commit()
@@ -1204,7 +1100,8 @@ def bulk_enroll_students(className, divisionName, generateQRCode, students):
 
 
 @frappe.whitelist()
-def enroll_student(student, className, divisionName, year, term, generateQRCode):
+def enroll_student(student, className, divisionName, year, term, generateQRCode, keys=None):
+    """Enroll one sheet row; `keys` from `enrollment.load_enrollment_keys` replaces the per-row queries."""
     first_name = student["First Name"]
     middle_name = student.get("Middle Name", "")
     last_name = student["Last Name"]
@@ -1227,25 +1124,34 @@ def enroll_student(student, className, divisionName, year, term, generateQRCode)
     # print("Guardian Info:", guardian_info)
 
     # --- Duplicate Checks ---
-    if email and frappe.db.exists("Student", {"student_email_id": email}):
-        frappe.throw(_("Duplicate email for: {0}, {1}").format(full_name, email))
+    if keys is not None:
+        check_enrollment_keys(student, full_name, str(student.get("GR Number")), keys)
+    else:
+        if email and frappe.db.exists("Student", {"student_email_id": email}):
+            frappe.throw(_("Duplicate email for: {0}, {1}").format(full_name, email))
 
-    if frappe.db.exists("Student", {"gr_num": student.get("GR Number")}):
-        frappe.throw(_("Duplicate GR Number for: {0}, {1}").format(full_name, student.get("GR Number")))
+        if frappe.db.exists("Student", {"gr_num": student.get("GR Number")}):
+            frappe.throw(_("Duplicate GR Number for: {0}, {1}").format(full_name, student.get("GR Number")))
 
     # --- Generate fallback email ---
     if not email or "@" not in email:
-        email = generate_unique_email(first_name, last_name, student.get("GR Number", ""))
+        email = generate_unique_email(
+            first_name, last_name, student.get("GR Number", ""), taken=keys.user_emails if keys is not None else None
+        )
 
     # --- Create User ---
-    phone = str(student.get("Phone Number") or generate_unique_phone())
+    phone = str(student.get("Phone Number") or generate_unique_phone(taken=keys.mobiles if keys is not None else None))
     user = frappe.new_doc("User")
     user.first_name = first_name
     user.middle_name = middle_name
     user.last_name = last_name
     user.email = email
-    user.username = f"{first_name.lower()}{student.get('GR Number', '')}".replace(" ", "")
-    if not frappe.db.exists("User", {"mobile_no": phone}):
+    user.username = get_username(student)
+    if keys is not None:
+        phone_taken = phone in keys.mobiles
+    else:
+        phone_taken = frappe.db.exists("User", {"mobile_no": phone})
+    if not phone_taken:
         user.mobile_no = phone
     user.send_welcome_email = 0
     user.enabled = 1
@@ -1265,40 +1171,9 @@ def enroll_student(student, className, divisionName, year, term, generateQRCode)
     student_doc.name = student["GR Number"]
     student_doc.aadhar_number = student["Aadhar Number"]
     student_doc.save(ignore_permissions=True)
-    # ✅ Generate QR Code if enabled
+    # ✅ QR code is rendered in a separate batch job
     if generateQRCode:
-        import qrcode
-        import base64
-        from io import BytesIO
-
-        # ✅ Data to encode inside QR
-        qr_data = f"{student_doc.name} - {student_doc.student_name}"
-
-        # ✅ Create QR image
-        qr = qrcode.QRCode(version=1, box_size=10, border=5)
-        qr.add_data(qr_data)
-        qr.make(fit=True)
-
-        img = qr.make_image()
-        buffer = BytesIO()
-        img.save(buffer, format="PNG")
-        image_data = buffer.getvalue()
-
-        # ✅ Create File doc for QR code
-        file_doc = frappe.get_doc({
-            "doctype": "File",
-            "file_name": f"{student_doc.name}_qr.png",
-            "content": image_data,
-            "attached_to_doctype": "Student",
-            "attached_to_name": student_doc.name,
-            "is_private": 0
-        })
-
-        file_doc.insert(ignore_permissions=True)
-
-        # ✅ Attach URL to Student.qr_code
-        student_doc.qr_code = file_doc.file_url
-        student_doc.save(ignore_permissions=True)
+        enqueue_qr_codes([student_doc.name], API3_QR_DATA_FORMAT)
 
     # --- Create Program Enrollment ---
     program_enrollment = frappe.new_doc("Program Enrollment")
@@ -1318,6 +1193,9 @@ def enroll_student(student, className, divisionName, year, term, generateQRCode)
             guardian_info=guardian_info
         )
 
+    if keys is not None:
+        remember_enrollment_keys(keys, email, student_doc.name, phone, user.username)
+
 
 
 @frappe.whitelist()
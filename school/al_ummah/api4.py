@@ -8,6 +8,8 @@ import base64
 from io import BytesIO
 from datetime import datetime
 from frappe import _
+from school.al_ummah.enrollment import check_enrollment_keys, get_username, remember_enrollment_keys
+from school.al_ummah.qr import enqueue_qr_codes
 
 @frappe.whitelist()
 def get_academic_years():
@@ -61,25 +63,31 @@ def safe_int(val):
         return float('inf')
 
 
-def generate_unique_email(first_name, last_name, name):
+def generate_unique_email(first_name, last_name, name, taken=None):
+    """`taken` is an optional set of emails already in use, checked instead of the database."""
     base_name = f"{first_name}.{last_name}".replace(" ", ".").lower()
     gr = str(name).strip().lower().replace(" ", "")
     base = re.sub(r'\.+', '.', f"{base_name}.{gr}").strip('.')
 
-    while True:
-        email = f"{base}@codedaddy.io"
-        if not frappe.db.exists("User", {"email": email}):
-            return email
+    def is_free(email):
+        if taken is not None:
+            return email not in taken
+        return not frappe.db.exists("User", {"email": email})
 
+    email = f"{base}@codedaddy.io"
+    while not is_free(email):
         email = f"{base}.{random.randint(1000, 9999)}@codedaddy.io"
-        if not frappe.db.exists("User", {"email": email}):
-            return email
+    return email
 
 
-def generate_unique_phone():
+def generate_unique_phone(taken=None):
+    """`taken` is an optional set of mobile numbers already in use, checked instead of the database."""
     while True:
         phone = f"9{''.join(random.choices(string.digits, k=9))}"
-        if not frappe.db.exists("User", {"mobile_no": phone}):
+        if taken is not None:
+            if phone not in taken:
+                return phone
+        elif not frappe.db.exists("User", {"mobile_no": phone}):
             return phone
 
 def convert_to_ddmmyyyy(d): 
@@ -87,7 +95,7 @@ def convert_to_ddmmyyyy(d):
     except: return datetime.strptime(d,"%Y-%m-%d").strftime("%d-%m-%Y")
 
 @frappe.whitelist(allow_guest=True)
-def add_guardian_to_student(student_id, student_name, guardian_info):
+def add_guardian_to_student(student_id, student_name, guardian_info, commit=True):
     try:
         guardian_no = guardian_info.get("guardian_no")
         guardian_name = guardian_info.get("guardian_name")
@@ -173,7 +181,8 @@ def add_guardian_to_student(student_id, student_name, guardian_info):
         student_guardian.relation = relation
 
         student_doc.save(ignore_permissions=True)
-        frappe.db.commit()
+        if commit:
+            frappe.db.commit()
 
         return "Guardian linked successfully."
 
@@ -243,7 +252,13 @@ def enroll_single_student(student_data, className, divisionName, generate_qr_cod
     return {"status": "success", "message": "Student enrolled and added to Student Group successfully!"}
 
 @frappe.whitelist()
-def enroll_student(student, className, divisionName, year, term, generate_qr_code):
+def enroll_student(student, className, divisionName, year, term, generate_qr_code, keys=None):
+    """Create the User, Student, Program Enrollment and Guardian for one sheet row.
+
+    Bulk imports pass `keys` from `enrollment.load_enrollment_keys` so the
+    duplicate checks and generated emails/phones use in-memory sets instead
+    of queries; the new student's values are added to them on success.
+    """
     dob = student["Student Date of Birth"]
     first_name = student["First Name"]
     middle_name = student.get("Middle Name", "")
@@ -265,30 +280,39 @@ def enroll_student(student, className, divisionName, year, term, generate_qr_cod
     }
 
     # --- Duplicate Checks ---
-    if email and frappe.db.exists("Student", {"student_email_id": email}):
-        frappe.throw(_("Duplicate email for: {0}, {1}").format(full_name, email))
-
     gr_num = f"GR-{student.get("GR Number")}"
-    if frappe.db.exists("Student", {"name": gr_num}):
-        frappe.throw(_("Duplicate GR Number for: {0}, {1}").format(full_name, gr_num))
+    if keys is not None:
+        check_enrollment_keys(student, full_name, gr_num, keys)
+    else:
+        if email and frappe.db.exists("Student", {"student_email_id": email}):
+            frappe.throw(_("Duplicate email for: {0}, {1}").format(full_name, email))
+
+        if frappe.db.exists("Student", {"name": gr_num}):
+            frappe.throw(_("Duplicate GR Number for: {0}, {1}").format(full_name, gr_num))
 
     # --- Generate fallback email ---
     if not email or "@" not in email:
-        email = generate_unique_email(first_name, last_name, student.get("GR Number", ""))
+        email = generate_unique_email(
+            first_name, last_name, student.get("GR Number", ""), taken=keys.user_emails if keys is not None else None
+        )
 
     student_doc = None
     program_enrollment = None
     
     try:
         # --- Step 1: Create User ---
-        phone = str(student.get("Phone Number") or generate_unique_phone())
+        phone = str(student.get("Phone Number") or generate_unique_phone(taken=keys.mobiles if keys is not None else None))
         user = frappe.new_doc("User")
         user.first_name = first_name
         user.middle_name = middle_name
         user.last_name = last_name
         user.email = email
-        user.username = f"{first_name.lower()}{student.get('GR Number', '')}".replace(" ", "")
-        if not frappe.db.exists("User", {"mobile_no": phone}):
+        user.username = get_username(student)
+        if keys is not None:
+            phone_taken = phone in keys.mobiles
+        else:
+            phone_taken = frappe.db.exists("User", {"mobile_no": phone})
+        if not phone_taken:
             user.mobile_no = phone
         user.date_birth = dob
         user.send_welcome_email = 0
@@ -313,37 +337,6 @@ def enroll_student(student, className, divisionName, year, term, generate_qr_cod
         student_doc.student_mobile_number = phone
         # student_doc.name = student["GR Number"]
         student_doc.save(ignore_permissions=True)
-        # ✅ Generate QR Code if enabled
-        if generate_qr_code:
-            import qrcode
-            import base64
-            from io import BytesIO
-
-            qr_data = f"{student_doc.name} / {student_doc.name} - {student_doc.student_name}"
-
-            qr = qrcode.QRCode(version=1, box_size=10, border=5)
-            qr.add_data(qr_data)
-            qr.make(fit=True)
-
-            img = qr.make_image()
-            buffer = BytesIO()
-            img.save(buffer, format="PNG")
-            image_data = buffer.getvalue()
-
-            file_doc = frappe.get_doc({
-                "doctype": "File",
-                "file_name": f"{student_doc.name}_qr.png",
-                "content": image_data,
-                "attached_to_doctype": "Student",
-                "attached_to_name": student_doc.name,
-                "is_private": 0
-            })
-
-            file_doc.insert(ignore_permissions=True)
-
-            # ✅ Do NOT use save() again — use db_set()
-            student_doc.db_set("qr_code", file_doc.file_url)
-        
         # ✅ Rename Student document to "GR-{GR Number}" format
         name = student["GR Number"]
         new_doc_name = f"GR-{name}"
@@ -397,7 +390,8 @@ def enroll_student(student, className, divisionName, year, term, generate_qr_cod
                 add_guardian_to_student(
                     student_id=student_doc.name,
                     student_name=student_doc.student_name,
-                    guardian_info=guardian_info
+                    guardian_info=guardian_info,
+                    commit=False,
                 )
                 print(f"✅ Guardian added successfully for student: {student_doc.name}")
             except Exception as guardian_error:
@@ -405,6 +399,13 @@ def enroll_student(student, className, divisionName, year, term, generate_qr_cod
                 print(f"⚠️ Guardian addition failed for {student_doc.name}: {str(guardian_error)}")
                 # Continue without throwing error - student is still enrolled
 
+        # ✅ QR codes are rendered in a separate batch job, after the rename
+        if generate_qr_code:
+            enqueue_qr_codes([student_doc.name])
+
+        if keys is not None:
+            remember_enrollment_keys(keys, email, student_doc.name, phone, user.username)
+
         return {
             "success": True,
             "user": user.name,
@@ -440,7 +441,28 @@ def cleanup_created_docs(user, student, program_enrollment):
 
 
 @frappe.whitelist()
-def bulk_enroll_students(className, divisionName, generate_qr_code, students):
+def bulk_enroll_students(className, divisionName, generate_qr_code, students, validate_only=False):
+    """Enroll an uploaded sheet through a Student Enrollment Import.
+
+    The whole sheet is validated first; if any row has errors nothing is
+    written and the report is returned under `validation`. Small uploads
+    are enrolled before returning; larger ones run as a background job and
+    report progress per row over the `student_enrollment_progress` realtime
+    event. Either way the response carries the import name for
+    `get_enrollment_import_status`.
+    """
+    from school.al_ummah.enrollment import (
+        INLINE_IMPORT_LIMIT,
+        create_enrollment_import,
+        enqueue_enrollment_import,
+        get_enrollment_import_response,
+        process_enrollment_import,
+        validate_enrollment_rows,
+    )
+    from frappe.utils import sbool
+
+    if isinstance(students, str):
+        students = json.loads(students)
     print(f"Received {len(students)} students")
 
     # --- Security check ---
@@ -451,263 +473,72 @@ def bulk_enroll_students(className, divisionName, generate_qr_code, students):
     if not className or not divisionName or not students:
         frappe.throw("Class, Division, and Students data are required.")
 
-    # --- Fetch academic context ---
-    edu_settings = frappe.get_single("Education Settings")
-    year = edu_settings.current_academic_year
-    term = edu_settings.current_academic_term
-
-    # --- Validate student data ---
-    def is_valid_student(s):
-        roll = safe_int(s.get("Roll No"))
-        gr = s.get("GR Number", "").strip()
-        return roll != float("inf") and roll > 0 and gr
+    if not frappe.db.exists("Student Group", divisionName):
+        frappe.throw(f"No Student Group found for Program '{className}' and Division '{divisionName}'")
 
-    valid_students = [s for s in students if is_valid_student(s)]
-    invalid_students = [s for s in students if not is_valid_student(s)]
-    for s in invalid_students:
-        print("Skipping invalid row:", s)
-
-    # --- Sort by Roll No ---
-    valid_students.sort(key=lambda s: safe_int(s.get("Roll No")))
-
-    # --- Initialize result dictionary ---
-    enrollment_results = {}
-
-    try:
-        # --- Get existing Student Group ---
-        student_group = frappe.get_doc("Student Group", divisionName)
-        # student_group = frappe.get_doc("Student Group", {"program": className, "batch": divisionName})
-        if not student_group:
-            frappe.throw(f"No Student Group found for Program '{className}' and Division '{divisionName}'")
-
-        # --- Cache existing students & roll numbers ---
-        existing_student_ids = {d.student for d in student_group.students}
-        next_roll = max([d.group_roll_number or 0 for d in student_group.students], default=0)
-
-        # --- Single loop: Enroll & add to group ---
-        added_count = 0
-        successful_count = 0
-        failed_count = 0
-        
-        for student in valid_students:
-            full_name = f"{student.get('First Name', '').strip()} {student.get('Middle Name', '').strip()} {student.get('Last Name', '').strip()}".strip()
-            email = student.get("Email Address", "")
-            print(f">>> Enrolling student: {full_name} | Roll No: {student.get('Roll No')}")
-            
-            # Initialize result entry for this student
-            enrollment_results[full_name] = {
-                "email": email,
-                "status": "pending",
-                "message": ""
-            }
-
-            try:
-                # Enroll student
-                enroll_student(student, className, divisionName, year, term, generate_qr_code)
-                gr_num = f"GR-{student.get("GR Number")}"
-                # Get enrolled student ID
-                student_id = frappe.db.get_value("Student", {"name": gr_num}, "name")
-
-                # Add to Student Group if not already there
-                if student_id and student_id not in existing_student_ids:
-                    next_roll += 1
-                    add_student_to_group(student_group, student_id, full_name, next_roll)
-                    existing_student_ids.add(student_id)
-                    added_count += 1
-
-                # Mark as success
-                enrollment_results[full_name]["status"] = "success"
-                enrollment_results[full_name]["message"] = f"Successfully enrolled and added to {className} - {divisionName}"
-                successful_count += 1
-                print(f"✅ Successfully enrolled: {full_name}")
-
-            except Exception as e:
-                # Mark as error but continue with next student
-                error_msg = str(e)
-                enrollment_results[full_name]["status"] = "error"
-                enrollment_results[full_name]["message"] = error_msg
-                failed_count += 1
-                print(f"❌ Failed to enroll {full_name}: {error_msg}")
-                # Continue to next student without breaking the loop
-
-        # --- Save group once at end ---
-        if added_count > 0:
-            student_group.save()
-            print(f"✅ Added {added_count} students to Student Group '{student_group.name}'")
-
-        # --- Commit all database changes at the end ---
-        frappe.db.commit()
-
-        print(f"✅ Bulk enrollment completed. Successful: {successful_count}, Failed: {failed_count}, Total processed: {len(valid_students)}")
+    # --- Pre-flight: report every problem before writing anything ---
+    validation = validate_enrollment_rows(
+        students, required_fields=("First Name", "Last Name", "Student Date of Birth")
+    )
+    if sbool(validate_only) or not validation["valid"]:
+        return {
+            "success": validation["valid"],
+            "message": (
+                f"{len(validation['errors'])} problem(s) found in {len(students)} rows, nothing was enrolled"
+                if not validation["valid"]
+                else f"All {len(students)} rows can be enrolled"
+            ),
+            "validation": validation,
+        }
 
-    except Exception as e:
-        frappe.db.rollback()
-        frappe.log_error(frappe.get_traceback(), "Bulk Enroll Failed")
-        frappe.throw(f"Enrollment process failed: {str(e)}")
+    enrollment_import = create_enrollment_import(className, divisionName, students, generate_qr_code)
+    frappe.db.commit()
 
-    # Prepare response
-    enrolled_students = []
-    failed_enrollments = []
-    
-    for name, result in enrollment_results.items():
-        if result["status"] == "success":
-            enrolled_students.append(name)
-        else:
-            # Find the student data for failed enrollments
-            student_data = next((s for s in valid_students if 
-                f"{s.get('First Name', '').strip()} {s.get('Middle Name', '').strip()} {s.get('Last Name', '').strip()}".strip() == name), {})
-            failed_enrollments.append({
-                "student_data": student_data,
-                "error": result["message"]
-            })
+    if enrollment_import.total_rows <= INLINE_IMPORT_LIMIT:
+        try:
+            process_enrollment_import(enrollment_import.name)
+        except Exception as e:
+            frappe.throw(f"Enrollment process failed: {str(e)}")
+    else:
+        enqueue_enrollment_import(enrollment_import.name)
 
-    return {
-        "success": True,
-        "message": f"Enrollment completed: {successful_count} successful, {failed_count} failed out of {len(valid_students)} students",
-        "enrollment_results": enrollment_results,
-        "enrolled_students": enrolled_students,
-        "failed_enrollments": failed_enrollments,
-        "summary": {
-            "total_processed": len(valid_students),
-            "successful": successful_count,
-            "failed": failed_count,
-            "added_to_group": added_count
-        }
-    }
+    response = get_enrollment_import_response(enrollment_import.name, enrollment_import.skipped_rows)
+    response["validation"] = validation
+    return response
 
 
 
 @frappe.whitelist()
 def bulk_enroll_instructors(teachers):
+    from school.al_ummah.instructors import onboard_instructors
+
+    if isinstance(teachers, str):
+        teachers = json.loads(teachers)
     if not teachers or not isinstance(teachers, list):
         frappe.throw("Invalid input: 'teachers' must be a non-empty list.")
 
-    # --- Initialize result dictionary ---
-    enrollment_results = {}
-    successful_count = 0
-    failed_count = 0
-
-    for teacher in teachers:
-        try:
-            user_doc = None
-            first_name = teacher.get("First Name", "")
-            middle_name = teacher.get("Middle Name", "")
-            last_name = teacher.get("Last Name", "")
-            phone = teacher.get("Mobile", "")
-            email = teacher.get("Email", "")
-            attendance_device_id = teacher.get("Attendance Device ID (Biometric/RF tag ID)", "")
-            full_name = " ".join(filter(None, [first_name, middle_name, last_name])).strip()
-
-            # Initialize result entry for this instructor
-            enrollment_results[full_name] = {
-                "email": email,
-                "status": "pending",
-                "message": ""
-            }
-
-            # --- Check if Instructor already exists ---
-            existing_instructor = frappe.db.exists("Instructor", {"instructor_name": full_name})
-            if existing_instructor:
-                raise Exception(
-                    f"❌ Duplicate Instructor found: {full_name}. "
-                    f"Existing record already exists in Instructor doctype."
-                )
-
-            # --- Check existing User/Employee ---
-            existing_email = frappe.db.exists("User", {"email": email})
-            existing_phone = frappe.db.exists("User", {"mobile_no": phone})
-            existing_ID = frappe.db.exists("Employee", {"attendance_device_id": attendance_device_id})
-
-            employee_doc = None
-            if existing_ID:
-                employee_doc = frappe.get_doc("Employee", existing_ID)
-
-            user_doc = None
-            if existing_email:
-                user_doc = frappe.get_doc("User", existing_email)
-            elif existing_phone:
-                user_doc = frappe.get_doc("User", existing_phone)
-            elif existing_ID and employee_doc and employee_doc.user_id:
-                user_doc = frappe.get_doc("User", employee_doc.user_id)
-
-            # --- Duplicate checks for Email / Phone / Attendance ID ---
-            if existing_email and "Instructor" in frappe.get_roles(existing_email):
-                raise Exception(
-                    f"❌ Duplicate email found for existing user: {user_doc.name} ({email}). "
-                    f"New record attempted for: {email}"
-                )
-
-            if existing_phone and "Instructor" in frappe.get_roles(existing_phone):
-                raise Exception(
-                    f"❌ Duplicate phone number found for existing user: {user_doc.name} ({phone}). "
-                    f"New record attempted for: {phone}"
-                )
-
-            if existing_ID and employee_doc and "Instructor" in frappe.get_roles(employee_doc.user_id):
-                raise Exception(
-                    f"❌ Duplicate Attendance Device ID found for existing user: {user_doc.name} ({attendance_device_id}). "
-                    f"New record attempted for: {attendance_device_id}"
-                )
-
-            # --- Proceed to creation ---
-            gender = teacher.get("Gender", "")
-            date_of_birth = teacher.get("Date of Birth", "")
-            division = teacher.get("Division", "")
-            date_of_joining = teacher.get("Date of Joining", "")
-            bank_name = teacher.get("Bank Name", "")
-            bank_ac_no = teacher.get("Bank A/C No.", "")
-            current_address = teacher.get("Current Address", "")
-            permanent_address = teacher.get("Permanent Address", "")
-            blood_group = teacher.get("Blood Group", "")
-            qualification = teacher.get("Qualification (Education)", "")
-            pan_number = teacher.get("PAN Number", "")
-            ifsc_code = teacher.get("IFSC Code", "")
-            class_name = teacher.get("Class", "")
-
-            # Call the creation function with validation data
-            success = create_user_and_instructor(
-                full_name, first_name, middle_name, last_name, gender, phone, email, date_of_birth,
-                division, attendance_device_id, date_of_joining, bank_name, bank_ac_no, current_address,
-                permanent_address, blood_group, qualification, pan_number, ifsc_code,
-                class_name, user_doc
-            )
-
-            if success:
-                # Mark as success
-                enrollment_results[full_name]["status"] = "success"
-                enrollment_results[full_name]["message"] = f"Successfully enrolled instructor {full_name}"
-                successful_count += 1
-                print(f"✅ Bulk enrolled: {full_name} ({email})")
-
-        except Exception as e:
-            # Mark as error but continue with next instructor
-            error_msg = str(e)
-            enrollment_results[full_name]["status"] = "error"
-            enrollment_results[full_name]["message"] = error_msg
-            failed_count += 1
-            print(f"❌ Failed to enroll {full_name}: {error_msg}")
-            # Continue to next instructor without breaking the loop
-
-    # --- Commit all database changes at the end ---
-    frappe.db.commit()
+    # --- Resolve existing records for the whole upload, then create in chunks ---
+    enrollment_results, successful_count, failed_count = onboard_instructors(teachers)
 
     print(f"✅ Bulk instructor enrollment completed. Successful: {successful_count}, Failed: {failed_count}, Total processed: {len(teachers)}")
 
     # Prepare response
     enrolled_instructors = []
     failed_enrollments = []
-    
+    teachers_by_name = {}
+    for t in teachers:
+        teachers_by_name.setdefault(" ".join(filter(None, [
+            t.get("First Name", "").strip(),
+            t.get("Middle Name", "").strip(),
+            t.get("Last Name", "").strip()
+        ])), t)
+
     for name, result in enrollment_results.items():
         if result["status"] == "success":
             enrolled_instructors.append(name)
         else:
             # Find the instructor data for failed enrollments
-            instructor_data = next((t for t in teachers if 
-                " ".join(filter(None, [
-                    t.get("First Name", "").strip(),
-                    t.get("Middle Name", "").strip(),
-                    t.get("Last Name", "").strip()
-                ])) == name), {})
+            instructor_data = teachers_by_name.get(name, {})
             failed_enrollments.append({
                 "instructor_data": instructor_data,
                 "error": result["message"]
@@ -821,7 +652,7 @@ def create_user_and_instructor(full_name, first_name, middle_name, last_name, ge
         else:
             print(f"⚠️ Skipping group assignment: No Division for {full_name} ({email})")
 
-        return True
+        return instructor_doc.name
 
     except Exception as e:
         # Error handling without cleanup
@@ -909,6 +740,8 @@ import hmac
 import hashlib
 import requests
 from frappe.utils import nowdate, getdate, flt, now_datetime, get_datetime
+from school.al_ummah.payments import get_invoice_rows, get_rounding_tolerance, update_invoices_paid
+from school.al_ummah import razorpay
 
 @frappe.whitelist()
 def process_student_payment(student_id, invoice_names, mode_of_payment, paid_to_account, paid_amount, cheque_no=None, cheque_date=None):
@@ -952,37 +785,35 @@ def process_student_payment(student_id, invoice_names, mode_of_payment, paid_to_
         if not resolved_student_id:
             frappe.throw(f"No student found for ID/GR Number: {student_id}")
 
-        # Get student document for validation
-        student_doc = frappe.get_doc("Student", resolved_student_id)
-        normalized_student_id = student_doc.name
+        normalized_student_id = resolved_student_id
 
         # Validate invoices exist and belong to the student
         valid_invoices = []
         total_outstanding = 0
         
+        invoices = get_invoice_rows(invoice_names)
         for invoice_name in invoice_names:
-            try:
-                invoice = frappe.get_doc("Sales Invoice", invoice_name)
-                
-                # Check if invoice belongs to the student - compare normalized IDs
-                if invoice.student != normalized_student_id:
-                    frappe.throw(f"Invoice {invoice_name} belongs to student '{invoice.student}' but you're trying to pay for student '{normalized_student_id}'")
-                
-                # Check if invoice is unpaid
-                if invoice.outstanding_amount > 0:
-                    valid_invoices.append({
-                        "name": invoice.name,
-                        "customer": invoice.customer,
-                        "grand_total": invoice.grand_total,
-                        "outstanding_amount": invoice.outstanding_amount
-                    })
-                    total_outstanding += invoice.outstanding_amount
-                else:
-                    frappe.throw(f"Invoice {invoice_name} is already paid")
-                    
-            except frappe.DoesNotExistError:
+            invoice = invoices.get(invoice_name)
+            if not invoice:
                 frappe.throw(f"Invoice {invoice_name} not found")
 
+            # Check if invoice belongs to the student - compare normalized IDs
+            if invoice.student != normalized_student_id:
+                frappe.throw(f"Invoice {invoice_name} belongs to student '{invoice.student}' but you're trying to pay for student '{normalized_student_id}'")
+
+            # Check if invoice is unpaid
+            if invoice.outstanding_amount > 0:
+                valid_invoices.append({
+                    "name": invoice.name,
+                    "customer": invoice.customer,
+                    "company": invoice.company,
+                    "grand_total": invoice.grand_total,
+                    "outstanding_amount": invoice.outstanding_amount
+                })
+                total_outstanding += invoice.outstanding_amount
+            else:
+                frappe.throw(f"Invoice {invoice_name} is already paid")
+
         if not valid_invoices:
             frappe.throw("No valid unpaid invoices found")
         
@@ -996,7 +827,7 @@ def process_student_payment(student_id, invoice_names, mode_of_payment, paid_to_
         amount_difference = abs(paid_amount - total_outstanding)
         
         # Allow for rounding differences up to 0.10 (10 cents) or 0.1%
-        rounding_tolerance = max(0.10, total_outstanding * 0.001)  # Whichever is larger
+        rounding_tolerance = get_rounding_tolerance(total_outstanding)
         
         if amount_difference > rounding_tolerance:
             frappe.throw(f"Paid amount ({paid_amount}) does not match total outstanding amount ({total_outstanding}). Difference: {amount_difference}")
@@ -1087,37 +918,20 @@ def process_student_payment(student_id, invoice_names, mode_of_payment, paid_to_
 
 def generate_pdf_download_url(payment_entry_name):
     """
-    Generate mobile-compatible PDF download URL
+    Generate mobile-compatible PDF download URL.
+    The receipt is rendered once in the background when the Payment Entry is
+    submitted and served from the cached File (see school.al_ummah.receipts).
     """
     try:
-        from frappe.utils import get_url
-        import re
-        
+        from school.al_ummah.receipts import get_receipt_url
+
         if isinstance(payment_entry_name, dict):
             payment_entry_name = payment_entry_name.get('payment_entry')
         
         if not payment_entry_name or not frappe.db.exists("Payment Entry", payment_entry_name):
             return None
         
-        # Create a simpler URL that's more likely to work on mobile
-        pdf_url_path = f"/api/method/frappe.utils.print_format.download_pdf"
-        
-        # Build the full URL with parameters
-        from urllib.parse import urlencode
-        params = {
-            'doctype': 'Payment Entry',
-            'name': payment_entry_name,
-            'format': 'test',
-            'no_letterhead': 1,
-            'letterhead': 'No Letterhead',
-            'orientation': 'Landscape',
-            'force_download': 1
-        }
-        
-        query_string = urlencode(params)
-        full_url = f"{get_url(pdf_url_path)}?{query_string}"
-        clean_url = re.sub(r':\d+', '', full_url)
-        
+        clean_url = get_receipt_url(payment_entry_name)
         print(f"Mobile PDF URL: {clean_url}")
         return clean_url
         
@@ -1132,10 +946,12 @@ def create_payment_entry(invoice_data, mode_of_payment, paid_to_account, paid_am
         if not invoice_data or len(invoice_data) == 0:
             return {"success": False, "message": "No invoice data provided"}
 
-        first_invoice_name = invoice_data[0]["name"]
-        first_invoice = frappe.get_doc("Sales Invoice", first_invoice_name)
-        company = first_invoice.company
-        customer = first_invoice.customer
+        company = invoice_data[0].get("company")
+        customer = invoice_data[0].get("customer")
+        if not company or not customer:
+            company, customer = frappe.db.get_value(
+                "Sales Invoice", invoice_data[0]["name"], ["company", "customer"]
+            )
 
         payment_entry = frappe.new_doc("Payment Entry")
         
@@ -1196,9 +1012,7 @@ def create_payment_entry(invoice_data, mode_of_payment, paid_to_account, paid_am
         }
 
 def update_invoice_status(invoice_names):
-    for invoice_name in invoice_names:
-        frappe.db.set_value("Sales Invoice", invoice_name, "status", "Paid")
-        frappe.db.set_value("Sales Invoice", invoice_name, "outstanding_amount", 0)
+    update_invoices_paid(invoice_names)
 
 def rollback_payments(processed_invoices):
     try:
@@ -1258,14 +1072,20 @@ def get_all_paid_to_accounts():
         }
 
 @frappe.whitelist()
-def get_sales_invoices_by_student(student_id):
+def get_sales_invoices_by_student(student_id, compact=False):
     """
     Get all unpaid sales invoices for a student.
     Accepts either:
     - Student.name  (primary key)
     - GR Number (name field)
+
+    With `compact` set the invoices come without their `items`.
+    Everything is fetched with one query per table (student, groups,
+    guardians, invoices, invoice items).
     """
+    from frappe.utils import sbool
 
+    compact = sbool(compact)
     try:
         if not student_id:
             return {
@@ -1274,25 +1094,13 @@ def get_sales_invoices_by_student(student_id):
             }
 
         # -----------------------------------------------------
-        # Step 1: Resolve Student ID
+        # Step 1: Resolve Student ID and get Student Data
         # -----------------------------------------------------
 
-        resolved_student = None
         gr_num = f"GR-{student_id}"
-        
-        resolved_student = frappe.db.get_value(
-            "Student",
-            {"name": gr_num},
-            "name"
-        )
-
-        # -----------------------------------------------------
-        # Step 2: Get Student Data and Group Information
-        # -----------------------------------------------------
-
         student_data = frappe.db.get_value(
             "Student",
-            resolved_student,
+            gr_num,
             [
                 "name", 
                 "student_name", 
@@ -1302,6 +1110,17 @@ def get_sales_invoices_by_student(student_id):
             ],
             as_dict=True
         )
+        if not student_data:
+            return {
+                "success": False,
+                "message": f"No student found for ID/GR Number: {student_id}",
+                "student_input": student_id
+            }
+        resolved_student = student_data.name
+
+        # -----------------------------------------------------
+        # Step 2: Group Information
+        # -----------------------------------------------------
 
         student_groups = frappe.get_all(
             "Student Group Student",
@@ -1311,62 +1130,48 @@ def get_sales_invoices_by_student(student_id):
         )
 
         # -----------------------------------------------------
-        # Step 3: Get Guardian Information
+        # Step 3: Get Guardian Information (child table joined to Guardian)
         # -----------------------------------------------------
 
+        guardian_rows = frappe.db.sql(
+            """
+            SELECT
+                sg.guardian AS link, sg.guardian_name AS link_name, sg.relation,
+                g.name, g.guardian_name, g.email_address, g.mobile_number, g.education, g.occupation
+            FROM `tabStudent Guardian` sg
+            LEFT JOIN `tabGuardian` g ON g.name = sg.guardian
+            WHERE sg.parent = %s AND sg.parenttype = 'Student'
+            ORDER BY sg.idx
+            """,
+            (resolved_student,),
+            as_dict=True,
+        )
+
         guardian_details = []
-        
-        # Get guardians using get_doc to access child tables
-        student_doc = frappe.get_doc("Student", resolved_student)
-        
-        # Check if guardians child table exists
-        if hasattr(student_doc, 'guardians') and student_doc.guardians:
-            for guardian_rel in student_doc.guardians:
-                guardian_name = getattr(guardian_rel, 'guardian', None)
-                if not guardian_name:
-                    guardian_name = getattr(guardian_rel, 'guardian_name', None)
-                
-                if guardian_name:
-                    # Get detailed guardian information from Guardian doctype
-                    guardian_info = frappe.db.get_value(
-                        "Guardian",
-                        guardian_name,
-                        [
-                            "name",
-                            "guardian_name", 
-                            "email_address", 
-                            "mobile_number",
-                            "education",
-                            "occupation"
-                        ],
-                        as_dict=True
-                    )
-                    
-                    if guardian_info:
-                        guardian_details.append({
-                            "name": guardian_info.name,
-                            "guardian_name": guardian_info.guardian_name,
-                            "email_address": guardian_info.email_address,
-                            "mobile_number": guardian_info.mobile_number,
-                            "education": guardian_info.education,
-                            "occupation": guardian_info.occupation,
-                            "relation": getattr(guardian_rel, 'relation', 'Guardian')
-                        })
-                    else:
-                        # Fallback: use basic info from child table
-                        guardian_details.append({
-                            "name": guardian_name,
-                            "guardian_name": getattr(guardian_rel, 'guardian_name', guardian_name),
-                            "relation": getattr(guardian_rel, 'relation', 'Guardian')
-                        })
-
-        # Add all data to student_data
-        if student_data:
-            student_data["student_groups"] = student_groups
-            student_data["guardians"] = guardian_details
+        for row in guardian_rows:
+            if row.name:
+                guardian_details.append({
+                    "name": row.name,
+                    "guardian_name": row.guardian_name,
+                    "email_address": row.email_address,
+                    "mobile_number": row.mobile_number,
+                    "education": row.education,
+                    "occupation": row.occupation,
+                    "relation": row.relation
+                })
+            elif row.link or row.link_name:
+                # Fallback: use basic info from child table
+                guardian_details.append({
+                    "name": row.link or row.link_name,
+                    "guardian_name": row.link_name or row.link,
+                    "relation": row.relation
+                })
+
+        student_data["student_groups"] = student_groups
+        student_data["guardians"] = guardian_details
 
         # -----------------------------------------------------
-        # Step 4: Fetch unpaid sales invoices with items
+        # Step 4: Fetch unpaid sales invoices
         # -----------------------------------------------------
 
         invoices = frappe.get_all(
@@ -1385,15 +1190,16 @@ def get_sales_invoices_by_student(student_id):
         )
 
         # -----------------------------------------------------
-        # Step 5: Get detailed items for each invoice
+        # Step 5: Items of all invoices in one query
         # -----------------------------------------------------
 
-        for invoice in invoices:
-            # Get items for this invoice
-            items = frappe.get_all(
+        items_by_invoice = {}
+        if invoices and not compact:
+            for item in frappe.get_all(
                 "Sales Invoice Item",
-                filters={"parent": invoice.name},
+                filters={"parent": ["in", [inv.name for inv in invoices]], "parenttype": "Sales Invoice"},
                 fields=[
+                    "parent",
                     "name",
                     "item_code",
                     "item_name",
@@ -1404,10 +1210,12 @@ def get_sales_invoices_by_student(student_id):
                     "income_account"
                 ],
                 order_by="idx"
-            )
-            
-            # Add items to invoice
-            invoice["items"] = items
+            ):
+                items_by_invoice.setdefault(item.pop("parent"), []).append(item)
+
+        for invoice in invoices:
+            if not compact:
+                invoice["items"] = items_by_invoice.get(invoice.name, [])
             
             # Format currency fields for display
             invoice["grand_total_formatted"] = f"₹{float(invoice.grand_total or 0):,.2f}"
@@ -1453,12 +1261,13 @@ def get_sales_invoices_by_student(student_id):
 def verify_razorpay_payment(razorpay_payment_id, razorpay_order_id, razorpay_signature, 
                           invoice_names, student_id, paid_to_account, paid_amount):
     """
-    Verify Razorpay payment and process using unified payment entry
+    Verify Razorpay payment and process using unified payment entry.
+
+    Each payment id is claimed in Razorpay Payment Log first, so a retried
+    callback gets the stored result back instead of a second Payment Entry.
     """
     try:
-        # Get Razorpay secret key from Frappe settings
-        razorpay_settings = frappe.get_single("Razorpay Settings")
-        secret_key = razorpay_settings.get_password("api_secret")
+        key_id, secret_key = razorpay.get_credentials()
         
         if not secret_key:
             return {
@@ -1467,22 +1276,52 @@ def verify_razorpay_payment(razorpay_payment_id, razorpay_order_id, razorpay_sig
             }
         
         # Verify the signature
-        payload = f"{razorpay_order_id}|{razorpay_payment_id}"
-        generated_signature = hmac.new(
-            secret_key.encode(),
-            payload.encode(),
-            hashlib.sha256
-        ).hexdigest()
-        
-        # Compare signatures
-        if not hmac.compare_digest(generated_signature, razorpay_signature):
+        if not razorpay.is_valid_signature(razorpay_order_id, razorpay_payment_id, razorpay_signature, secret_key):
             return {
                 "success": False,
                 "message": "Invalid payment signature"
             }
 
+        claimed, stored_result = razorpay.claim_payment(razorpay_payment_id, razorpay_order_id)
+        if not claimed:
+            return stored_result
+
+    except Exception as e:
+        frappe.db.rollback()
+        frappe.log_error(f"Razorpay payment processing failed: {str(e)}")
+        return {
+            "success": False,
+            "message": f"Payment processing failed: {str(e)}"
+        }
+
+    result = process_razorpay_payment(razorpay_payment_id, razorpay_order_id, invoice_names,
+                                      student_id, paid_to_account, paid_amount)
+    razorpay.record_payment_result(razorpay_payment_id, result, result.get("resolved_student_id"))
+    return result
+
+def process_razorpay_payment(razorpay_payment_id, razorpay_order_id, invoice_names,
+                             student_id, paid_to_account, paid_amount, payment_details=None):
+    """
+    Create the Payment Entry of a verified and claimed Razorpay payment.
+    `payment_details` (the payment entity of a verified webhook) saves the API call.
+    """
+    try:
+        # a Payment Entry posted before the payment log existed
+        existing_payment_entry = frappe.db.get_value(
+            "Payment Entry", {"razorpay_payment_id": razorpay_payment_id, "docstatus": 1}, "name"
+        )
+        if existing_payment_entry:
+            return {
+                "success": True,
+                "message": "Payment processed successfully",
+                "payment_id": razorpay_payment_id,
+                "payment_entry": existing_payment_entry,
+                "pdf_download_url": generate_pdf_download_url(existing_payment_entry)
+            }
+
         # Fetch payment details from Razorpay API for additional verification
-        payment_details = get_razorpay_payment_details(razorpay_payment_id, secret_key)
+        if not payment_details:
+            payment_details = razorpay.fetch_payment(razorpay_payment_id)
         
         if not payment_details or payment_details.get('status') != 'captured':
             return {
@@ -1508,63 +1347,52 @@ def verify_razorpay_payment(razorpay_payment_id, razorpay_order_id, razorpay_sig
         resolved_student_id = None
 
         student_id = f"GR-{student_id}"
-        # Case 1 → Direct student ID exists
         if frappe.db.exists("Student", student_id):
             resolved_student_id = student_id
 
-        # Case 2 → Maybe 'student_id' is actually a GR Number
-        else:
-            resolved_student_id = frappe.db.get_value(
-                "Student",
-                {"name": student_id},
-                "name"
-            )
-
         if not resolved_student_id:
             return {
                 "success": False,
                 "message": f"No student found for ID/GR Number: {student_id}"
             }
 
-        # Get student document for validation
-        student_doc = frappe.get_doc("Student", resolved_student_id)
-        normalized_student_id = student_doc.name
+        normalized_student_id = resolved_student_id
 
         # Validate invoices exist and belong to the student
         valid_invoices = []
         total_outstanding = 0
+        invoices = get_invoice_rows(invoice_names)
         
         for invoice_name in invoice_names:
-            try:
-                invoice = frappe.get_doc("Sales Invoice", invoice_name)
-                
-                # Check if invoice belongs to the student - compare normalized IDs
-                if invoice.student != normalized_student_id:
-                    return {
-                        "success": False,
-                        "message": f"Invoice {invoice_name} belongs to student '{invoice.student}' but you're trying to pay for student '{normalized_student_id}'"
-                    }
-                
-                # Check if invoice is unpaid
-                if invoice.outstanding_amount > 0:
-                    valid_invoices.append({
-                        "name": invoice.name,
-                        "customer": invoice.customer,
-                        "grand_total": invoice.grand_total,
-                        "outstanding_amount": invoice.outstanding_amount
-                    })
-                    total_outstanding += invoice.outstanding_amount
-                else:
-                    return {
-                        "success": False,
-                        "message": f"Invoice {invoice_name} is already paid"
-                    }
-                    
-            except frappe.DoesNotExistError:
+            invoice = invoices.get(invoice_name)
+            if not invoice:
                 return {
                     "success": False,
                     "message": f"Invoice {invoice_name} not found"
                 }
+            
+            # Check if invoice belongs to the student - compare normalized IDs
+            if invoice.student != normalized_student_id:
+                return {
+                    "success": False,
+                    "message": f"Invoice {invoice_name} belongs to student '{invoice.student}' but you're trying to pay for student '{normalized_student_id}'"
+                }
+            
+            # Check if invoice is unpaid
+            if invoice.outstanding_amount > 0:
+                valid_invoices.append({
+                    "name": invoice.name,
+                    "customer": invoice.customer,
+                    "company": invoice.company,
+                    "grand_total": invoice.grand_total,
+                    "outstanding_amount": invoice.outstanding_amount
+                })
+                total_outstanding += invoice.outstanding_amount
+            else:
+                return {
+                    "success": False,
+                    "message": f"Invoice {invoice_name} is already paid"
+                }
 
         if not valid_invoices:
             return {
@@ -1582,7 +1410,7 @@ def verify_razorpay_payment(razorpay_payment_id, razorpay_order_id, razorpay_sig
         amount_difference = abs(paid_amount - total_outstanding)
         
         # Allow for rounding differences up to 0.10 (10 cents) or 0.1%
-        rounding_tolerance = max(0.10, total_outstanding * 0.001)  # Whichever is larger
+        rounding_tolerance = get_rounding_tolerance(total_outstanding)
         
         if amount_difference > rounding_tolerance:
             return {
@@ -1665,55 +1493,17 @@ def verify_razorpay_payment(razorpay_payment_id, razorpay_order_id, razorpay_sig
             "message": f"Payment processing failed: {str(e)}"
         }
 
-def get_razorpay_payment_details(payment_id, secret_key):
+def get_razorpay_payment_details(payment_id, secret_key=None):
     """
     Fetch payment details from Razorpay API
     """
-    try:
-        razorpay_settings = frappe.get_single("Razorpay Settings")
-        key_id = razorpay_settings.api_key
-        
-        auth = (key_id, secret_key)
-        response = requests.get(
-            f"https://api.razorpay.com/v1/payments/{payment_id}",
-            auth=auth,
-            timeout=10
-        )
-        
-        if response.status_code == 200:
-            return response.json()
-        else:
-            frappe.log_error(f"Razorpay API error: {response.text}")
-            return None
-            
-    except Exception as e:
-        frappe.log_error(f"Failed to fetch Razorpay payment: {str(e)}")
-        return None
+    return razorpay.fetch_payment(payment_id)
 
-def get_razorpay_order_details(order_id, secret_key):
+def get_razorpay_order_details(order_id, secret_key=None):
     """
     Fetch order details from Razorpay API
     """
-    try:
-        razorpay_settings = frappe.get_single("Razorpay Settings")
-        key_id = razorpay_settings.api_key
-        
-        auth = (key_id, secret_key)
-        response = requests.get(
-            f"https://api.razorpay.com/v1/orders/{order_id}",
-            auth=auth,
-            timeout=10
-        )
-        
-        if response.status_code == 200:
-            return response.json()
-        else:
-            frappe.log_error(f"Razorpay Order API error: {response.text}")
-            return None
-            
-    except Exception as e:
-        frappe.log_error(f"Failed to fetch Razorpay order: {str(e)}")
-        return None
+    return razorpay.fetch_order(order_id)
 
 @frappe.whitelist()
 def create_razorpay_order(invoice_names, student_id, total_amount, paid_to_account):
@@ -1721,9 +1511,11 @@ def create_razorpay_order(invoice_names, student_id, total_amount, paid_to_accou
     Create Razorpay order for the selected invoices
     """
     try:
-        razorpay_settings = frappe.get_single("Razorpay Settings")
-        secret_key = razorpay_settings.get_password("api_secret")
-        key_id = razorpay_settings.api_key
+        # form-encoded calls deliver the list as a JSON string
+        if isinstance(invoice_names, str):
+            invoice_names = json.loads(invoice_names)
+
+        key_id, secret_key = razorpay.get_credentials()
         
         if not key_id or not secret_key:
             return {
@@ -1749,16 +1541,9 @@ def create_razorpay_order(invoice_names, student_id, total_amount, paid_to_accou
         }
         
         # Create order via Razorpay API
-        auth = (key_id, secret_key)
-        response = requests.post(
-            "https://api.razorpay.com/v1/orders",
-            json=order_data,
-            auth=auth,
-            timeout=10
-        )
+        order_data = razorpay.create_order(order_data)
         
-        if response.status_code == 200:
-            order_data = response.json()
+        if order_data:
             return {
                 "success": True,
                 "order_id": order_data['id'],
@@ -1767,7 +1552,6 @@ def create_razorpay_order(invoice_names, student_id, total_amount, paid_to_accou
                 "key_id": key_id
             }
         else:
-            frappe.log_error(f"Razorpay order creation failed: {response.text}")
             return {
                 "success": False,
                 "message": "Failed to create payment order. Please check Razorpay settings."
@@ -1786,9 +1570,9 @@ def get_razorpay_settings_status():
     Check if Razorpay settings are configured
     """
     try:
-        razorpay_settings = frappe.get_single("Razorpay Settings")
-        has_key_id = bool(razorpay_settings.api_key)
-        has_secret_key = bool(razorpay_settings.get_password("api_secret"))
+        key_id, secret_key = razorpay.get_credentials()
+        has_key_id = bool(key_id)
+        has_secret_key = bool(secret_key)
         
         return {
             "success": True,
@@ -1801,4 +1585,4 @@ def get_razorpay_settings_status():
             "success": False,
             "configured": False,
             "error": str(e)
-        }
\ No newline at end of file
+        }
@@ -2,6 +2,8 @@ import frappe
 import json
 from education.education.doctype.fee_structure.fee_structure import make_fee_schedule, get_amount_distribution_based_on_fee_plan
 from frappe.utils import nowdate
+from school.al_ummah.fee_invoices import create_invoice_jobs, get_invoice_job_response
+from school.al_ummah.fee_simulation import simulate as simulate_fee_schedules
 
 @frappe.whitelist()
 def create_and_submit_fee_schedules_with_invoices(fee_structures, student_groups, student_exceptions=None):
@@ -78,7 +80,7 @@ def create_and_submit_fee_schedules_with_invoices(fee_structures, student_groups
                 "message": "No fee schedules were created"
             }
 
-        # Step 2: Create and submit sales invoices for all submitted fee schedules with exceptions handling
+        # Step 2: Queue sales invoices for all submitted fee schedules with exceptions handling
         invoice_results = []
         for schedule_name in all_created_schedules:
             result = create_and_submit_sales_invoices_for_schedule_with_exceptions(
@@ -92,7 +94,7 @@ def create_and_submit_fee_schedules_with_invoices(fee_structures, student_groups
 
         return {
             "success": True,
-            "message": f"Successfully created {len(all_created_schedules)} fee schedules and corresponding sales documents",
+            "message": f"Successfully created {len(all_created_schedules)} fee schedules; their sales documents are being generated in the background",
             "fee_schedules": all_created_schedules,
             "invoice_results": invoice_results
         }
@@ -183,246 +185,127 @@ def submit_recent_fee_schedules(fee_structure_name, expected_count):
 
 
 def create_and_submit_sales_invoices_for_schedule_with_exceptions(fee_schedule_name, student_exceptions=None):
-    """Create and submit sales invoices for a given fee schedule with student exceptions"""
-    try:
-        # Get the fee schedule document
-        fee_schedule = frappe.get_doc("Fee Schedule", fee_schedule_name)
-        
-        # Check Education Settings to see if we should create Sales Orders instead
-        create_so = frappe.db.get_single_value("Education Settings", "create_so")
-        
-        if create_so:
-            result = create_and_submit_sales_orders_for_schedule_with_exceptions(fee_schedule_name, student_exceptions)
-        else:
-            result = create_and_submit_sales_invoices_for_schedule_backend_with_exceptions(fee_schedule_name, student_exceptions)
-        
-        return result
-        
-    except Exception as e:
-        frappe.log_error(f"Sales Document Creation Error for {fee_schedule_name}: {str(e)}")
-        return {"success": False, "message": str(e)}
-
+    """Queue the sales invoices (or orders, per Education Settings) of a fee schedule with student exceptions.
 
-def create_and_submit_sales_invoices_for_schedule_backend_with_exceptions(fee_schedule_name, student_exceptions=None):
-    """Backend logic to create and submit sales invoices with fee category exceptions"""
+    The documents are generated by one background job per student group;
+    poll `fee_invoices.get_fee_schedule_invoice_status` for progress.
+    """
     try:
-        # Set status to "In Process"
-        frappe.db.set_value("Fee Schedule", fee_schedule_name, "status", "In Process")
-        
-        # Get all students from the fee schedule's student groups
-        fee_schedule = frappe.get_doc("Fee Schedule", fee_schedule_name)
-        total_records = sum([int(d.total_students) for d in fee_schedule.student_groups])
-        created_records = 0
-        submitted_invoices = []
-        
-        # Get fee structure components to understand available fee categories
-        fee_structure = frappe.get_doc("Fee Structure", fee_schedule.fee_structure)
-        all_fee_categories = [comp.fees_category for comp in fee_structure.components]
-        
-        # Process each student group
-        for student_group in fee_schedule.student_groups:
-            students = get_students_from_group(
-                student_group.student_group,
-                fee_schedule.academic_year,
-                fee_schedule.academic_term,
-                fee_schedule.student_category
-            )
-            
-            # Get exceptions for this student group
-            group_exceptions = student_exceptions.get(student_group.student_group, {}) if student_exceptions else {}
-            
-            # Create and submit sales invoice for each student with exceptions handling
-            for student in students:
-                try:
-                    # Get excluded categories for this student
-                    excluded_categories = group_exceptions.get(student.student, [])
-                    
-                    # Create invoice with only selected fee categories
-                    invoice_name = create_and_submit_single_sales_invoice_with_exceptions(
-                        fee_schedule_name, 
-                        student.student, 
-                        excluded_categories,
-                        all_fee_categories
-                    )
-                    created_records += 1
-                    submitted_invoices.append(invoice_name)
-                except Exception as e:
-                    frappe.log_error(f"Failed to create invoice for student {student.student}: {str(e)}")
-        
-        # Update fee schedule status
-        frappe.db.set_value("Fee Schedule", fee_schedule_name, "status", "Invoice Created")
-        
-        return {
-            "success": True,
-            "created_count": created_records,
-            "total_students": total_records,
-            "submitted_invoices": submitted_invoices
-        }
+        create_invoice_jobs(fee_schedule_name, student_exceptions)
+        return get_invoice_job_response(fee_schedule_name)
         
     except Exception as e:
-        # Mark as failed in case of error
+        frappe.log_error(f"Sales Document Creation Error for {fee_schedule_name}: {str(e)}")
         frappe.db.set_value("Fee Schedule", fee_schedule_name, "status", "Failed")
         frappe.db.set_value("Fee Schedule", fee_schedule_name, "error_log", str(e))
         return {"success": False, "message": str(e)}
 
 
-def create_and_submit_sales_orders_for_schedule_with_exceptions(fee_schedule_name, student_exceptions=None):
-    """Create and submit sales orders with fee category exceptions"""
-    try:
-        fee_schedule = frappe.get_doc("Fee Schedule", fee_schedule_name)
-        frappe.db.set_value("Fee Schedule", fee_schedule_name, "status", "In Process")
-        
-        total_records = sum([int(d.total_students) for d in fee_schedule.student_groups])
-        created_records = 0
-        submitted_orders = []
-        
-        # Get fee structure components
-        fee_structure = frappe.get_doc("Fee Structure", fee_schedule.fee_structure)
-        all_fee_categories = [comp.fees_category for comp in fee_structure.components]
-        
-        for student_group in fee_schedule.student_groups:
-            students = get_students_from_group(
-                student_group.student_group,
-                fee_schedule.academic_year,
-                fee_schedule.academic_term,
-                fee_schedule.student_category
-            )
-            
-            # Get exceptions for this student group
-            group_exceptions = student_exceptions.get(student_group.student_group, {}) if student_exceptions else {}
-            
-            for student in students:
-                try:
-                    # Get excluded categories for this student
-                    excluded_categories = group_exceptions.get(student.student, [])
-                    
-                    # Create order with only selected fee categories
-                    order_name = create_and_submit_single_sales_order_with_exceptions(
-                        fee_schedule_name, 
-                        student.student, 
-                        excluded_categories,
-                        all_fee_categories
-                    )
-                    created_records += 1
-                    submitted_orders.append(order_name)
-                except Exception as e:
-                    frappe.log_error(f"Failed to create sales order for {student.student}: {str(e)}")
-        
-        frappe.db.set_value("Fee Schedule", fee_schedule_name, "status", "Order Created")
-        
-        return {
-            "success": True,
-            "created_count": created_records,
-            "total_students": total_records,
-            "submitted_orders": submitted_orders
-        }
-        
-    except Exception as e:
-        frappe.db.set_value("Fee Schedule", fee_schedule_name, "status", "Failed")
-        frappe.db.set_value("Fee Schedule", fee_schedule_name, "error_log", str(e))
-        return {"success": False, "message": str(e)}
+def create_and_submit_single_sales_invoice_with_exceptions(fee_schedule_name, student_id, excluded_categories, all_fee_categories, item_fee_categories=None):
+    """Create and submit a single sales invoice for a student with fee category exceptions"""
+    invoice_doc = make_sales_document_with_exceptions(
+        "Sales Invoice", fee_schedule_name, student_id, excluded_categories, item_fee_categories
+    )
 
+    # Same defaults as Education's create_sales_invoice
+    for item in invoice_doc.items:
+        item.qty = 1
+        item.cost_center = ""
+    if frappe.db.get_single_value("Education Settings", "sales_invoice_posting_date_fee_schedule"):
+        invoice_doc.set_posting_time = 1
 
-def create_and_submit_single_sales_invoice_with_exceptions(fee_schedule_name, student_id, excluded_categories, all_fee_categories):
-    """Create and submit a single sales invoice for a student with fee category exceptions"""
-    from education.education.doctype.fee_schedule.fee_schedule import create_sales_invoice
-    
-    # Create the base sales invoice
-    invoice_name = create_sales_invoice(fee_schedule_name, student_id)
-    
-    if invoice_name and excluded_categories:
-        # Modify the invoice to remove excluded fee categories
-        invoice_doc = frappe.get_doc("Sales Invoice", invoice_name)
-        modified_items = []
-        
-        for item in invoice_doc.items:
-            # Check if this item corresponds to an excluded fee category
-            item_fee_category = get_fee_category_from_item(item.item_code, item.item_name)
-            
-            # Only include items that are not in excluded categories
-            if item_fee_category not in excluded_categories:
-                modified_items.append(item)
-            else:
-                frappe.logger().info(f"Excluding fee category {item_fee_category} for student {student_id}")
-        
-        # Replace items with filtered list
-        invoice_doc.set('items', modified_items)
-        
-        # Recalculate totals
-        invoice_doc.calculate_taxes_and_totals()
-        
-        # Save the modified invoice
-        invoice_doc.save()
-    
-    # Submit the sales invoice
-    if invoice_name:
-        invoice_doc = frappe.get_doc("Sales Invoice", invoice_name)
-        invoice_doc.submit()
-    
-    return invoice_name
+    invoice_doc.save()
+    invoice_doc.submit()
+    return invoice_doc.name
 
 
-def create_and_submit_single_sales_order_with_exceptions(fee_schedule_name, student_id, excluded_categories, all_fee_categories):
+def create_and_submit_single_sales_order_with_exceptions(fee_schedule_name, student_id, excluded_categories, all_fee_categories, item_fee_categories=None):
     """Create and submit a single sales order for a student with fee category exceptions"""
-    from education.education.doctype.fee_schedule.fee_schedule import create_sales_order
-    
-    # Create the base sales order
-    order_name = create_sales_order(fee_schedule_name, student_id)
-    
-    if order_name and excluded_categories:
-        # Modify the order to remove excluded fee categories
-        order_doc = frappe.get_doc("Sales Order", order_name)
-        modified_items = []
-        
-        for item in order_doc.items:
-            # Check if this item corresponds to an excluded fee category
-            item_fee_category = get_fee_category_from_item(item.item_code, item.item_name)
-            
-            # Only include items that are not in excluded categories
+    order_doc = make_sales_document_with_exceptions(
+        "Sales Order", fee_schedule_name, student_id, excluded_categories, item_fee_categories
+    )
+    order_doc.save()
+    order_doc.submit()
+    return order_doc.name
+
+
+def make_sales_document_with_exceptions(doctype, fee_schedule_name, student_id, excluded_categories, item_fee_categories=None):
+    """
+    Map a fee schedule to an unsaved Sales Invoice/Order for a student, leaving out excluded fee categories.
+    Exclusions are applied before the first save, so each document is saved once.
+    """
+    from education.education.doctype.fee_schedule.fee_schedule import get_customer_from_student, get_fees_mapped_doc
+
+    doc = get_fees_mapped_doc(
+        fee_schedule=fee_schedule_name,
+        doctype=doctype,
+        student_id=student_id,
+        customer=get_customer_from_student(student_id),
+    )
+
+    if excluded_categories:
+        if item_fee_categories is None:
+            item_fee_categories = get_item_fee_category_map()
+
+        items = []
+        for item in doc.items:
+            item_fee_category = get_fee_category_from_item(item.item_code, item.item_name, item_fee_categories)
             if item_fee_category not in excluded_categories:
-                modified_items.append(item)
+                items.append(item)
             else:
                 frappe.logger().info(f"Excluding fee category {item_fee_category} for student {student_id}")
-        
-        # Replace items with filtered list
-        order_doc.set('items', modified_items)
-        
-        # Recalculate totals
-        order_doc.calculate_taxes_and_totals()
-        
-        # Save the modified order
-        order_doc.save()
-    
-    # Submit the sales order
-    if order_name:
-        order_doc = frappe.get_doc("Sales Order", order_name)
-        order_doc.submit()
-    
-    return order_name
 
+        if not items:
+            frappe.throw(f"All fee categories are excluded for student {student_id}")
+        doc.set("items", items)
+
+    return doc
+
+
+def get_item_fee_category_map(fee_structure=None):
+    """
+    Map item codes to fee categories in (at most) two queries, for a whole schedule run.
+    Uses the Fee Category's item and, where Items carry one, their own fee_category (which wins).
+    """
+    filters = {}
+    if fee_structure:
+        categories = frappe.get_all(
+            "Fee Component",
+            filters={"parent": fee_structure, "parenttype": "Fee Structure"},
+            pluck="fees_category"
+        )
+        filters = {"name": ["in", categories or [""]]}
+
+    item_fee_categories = {}
+    if frappe.get_meta("Fee Category").has_field("item"):
+        for category in frappe.get_all("Fee Category", filters={**filters, "item": ["is", "set"]}, fields=["name", "item"]):
+            item_fee_categories[category.item] = category.name
+
+    if frappe.get_meta("Item").has_field("fee_category"):
+        item_filters = {"fee_category": filters["name"] if filters else ["is", "set"]}
+        for item in frappe.get_all("Item", filters=item_filters, fields=["name", "fee_category"]):
+            item_fee_categories[item.name] = item.fee_category
+
+    return item_fee_categories
 
-def get_fee_category_from_item(item_code, item_name):
+
+def get_fee_category_from_item(item_code, item_name, item_fee_categories=None):
     """
     Extract fee category from item code or name
     This function maps sales invoice items back to fee categories
     """
-    try:
-        # Method 1: Check if item has a fee category field
-        if frappe.db.exists("Item", item_code):
-            item_doc = frappe.get_doc("Item", item_code)
-            if hasattr(item_doc, 'fee_category') and item_doc.fee_category:
-                return item_doc.fee_category
-        
-        # Method 2: Extract from item name (common pattern: "Fee Category - Description")
-        if " - " in item_name:
-            return item_name.split(" - ")[0]
-        
-        # Method 3: Use item name as fallback
-        return item_name
-        
-    except Exception:
-        # Fallback to item name
-        return item_name
+    # Method 1: Look the item up in the precomputed item -> fee category map
+    if item_fee_categories is None:
+        item_fee_categories = get_item_fee_category_map()
+    if item_fee_categories.get(item_code):
+        return item_fee_categories[item_code]
+    
+    # Method 2: Extract from item name (common pattern: "Fee Category - Description")
+    if " - " in item_name:
+        return item_name.split(" - ")[0]
+    
+    # Method 3: Use item name as fallback
+    return item_name
 
 
 def get_students_from_group(student_group, academic_year, academic_term=None, student_category=None):
@@ -445,54 +328,67 @@ def get_students_from_group(student_group, academic_year, academic_term=None, st
     return students
 
 
-# Alternative approach: Create custom sales invoice function that handles exceptions from start
-# def create_custom_sales_invoice_with_selected_categories(fee_schedule_name, student_id, selected_categories):
-#     """
-#     Create sales invoice with only selected fee categories
-#     This is an alternative approach that builds the invoice from scratch
-#     """
-#     try:
-#         from education.education.doctype.fee_schedule.fee_schedule import get_customer_from_student, get_fees_mapped_doc
-        
-#         customer = get_customer_from_student(student_id)
-#         fee_schedule = frappe.get_doc("Fee Schedule", fee_schedule_name)
-        
-#         # Create base sales invoice
-#         sales_invoice_doc = get_fees_mapped_doc(
-#             fee_schedule=fee_schedule_name,
-#             doctype="Sales Invoice",
-#             student_id=student_id,
-#             customer=customer,
-#         )
-        
-#         # Filter items based on selected categories
-#         filtered_items = []
-#         for item in sales_invoice_doc.items:
-#             item_fee_category = get_fee_category_from_item(item.item_code, item.item_name)
-#             if item_fee_category in selected_categories:
-#                 item.qty = 1
-#                 item.cost_center = ""
-#                 filtered_items.append(item)
-        
-#         # Replace items with filtered list
-#         sales_invoice_doc.set('items', filtered_items)
-        
-#         # Set posting time if configured
-#         if frappe.db.get_single_value("Education Settings", "sales_invoice_posting_date_fee_schedule"):
-#             sales_invoice_doc.set_posting_time = 1
-        
-#         # Save the invoice
-#         sales_invoice_doc.save()
-        
-#         # Auto-submit if configured
-#         if frappe.db.get_single_value("Education Settings", "auto_submit_sales_invoice"):
-#             sales_invoice_doc.submit()
+@frappe.whitelist()
+def simulate_fee_schedules_with_invoices(fee_structures, student_groups, student_exceptions=None):
+    """
+    Dry run of create_and_submit_fee_schedules_with_invoices: takes the same arguments and returns
+    the per-student, per-group and per-installment totals it would invoice, without writing anything
+    """
+    try:
+        if not all([fee_structures, student_groups]):
+            return {
+                "success": False,
+                "message": "Fee Structures and Student Groups are required"
+            }
+
+        if isinstance(fee_structures, str):
+            fee_structures = json.loads(fee_structures)
         
-#         return sales_invoice_doc.name
+        if isinstance(student_groups, str):
+            student_groups = json.loads(student_groups)
         
-#     except Exception as e:
-#         frappe.log_error(f"Custom Sales Invoice Creation Error: {str(e)}")
-#         raise e
+        if student_exceptions and isinstance(student_exceptions, str):
+            student_exceptions = json.loads(student_exceptions)
+
+        for fs_data in fee_structures:
+            if not all([fs_data.get('fee_structure_name'), fs_data.get('fee_plan')]):
+                return {
+                    "success": False,
+                    "message": "Each fee structure must have fee_structure_name and fee_plan"
+                }
+
+        structure_names = [fs['fee_structure_name'] for fs in fee_structures]
+        missing_structures = set(structure_names) - set(
+            frappe.get_all("Fee Structure", filters={"name": ["in", structure_names]}, pluck="name")
+        )
+        if missing_structures:
+            return {
+                "success": False,
+                "message": f"Fee Structure {', '.join(sorted(missing_structures))} not found"
+            }
+
+        missing_groups = set(student_groups) - set(
+            frappe.get_all("Student Group", filters={"name": ["in", student_groups]}, pluck="name")
+        )
+        if missing_groups:
+            return {
+                "success": False,
+                "message": f"Student Group {', '.join(sorted(missing_groups))} not found"
+            }
+
+        return {
+            "success": True,
+            "dry_run": True,
+            **simulate_fee_schedules(fee_structures, student_groups, student_exceptions)
+        }
+
+    except Exception as e:
+        frappe.log_error(f"Fee Schedule Simulation Error: {str(e)}")
+        return {
+            "success": False,
+            "message": f"Simulation failed: {str(e)}"
+        }
+
 
 #____________________________________________
 
@@ -0,0 +1,477 @@
+import frappe
+from frappe import _
+from frappe.model.naming import parse_naming_series
+from frappe.utils import getdate, now_datetime
+
+from erpnext.setup.doctype.holiday_list.holiday_list import is_holiday
+from education.education.doctype.student_attendance.student_attendance import (
+    get_holiday_list,
+)
+
+
+ATTENDANCE_FIELDS = (
+    "name",
+    "creation",
+    "modified",
+    "owner",
+    "modified_by",
+    "docstatus",
+    "naming_series",
+    "student",
+    "student_name",
+    "course_schedule",
+    "student_group",
+    "date",
+    "status",
+)
+
+
+def get_attendance_naming_series():
+    """Return the naming series Student Attendance documents are created with."""
+    field = frappe.get_meta("Student Attendance").get_field("naming_series")
+    options = [o for o in (field.options or "").split("\n") if o] if field else []
+    return (field and field.default) or (options[0] if options else "EDU-ATT-.YYYY.-")
+
+
+def reserve_attendance_names(count):
+    """Reserve `count` consecutive names from the Student Attendance series.
+
+    Works like `frappe.model.naming.getseries` but bumps `tabSeries` once
+    for the whole block instead of once per document.
+    """
+    naming_series = get_attendance_naming_series()
+    digits = naming_series.count("#") or 5
+    prefix = parse_naming_series(naming_series.rstrip("#").rstrip("."))
+
+    current = frappe.db.sql(
+        "SELECT `current` FROM `tabSeries` WHERE `name`=%s FOR UPDATE", (prefix,)
+    )
+    if current and current[0][0] is not None:
+        start = current[0][0]
+        frappe.db.sql(
+            "UPDATE `tabSeries` SET `current` = `current` + %s WHERE `name`=%s",
+            (count, prefix),
+        )
+    else:
+        start = 0
+        frappe.db.sql(
+            "INSERT INTO `tabSeries` (`name`, `current`) VALUES (%s, %s)", (prefix, count)
+        )
+
+    return naming_series, [f"{prefix}{str(start + i).zfill(digits)}" for i in range(1, count + 1)]
+
+
+def validate_attendance_batch(student_group=None, course_schedule=None, date=None):
+    """Run the Student Attendance checks once for a whole group and date.
+
+    Mirrors the per-document validation in education's Student Attendance
+    (mandatory group, future date, academic year, holiday) and returns the
+    resolved `(student_group, date, active_students)`.
+    """
+    if course_schedule:
+        student_group, date = frappe.db.get_value(
+            "Course Schedule", course_schedule, ["student_group", "schedule_date"]
+        )
+
+    if not (student_group or course_schedule):
+        frappe.throw(_("Student Group or Course Schedule is mandatory"))
+
+    date = getdate(date)
+    if date > getdate():
+        frappe.throw(_("Attendance cannot be marked for future dates."))
+
+    academic_year = frappe.db.get_value("Student Group", student_group, "academic_year")
+    if academic_year:
+        year_start_date, year_end_date = frappe.db.get_value(
+            "Academic Year", academic_year, ["year_start_date", "year_end_date"]
+        )
+        if year_start_date and year_end_date and (
+            date < getdate(year_start_date) or date > getdate(year_end_date)
+        ):
+            frappe.throw(
+                _("Attendance cannot be marked outside of Academic Year {0}").format(academic_year)
+            )
+
+    holiday_list = get_holiday_list()
+    if holiday_list and is_holiday(holiday_list, date):
+        frappe.throw(
+            _("Attendance cannot be marked for {0} as it is a holiday.").format(
+                frappe.format(date, "Date")
+            )
+        )
+
+    active_students = set(
+        frappe.get_all(
+            "Student Group Student",
+            filters={"parent": student_group, "active": 1},
+            pluck="student",
+        )
+    )
+
+    return student_group, date, active_students
+
+
+def get_existing_attendance(students, student_group=None, course_schedule=None, date=None):
+    """Return `{student: {name, status, docstatus}}` for non-cancelled records."""
+    if not students:
+        return {}
+
+    filters = {"student": ["in", list(students)], "docstatus": ["!=", 2]}
+    if course_schedule:
+        filters["course_schedule"] = course_schedule
+    else:
+        filters.update({"student_group": student_group, "date": date})
+        filters["course_schedule"] = ["is", "not set"]
+
+    rows = frappe.get_all(
+        "Student Attendance", filters=filters, fields=["name", "student", "status", "docstatus"]
+    )
+    return {row.student: row for row in rows}
+
+
+def bulk_mark_attendance(records, course_schedule=None, student_group=None, date=None):
+    """Insert or update Student Attendance for a whole class in a few statements.
+
+    :param records: list of dicts with `student`, `student_name` and `status`.
+    :param course_schedule: Course Schedule (takes precedence over the group).
+    :param student_group: Student Group.
+    :param date: Attendance date.
+
+    New rows are written submitted (docstatus=1) with one multi-row INSERT.
+    A submitted row that already exists for the student is corrected in
+    place, one UPDATE per status, and the caller applies the counter delta
+    (`apply_bulk_attendance_to_summary`); this replaces the "attendance
+    already exists" error a second marking used to get. Draft rows go
+    through the normal submit, so their validation and hooks (counters
+    included) run. Returns the inserted, updated and submitted rows, along
+    with the status each updated row had before.
+    """
+    student_group, date, active_students = validate_attendance_batch(
+        student_group, course_schedule, date
+    )
+
+    # last entry wins when the app sends a student twice
+    by_student = {}
+    for record in records:
+        if record["student"] not in active_students:
+            frappe.throw(
+                _("Student {0}: {1} does not belong to Student Group {2}").format(
+                    record["student"], record.get("student_name"), student_group
+                )
+            )
+        by_student[record["student"]] = record
+
+    existing = get_existing_attendance(by_student, student_group, course_schedule, date)
+
+    to_insert = [r for student, r in by_student.items() if student not in existing]
+    to_update = {}
+    to_submit = []
+    changes = []
+    for student, record in by_student.items():
+        row = existing.get(student)
+        if not row:
+            continue
+        if row.docstatus == 0:
+            to_submit.append((row.name, record))
+        elif row.status != record["status"]:
+            to_update.setdefault(record["status"], []).append(row.name)
+            changes.append({"student": student, "previous_status": row.status, "status": record["status"]})
+
+    now = now_datetime()
+    user = frappe.session.user
+
+    if to_insert:
+        naming_series, names = reserve_attendance_names(len(to_insert))
+        values = [
+            (
+                name,
+                now,
+                now,
+                user,
+                user,
+                1,
+                naming_series,
+                record["student"],
+                record.get("student_name"),
+                course_schedule,
+                student_group,
+                date,
+                record["status"],
+            )
+            for name, record in zip(names, to_insert)
+        ]
+        frappe.db.bulk_insert("Student Attendance", ATTENDANCE_FIELDS, values)
+
+    for status, names in to_update.items():
+        frappe.db.sql(
+            """
+            UPDATE `tabStudent Attendance`
+            SET status=%s, modified=%s, modified_by=%s
+            WHERE name IN %s AND docstatus=1
+            """,
+            (status, now, user, tuple(names)),
+        )
+
+    for name, record in to_submit:
+        attendance = frappe.get_doc("Student Attendance", name)
+        attendance.student_name = record.get("student_name") or attendance.student_name
+        attendance.status = record["status"]
+        attendance.submit()
+
+    return {
+        "student_group": student_group,
+        "date": date,
+        "inserted": [{"student": r["student"], "status": r["status"]} for r in to_insert],
+        "updated": changes,
+        # already counted by the Student Attendance on_submit hook
+        "submitted": [{"student": r["student"], "status": r["status"]} for name, r in to_submit],
+    }
+
+
+# ---------------------- ATTENDANCE SUMMARY ---------------------- #
+# Per (student, student_group, academic_year) counters kept in
+# `Student Attendance Summary` so dashboards don't rescan attendance history.
+
+SUMMARY_FIELDS = {"Present": "present_count", "Absent": "absent_count"}
+LEAVE_FIELD = "leave_count"
+
+
+def get_summary_field(status):
+    return SUMMARY_FIELDS.get(status, LEAVE_FIELD)
+
+
+def get_summary_name(student, student_group, academic_year):
+    return f"{student}-{student_group}-{academic_year or ''}"
+
+
+def update_attendance_summary(deltas, student_group):
+    """Apply `(student, student_name, status, delta)` tuples to the counters of one group.
+
+    Rows are upserted in one statement, so a whole class costs a single query.
+    """
+    if not deltas:
+        return
+
+    academic_year = frappe.db.get_value("Student Group", student_group, "academic_year")
+
+    counters = {}
+    for student, student_name, status, delta in deltas:
+        if not status:
+            continue
+        row = counters.setdefault(
+            student, {"student_name": student_name, "present_count": 0, "absent_count": 0, LEAVE_FIELD: 0}
+        )
+        row[get_summary_field(status)] += delta
+
+    now = now_datetime()
+    user = frappe.session.user
+    values = [
+        (
+            get_summary_name(student, student_group, academic_year),
+            now,
+            now,
+            user,
+            user,
+            student,
+            row["student_name"],
+            student_group,
+            academic_year,
+            row["present_count"],
+            row["absent_count"],
+            row[LEAVE_FIELD],
+        )
+        for student, row in counters.items()
+    ]
+    placeholders = ", ".join(["(%s, %s, %s, %s, %s, 0, %s, %s, %s, %s, %s, %s, %s)"] * len(values))
+
+    frappe.db.sql(
+        f"""
+        INSERT INTO `tabStudent Attendance Summary`
+            (name, creation, modified, owner, modified_by, docstatus,
+            student, student_name, student_group, academic_year,
+            present_count, absent_count, leave_count)
+        VALUES {placeholders}
+        ON DUPLICATE KEY UPDATE
+            present_count = GREATEST(present_count + VALUES(present_count), 0),
+            absent_count = GREATEST(absent_count + VALUES(absent_count), 0),
+            leave_count = GREATEST(leave_count + VALUES(leave_count), 0),
+            student_name = COALESCE(VALUES(student_name), student_name),
+            modified = VALUES(modified),
+            modified_by = VALUES(modified_by)
+        """,
+        tuple(v for row in values for v in row),
+    )
+
+
+def apply_bulk_attendance_to_summary(result, records):
+    """Update the counters from the return value of `bulk_mark_attendance`."""
+    names = {r["student"]: r.get("student_name") for r in records}
+    deltas = [(r["student"], names.get(r["student"]), r["status"], 1) for r in result["inserted"]]
+    for change in result["updated"]:
+        deltas.append((change["student"], names.get(change["student"]), change["previous_status"], -1))
+        deltas.append((change["student"], names.get(change["student"]), change["status"], 1))
+    update_attendance_summary(deltas, result["student_group"])
+
+
+def get_attendance_student_group(doc):
+    if doc.get("student_group"):
+        return doc.student_group
+    if doc.get("course_schedule"):
+        return frappe.db.get_value("Course Schedule", doc.course_schedule, "student_group")
+
+
+def on_attendance_submit(doc, method=None):
+    student_group = get_attendance_student_group(doc)
+    if student_group:
+        update_attendance_summary([(doc.student, doc.student_name, doc.status, 1)], student_group)
+
+
+def on_attendance_cancel(doc, method=None):
+    student_group = get_attendance_student_group(doc)
+    if student_group:
+        update_attendance_summary([(doc.student, doc.student_name, doc.status, -1)], student_group)
+
+
+def on_leave_application_change(doc, method=None):
+    """Student Leave Application rewrites attendance with `set_value`, which
+    skips the Student Attendance hooks, so recount the student afterwards."""
+    recount_attendance_summary(student=doc.student)
+
+
+@frappe.whitelist()
+def rebuild_attendance_summary(student_group=None, student=None):
+    """Recompute the counters from Student Attendance and commit.
+
+    bench --site <site> execute school.al_ummah.attendance.rebuild_attendance_summary
+    """
+    frappe.only_for("System Manager")
+    result = recount_attendance_summary(student_group, student)
+    frappe.db.commit()
+    return result
+
+
+def recount_attendance_summary(student_group=None, student=None):
+    """Replace the counters of the matching rows with a fresh GROUP BY count."""
+    filters = {}
+    if student_group:
+        filters["student_group"] = student_group
+    if student:
+        filters["student"] = student
+    frappe.db.delete("Student Attendance Summary", filters)
+
+    conditions = ["sa.docstatus = 1", "sa.student_group IS NOT NULL", "sa.student_group != ''"]
+    if student_group:
+        conditions.append("sa.student_group = %(student_group)s")
+    if student:
+        conditions.append("sa.student = %(student)s")
+
+    rows = frappe.db.sql(
+        f"""
+        SELECT
+            sa.student, MAX(sa.student_name) AS student_name, sa.student_group,
+            sg.academic_year,
+            SUM(sa.status = 'Present') AS present_count,
+            SUM(sa.status = 'Absent') AS absent_count,
+            SUM(sa.status NOT IN ('Present', 'Absent')) AS leave_count
+        FROM `tabStudent Attendance` sa
+        LEFT JOIN `tabStudent Group` sg ON sg.name = sa.student_group
+        WHERE {" AND ".join(conditions)}
+        GROUP BY sa.student, sa.student_group, sg.academic_year
+        """,
+        {"student_group": student_group, "student": student},
+        as_dict=True,
+    )
+
+    now = now_datetime()
+    user = frappe.session.user
+    values = [
+        (
+            get_summary_name(r.student, r.student_group, r.academic_year),
+            now,
+            now,
+            user,
+            user,
+            0,
+            r.student,
+            r.student_name,
+            r.student_group,
+            r.academic_year,
+            int(r.present_count or 0),
+            int(r.absent_count or 0),
+            int(r.leave_count or 0),
+        )
+        for r in rows
+    ]
+    frappe.db.bulk_insert(
+        "Student Attendance Summary",
+        (
+            "name",
+            "creation",
+            "modified",
+            "owner",
+            "modified_by",
+            "docstatus",
+            "student",
+            "student_name",
+            "student_group",
+            "academic_year",
+            "present_count",
+            "absent_count",
+            "leave_count",
+        ),
+        values,
+    )
+
+    return {"rows": len(values)}
+
+
+def get_attendance_summary(students, student_group):
+    """Return `{student: counters}` for the given students of one group."""
+    if not students:
+        return {}
+
+    academic_year = frappe.db.get_value("Student Group", student_group, "academic_year")
+    rows = frappe.get_all(
+        "Student Attendance Summary",
+        filters={
+            "student": ["in", list(students)],
+            "student_group": student_group,
+            "academic_year": academic_year,
+        },
+        fields=["student", "present_count", "absent_count", "leave_count"],
+    )
+    return {row.student: row for row in rows}
+
+
+def get_group_attendance_overview(student_group, date):
+    """Return `{student: {status, present_count, absent_count, leave_count}}` for a group.
+
+    Today's status and the counters come back from one grouped query, so the
+    caller only does a dict lookup per student.
+    """
+    rows = frappe.db.sql(
+        """
+        SELECT
+            sgs.student,
+            MAX(sa.status) AS status,
+            MAX(IFNULL(sas.present_count, 0)) AS present_count,
+            MAX(IFNULL(sas.absent_count, 0)) AS absent_count,
+            MAX(IFNULL(sas.leave_count, 0)) AS leave_count
+        FROM `tabStudent Group Student` sgs
+        LEFT JOIN `tabStudent Group` sg ON sg.name = sgs.parent
+        LEFT JOIN `tabStudent Attendance Summary` sas
+            ON sas.student = sgs.student
+            AND sas.student_group = sgs.parent
+            AND IFNULL(sas.academic_year, '') = IFNULL(sg.academic_year, '')
+        LEFT JOIN `tabStudent Attendance` sa
+            ON sa.student = sgs.student
+            AND sa.student_group = sgs.parent
+            AND sa.date = %(date)s
+            AND sa.docstatus < 2
+        WHERE sgs.parent = %(student_group)s AND sgs.active = 1
+        GROUP BY sgs.student
+        """,
+        {"student_group": student_group, "date": date},
+        as_dict=True,
+    )
+    return {row.student: row for row in rows}
@@ -0,0 +1,238 @@
+"""Timing helpers for the heavier endpoints.
+
+Run against a site with `bench execute`, e.g.
+
+    bench --site <site> execute school.al_ummah.benchmarks.attendance_marking --kwargs "{'student_group': 'FIRST-A'}"
+
+Anything that writes to the database is rolled back after each run.
+"""
+
+import time
+
+import frappe
+from frappe.utils import getdate
+
+
+def _timed(fn, runs, rollback=True):
+    # read-only benchmarks pass rollback=False to keep their uncommitted fixtures between runs
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+        if rollback:
+            frappe.db.rollback()
+    return {
+        "runs": runs,
+        "best_ms": round(min(timings) * 1000, 2),
+        "avg_ms": round(sum(timings) / len(timings) * 1000, 2),
+    }
+
+
+def attendance_marking(student_group, date=None, runs=3):
+    """Per-class latency of `make_attendance_records` per student vs `bulk_mark_attendance`.
+
+    Pick a `date` on which the group has no attendance yet, otherwise the
+    per-document path trips over its own duplicate check.
+    """
+    from school.al_ummah.api2 import make_attendance_records
+    from school.al_ummah.attendance import bulk_mark_attendance
+
+    date = getdate(date)
+    students = frappe.get_all(
+        "Student Group Student",
+        filters={"parent": student_group, "active": 1},
+        fields=["student", "student_name"],
+    )
+    records = [
+        {"student": s.student, "student_name": s.student_name, "status": "Present" if i % 5 else "Absent"}
+        for i, s in enumerate(students)
+    ]
+
+    def per_document():
+        for r in records:
+            make_attendance_records(r["student"], r["student_name"], r["status"], None, student_group, date)
+
+    def bulk():
+        bulk_mark_attendance(records, None, student_group, date)
+
+    result = {
+        "students": len(records),
+        "per_document": _timed(per_document, runs),
+        "bulk": _timed(bulk, runs),
+    }
+    print(result)
+    return result
+
+
+def attendance_enrichment(students=100, days=200, runs=3):
+    """Step 5 of `get_detailed_student_data`: per-student scans vs one grouped query.
+
+    Seeds `students` x `days` attendance rows for a throwaway group inside the
+    transaction, times both variants, then rolls everything back.
+    """
+    from frappe.utils import add_days, now_datetime
+
+    from school.al_ummah.attendance import get_group_attendance_overview, recount_attendance_summary
+
+    student_group = "BENCH-" + frappe.generate_hash(length=6)
+    date = getdate()
+    now = now_datetime()
+    user = frappe.session.user
+    student_ids = [f"{student_group}-STU-{i:04d}" for i in range(students)]
+
+    frappe.db.bulk_insert(
+        "Student Group Student",
+        ("name", "creation", "modified", "owner", "modified_by", "parent", "parenttype", "parentfield",
+         "idx", "student", "student_name", "group_roll_number", "active"),
+        [
+            (frappe.generate_hash(length=10), now, now, user, user, student_group, "Student Group",
+             "students", i + 1, s, s, i + 1, 1)
+            for i, s in enumerate(student_ids)
+        ],
+    )
+    statuses = ("Present", "Present", "Present", "Absent", "Leave")
+    frappe.db.bulk_insert(
+        "Student Attendance",
+        ("name", "creation", "modified", "owner", "modified_by", "docstatus", "student",
+         "student_name", "student_group", "date", "status"),
+        [
+            (frappe.generate_hash(length=12), now, now, user, user, 1, s, s, student_group,
+             add_days(date, -d), statuses[(i + d) % len(statuses)])
+            for i, s in enumerate(student_ids)
+            for d in range(days)
+        ],
+    )
+    recount_attendance_summary(student_group=student_group)
+
+    StudentAttendance = frappe.qb.DocType("Student Attendance")
+
+    def legacy():
+        student_list = [frappe._dict(student=s) for s in student_ids]
+        today_attendance_list = (
+            frappe.qb.from_(StudentAttendance)
+            .select(StudentAttendance.student, StudentAttendance.status)
+            .where((StudentAttendance.student_group == student_group) & (StudentAttendance.date == date))
+        ).run(as_dict=True)
+        all_attendance_list = (
+            frappe.qb.from_(StudentAttendance)
+            .select(StudentAttendance.student, StudentAttendance.status)
+            .where(StudentAttendance.student_group == student_group)
+        ).run(as_dict=True)
+        for s in student_list:
+            s.status = next((a.status for a in today_attendance_list if a.student == s.student), None)
+            s.present_count = sum(1 for a in all_attendance_list if a.student == s.student and a.status == "Present")
+            s.absent_count = sum(1 for a in all_attendance_list if a.student == s.student and a.status == "Absent")
+            s.leave_count = sum(
+                1 for a in all_attendance_list if a.student == s.student and a.status not in ("Present", "Absent")
+            )
+        return student_list
+
+    def grouped():
+        student_list = [frappe._dict(student=s) for s in student_ids]
+        overview = get_group_attendance_overview(student_group, date)
+        for s in student_list:
+            row = overview.get(s.student) or {}
+            s.status = row.get("status")
+            s.present_count = row.get("present_count") or 0
+            s.absent_count = row.get("absent_count") or 0
+            s.leave_count = row.get("leave_count") or 0
+        return student_list
+
+    try:
+        expected = {(s.student, s.status, s.present_count, s.absent_count, s.leave_count) for s in legacy()}
+        actual = {(s.student, s.status, s.present_count, s.absent_count, s.leave_count) for s in grouped()}
+        result = {
+            "students": students,
+            "days": days,
+            "same_result": expected == actual,
+            "legacy": _timed(legacy, runs, rollback=False),
+            "grouped": _timed(grouped, runs, rollback=False),
+        }
+    finally:
+        frappe.db.rollback()
+
+    print(result)
+    return result
+
+
+def instructor_onboarding(count=300, runs=1):
+    """Duplicate lookups per teacher (as `bulk_enroll_instructors` used to run them) vs
+    `load_instructor_lookups`, plus a full `onboard_instructors` run of `count`
+    synthetic teachers. Nothing is committed.
+    """
+    from school.al_ummah.instructors import ATTENDANCE_DEVICE_FIELD, load_instructor_lookups, onboard_instructors
+
+    tag = frappe.generate_hash(length=6).lower()
+    teachers = [
+        {
+            "First Name": "Bench",
+            "Middle Name": tag,
+            "Last Name": f"Teacher{i:04d}",
+            "Gender": "Male" if i % 2 else "Female",
+            "Mobile": f"7{i:04d}{abs(hash(tag)) % 100000:05d}",
+            "Email": f"bench.{tag}.{i:04d}@example.com",
+            "Date of Birth": "1990-01-01",
+            ATTENDANCE_DEVICE_FIELD: f"BENCH-{tag}-{i:04d}",
+        }
+        for i in range(count)
+    ]
+
+    def per_teacher_lookups():
+        for t in teachers:
+            full_name = " ".join(filter(None, [t["First Name"], t["Middle Name"], t["Last Name"]]))
+            frappe.db.exists("Instructor", {"instructor_name": full_name})
+            email = frappe.db.exists("User", {"email": t["Email"]})
+            phone = frappe.db.exists("User", {"mobile_no": t["Mobile"]})
+            frappe.db.exists("Employee", {"attendance_device_id": t[ATTENDANCE_DEVICE_FIELD]})
+            for user in (email, phone):
+                if user:
+                    frappe.get_roles(user)
+
+    result = {
+        "instructors": count,
+        "per_teacher_lookups": _timed(per_teacher_lookups, runs),
+        "bulk_lookups": _timed(lambda: load_instructor_lookups(teachers), runs),
+    }
+
+    start = time.perf_counter()
+    try:
+        _, successful, failed = onboard_instructors(teachers, commit=False)
+        result["onboarding"] = {
+            "ms": round((time.perf_counter() - start) * 1000, 2),
+            "successful": successful,
+            "failed": failed,
+        }
+    finally:
+        frappe.db.rollback()
+
+    print(result)
+    return result
+
+
+def fee_schedule_simulation(fee_structure, fee_plan, student_groups=None, runs=3):
+    """`fee_simulation.simulate` for one fee structure over `student_groups`
+    (default: every active Student Group), with a tenth of the students
+    excluded from the structure's first fee category.
+    """
+    from school.al_ummah.fee_simulation import get_roster, simulate
+
+    student_groups = student_groups or frappe.get_all("Student Group", filters={"disabled": 0}, pluck="name")
+    academic_year = frappe.db.get_value("Fee Structure", fee_structure, "academic_year")
+    first_category = frappe.db.get_value(
+        "Fee Component", {"parent": fee_structure, "parenttype": "Fee Structure", "idx": 1}, "fees_category"
+    )
+
+    student_exceptions = {}
+    for i, member in enumerate(get_roster(student_groups, [academic_year])):
+        if i % 10 == 0:
+            student_exceptions.setdefault(member.student_group, {})[member.student] = [first_category]
+
+    fee_structures = [{"fee_structure_name": fee_structure, "fee_plan": fee_plan}]
+    summary = simulate(fee_structures, student_groups, student_exceptions)["summary"]
+    result = {
+        **summary,
+        "simulate": _timed(lambda: simulate(fee_structures, student_groups, student_exceptions), runs),
+    }
+    print(result)
+    return result
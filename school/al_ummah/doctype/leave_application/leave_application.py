@@ -13,6 +13,7 @@ from frappe.utils import date_diff, flt, get_link_to_form, getdate
 from education.education.doctype.student_attendance.student_attendance import (
 	get_holiday_list,
 )
+from school.al_ummah.attendance import update_attendance_summary
 
 
 class LeaveApplication(Document):
@@ -88,10 +89,23 @@ class LeaveApplication(Document):
 			status = "Present" if self.mark_as_present else "Leave"
 			if attendance:
 				# update existing attendance record
+				previous = frappe.db.get_value(
+					"Student Attendance", attendance, ["status", "docstatus", "student_group"], as_dict=1
+				)
 				values = dict()
 				values["status"] = status
 				values["leave_application"] = self.name
 				frappe.db.set_value("Student Attendance", attendance, values)
+
+				# set_value skips the Student Attendance hooks, keep the counters in step
+				if previous.docstatus == 1 and previous.student_group:
+					update_attendance_summary(
+						[
+							(self.student, self.student_name, previous.status, -1),
+							(self.student, self.student_name, status, 1),
+						],
+						previous.student_group,
+					)
 			else:
 				# make a new attendance record
 				doc = frappe.new_doc("Student Attendance")
@@ -111,7 +125,7 @@ class LeaveApplication(Document):
 		if self.docstatus == 2:
 			attendance = frappe.db.sql(
 				"""
-				SELECT name
+				SELECT name, status, docstatus, student_group
 				FROM `tabStudent Attendance`
 				WHERE
 					student = %s and
@@ -122,8 +136,16 @@ class LeaveApplication(Document):
 				as_dict=1,
 			)
 
-			for name in attendance:
-				frappe.db.set_value("Student Attendance", name, "docstatus", 2)
+			deltas = {}
+			for row in attendance:
+				frappe.db.set_value("Student Attendance", row.name, "docstatus", 2)
+				if row.docstatus == 1 and row.student_group:
+					deltas.setdefault(row.student_group, []).append(
+						(self.student, self.student_name, row.status, -1)
+					)
+
+			for student_group, group_deltas in deltas.items():
+				update_attendance_summary(group_deltas, student_group)
 
 
 def daterange(start_date, end_date):
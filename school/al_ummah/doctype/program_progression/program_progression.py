@@ -0,0 +1,15 @@
+# Copyright (c) 2026, Yaseen and contributors
+# For license information, please see license.txt
+
+# import frappe
+from frappe.model.document import Document
+
+from school.al_ummah.progression import clear_progression_cache
+
+
+class ProgramProgression(Document):
+	def on_update(self):
+		clear_progression_cache()
+
+	def on_trash(self):
+		clear_progression_cache()
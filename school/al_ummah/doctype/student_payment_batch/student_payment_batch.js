@@ -0,0 +1,8 @@
+// Copyright (c) 2026, Yaseen and contributors
+// For license information, please see license.txt
+
+// frappe.ui.form.on("Student Payment Batch", {
+// 	refresh(frm) {
+
+// 	},
+// });
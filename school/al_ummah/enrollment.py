@@ -0,0 +1,399 @@
+import json
+
+import frappe
+from frappe.utils import cint, sbool
+
+from school.al_ummah.qr import enqueue_qr_codes
+
+
+# rows enrolled between two commits/checkpoints
+IMPORT_CHUNK_SIZE = 25
+# uploads up to this size are still enrolled inside the request
+INLINE_IMPORT_LIMIT = 25
+
+
+def get_full_name(student):
+    return " ".join(
+        part
+        for part in (
+            (student.get("First Name") or "").strip(),
+            (student.get("Middle Name") or "").strip(),
+            (student.get("Last Name") or "").strip(),
+        )
+        if part
+    )
+
+
+def is_valid_row(student):
+    from school.al_ummah.api4 import safe_int
+
+    roll = safe_int(student.get("Roll No"))
+    return roll != float("inf") and roll > 0 and bool((student.get("GR Number") or "").strip())
+
+
+def load_enrollment_keys():
+    """Load every value a new student must not collide with, as lowercase sets.
+
+    `student_emails`, `gr_names` (Student names and GR numbers),
+    `user_emails`, `mobiles` and `usernames` - four queries in all, however
+    large the upload.
+    """
+    keys = frappe._dict(student_emails=set(), gr_names=set(), user_emails=set(), mobiles=set(), usernames=set())
+
+    gr_field = ", gr_num" if frappe.db.has_column("Student", "gr_num") else ""
+    for row in frappe.db.sql(f"SELECT name, student_email_id{gr_field} FROM `tabStudent`", as_dict=True):
+        keys.gr_names.add(row.name.lower())
+        if row.get("gr_num"):
+            keys.gr_names.add(str(row.gr_num).lower())
+        if row.student_email_id:
+            keys.student_emails.add(row.student_email_id.lower())
+
+    for row in frappe.db.sql("SELECT name, email, mobile_no, username FROM `tabUser`", as_dict=True):
+        keys.user_emails.update(e.lower() for e in (row.name, row.email) if e)
+        if row.mobile_no:
+            keys.mobiles.add(row.mobile_no)
+        if row.username:
+            keys.usernames.add(row.username.lower())
+
+    return keys
+
+
+def get_username(student):
+    return f"{(student.get('First Name') or '').lower()}{student.get('GR Number', '')}".replace(" ", "")
+
+
+def validate_enrollment_rows(students, gr_prefix="GR-", required_fields=("First Name", "Last Name"), keys=None):
+    """Check a whole upload against the database and against itself, without writing anything.
+
+    :param gr_prefix: prefix the Student name gets in front of the GR number.
+    :param required_fields: columns `enroll_student` cannot do without.
+
+    Returns `{"valid", "total_rows", "errors", "warnings"}`; each error and
+    warning is `{"row", "student_name", "field", "value", "message"}` with
+    `row` counted from 1 in upload order. Rows without a Roll No or GR
+    Number are only warned about, as the import skips them.
+    """
+    keys = keys or load_enrollment_keys()
+    errors = []
+    warnings = []
+    seen = {"email": {}, "gr": {}, "username": {}, "phone": {}}
+
+    def report(target, row, student, field, value, message):
+        target.append(
+            {"row": row, "student_name": get_full_name(student), "field": field, "value": value, "message": message}
+        )
+
+    for row, student in enumerate(students, 1):
+        if not is_valid_row(student):
+            report(warnings, row, student, "Roll No", student.get("Roll No"), "Missing Roll No or GR Number, row will be skipped")
+            continue
+
+        for field in required_fields:
+            if not (student.get(field) or "").strip():
+                report(errors, row, student, field, None, f"{field} is required")
+
+        email = (student.get("Email Address") or "").strip().lower()
+        if "@" in email:
+            if email in keys.student_emails:
+                report(errors, row, student, "Email Address", email, "A student with this email already exists")
+            elif email in keys.user_emails:
+                report(errors, row, student, "Email Address", email, "A user with this email already exists")
+            elif email in seen["email"]:
+                report(errors, row, student, "Email Address", email, f"Same email as row {seen['email'][email]}")
+            seen["email"].setdefault(email, row)
+
+        gr_name = f"{gr_prefix}{student.get('GR Number').strip()}".lower()
+        if gr_name in keys.gr_names:
+            report(errors, row, student, "GR Number", student.get("GR Number"), "A student with this GR Number already exists")
+        elif gr_name in seen["gr"]:
+            report(errors, row, student, "GR Number", student.get("GR Number"), f"Same GR Number as row {seen['gr'][gr_name]}")
+        seen["gr"].setdefault(gr_name, row)
+
+        username = get_username(student).lower()
+        if username in keys.usernames:
+            report(errors, row, student, "Username", username, "A user with this username already exists")
+        elif username in seen["username"]:
+            report(errors, row, student, "Username", username, f"Same username as row {seen['username'][username]}")
+        seen["username"].setdefault(username, row)
+
+        # a clashing mobile number is simply not set on the new User
+        phone = str(student.get("Phone Number") or "").strip()
+        if phone:
+            if phone in keys.mobiles:
+                report(warnings, row, student, "Phone Number", phone, "Mobile number already belongs to a user, it won't be set on the login")
+            elif phone in seen["phone"]:
+                report(warnings, row, student, "Phone Number", phone, f"Same mobile number as row {seen['phone'][phone]}, it won't be set on this login")
+            seen["phone"].setdefault(phone, row)
+
+    return {"valid": not errors, "total_rows": len(students), "errors": errors, "warnings": warnings}
+
+
+def check_enrollment_keys(student, full_name, gr_name, keys):
+    """Duplicate checks of `enroll_student` against preloaded `keys` instead of per-row queries."""
+    from frappe import _
+
+    email = (student.get("Email Address") or "").lower()
+    if email and (email in keys.student_emails or email in keys.user_emails):
+        frappe.throw(_("Duplicate email for: {0}, {1}").format(full_name, student.get("Email Address")))
+    if gr_name.lower() in keys.gr_names:
+        frappe.throw(_("Duplicate GR Number for: {0}, {1}").format(full_name, gr_name))
+
+
+def remember_enrollment_keys(keys, email, gr_name, phone, username):
+    """Add the values of a newly enrolled student to `keys`."""
+    keys.student_emails.add(email.lower())
+    keys.user_emails.add(email.lower())
+    keys.gr_names.add(gr_name.lower())
+    keys.usernames.add(username.lower())
+    if phone:
+        keys.mobiles.add(phone)
+
+
+@frappe.whitelist()
+def validate_enrollment_sheet(students, gr_prefix="GR-"):
+    """Pre-flight report for an upload, see `validate_enrollment_rows`."""
+    frappe.only_for("Administrator")
+    if isinstance(students, str):
+        students = json.loads(students)
+    return validate_enrollment_rows(students, gr_prefix=gr_prefix)
+
+
+def create_enrollment_import(program, student_group, students, generate_qr_code):
+    """Store an upload as a Student Enrollment Import; only valid rows are kept, sorted by Roll No."""
+    from school.al_ummah.api4 import safe_int
+
+    rows = [s for s in students if is_valid_row(s)]
+    for s in students:
+        if not is_valid_row(s):
+            print("Skipping invalid row:", s)
+    rows.sort(key=lambda s: safe_int(s.get("Roll No")))
+
+    edu_settings = frappe.get_single("Education Settings")
+    enrollment_import = frappe.get_doc(
+        {
+            "doctype": "Student Enrollment Import",
+            "program": program,
+            "student_group": student_group,
+            "academic_year": edu_settings.current_academic_year,
+            "academic_term": edu_settings.current_academic_term,
+            "generate_qr_code": cint(sbool(generate_qr_code)),
+            "status": "Queued",
+            "total_rows": len(rows),
+            "rows": json.dumps(rows),
+            "results": "[]",
+        }
+    ).insert(ignore_permissions=True)
+    enrollment_import.skipped_rows = len(students) - len(rows)
+    return enrollment_import
+
+
+def enqueue_enrollment_import(name):
+    frappe.enqueue(
+        "school.al_ummah.enrollment.process_enrollment_import",
+        queue="long",
+        timeout=3600,
+        job_id=f"student_enrollment_import::{name}",
+        deduplicate=True,
+        enqueue_after_commit=True,
+        name=name,
+    )
+
+
+def add_group_member(student_group, student, student_name, roll_no, idx):
+    """Insert a Student Group Student row directly, in the current transaction.
+
+    `idx` places the row in the group's table, so callers pass the group's
+    current last idx plus one.
+    """
+    frappe.get_doc(
+        {
+            "doctype": "Student Group Student",
+            "parent": student_group,
+            "parenttype": "Student Group",
+            "parentfield": "students",
+            "idx": idx,
+            "student": student,
+            "student_name": student_name,
+            "group_roll_number": roll_no,
+            "active": 1,
+        }
+    ).db_insert()
+
+
+def process_enrollment_import(name):
+    """Enroll the rows of a Student Enrollment Import in chunks.
+
+    Each chunk is committed together with the import's checkpoint
+    (`processed_rows`) and per-row results, so a failed or interrupted
+    import resumes at the first uncommitted row. A failing row is rolled
+    back to its savepoint and reported; the rest of the chunk carries on.
+    """
+    from school.al_ummah.api4 import enroll_student
+
+    enrollment_import = frappe.get_doc("Student Enrollment Import", name)
+    if enrollment_import.status == "Completed":
+        return
+
+    rows = json.loads(enrollment_import.rows or "[]")
+    results = json.loads(enrollment_import.results or "[]")
+    start = cint(enrollment_import.processed_rows)
+    counts = {
+        "successful": cint(enrollment_import.successful),
+        "failed": cint(enrollment_import.failed),
+        "added_to_group": cint(enrollment_import.added_to_group),
+    }
+
+    enrollment_import.db_set({"status": "Running", "error": None})
+    frappe.db.commit()
+
+    try:
+        keys = load_enrollment_keys()
+        group_students = frappe.get_all(
+            "Student Group Student",
+            filters={"parent": enrollment_import.student_group, "parenttype": "Student Group"},
+            fields=["student", "group_roll_number", "idx"],
+        )
+        group_student_ids = {d.student for d in group_students}
+        next_roll = max([d.group_roll_number or 0 for d in group_students], default=0)
+        next_idx = max([d.idx or 0 for d in group_students], default=0)
+
+        for chunk_start in range(start, len(rows), IMPORT_CHUNK_SIZE):
+            for index in range(chunk_start, min(chunk_start + IMPORT_CHUNK_SIZE, len(rows))):
+                student = rows[index]
+                full_name = get_full_name(student)
+                result = {
+                    "row": index,
+                    "student_name": full_name,
+                    "email": student.get("Email Address", ""),
+                    "student": None,
+                    "status": "error",
+                    "message": "",
+                }
+
+                frappe.db.savepoint("enroll_row")
+                try:
+                    enrolled = enroll_student(
+                        student,
+                        enrollment_import.program,
+                        enrollment_import.student_group,
+                        enrollment_import.academic_year,
+                        enrollment_import.academic_term,
+                        # QR codes are made for the whole import once it is done
+                        0,
+                        keys=keys,
+                    )
+                    student_id = enrolled["student"]
+                    if student_id not in group_student_ids:
+                        next_roll += 1
+                        next_idx += 1
+                        add_group_member(
+                            enrollment_import.student_group, student_id, full_name, next_roll, next_idx
+                        )
+                        group_student_ids.add(student_id)
+                        counts["added_to_group"] += 1
+
+                    result["student"] = student_id
+                    result["status"] = "success"
+                    result["message"] = (
+                        f"Successfully enrolled and added to {enrollment_import.program} - {enrollment_import.student_group}"
+                    )
+                except Exception as e:
+                    frappe.db.rollback(save_point="enroll_row")
+                    result["message"] = str(e)
+
+                counts["successful" if result["status"] == "success" else "failed"] += 1
+                results.append(result)
+                print(f"{'✅' if result['status'] == 'success' else '❌'} Row {index + 1}: {full_name} {result['message']}")
+                frappe.publish_realtime(
+                    "student_enrollment_progress",
+                    {"import": name, **result, "progress": [index + 1, len(rows)]},
+                    user=enrollment_import.owner,
+                )
+
+            # checkpoint: the chunk's documents and its results are committed together
+            enrollment_import.db_set(
+                {"processed_rows": len(results), "results": json.dumps(results), **counts},
+                update_modified=False,
+            )
+            frappe.db.commit()
+
+        enrollment_import.db_set("status", "Completed")
+        if enrollment_import.generate_qr_code:
+            enqueue_qr_codes([r["student"] for r in results if r["status"] == "success"])
+        frappe.db.commit()
+        print(f"✅ Enrollment import {name} completed. Successful: {counts['successful']}, Failed: {counts['failed']}")
+
+    except Exception as e:
+        frappe.db.rollback()
+        frappe.log_error(frappe.get_traceback(), "Bulk Enroll Failed")
+        enrollment_import.db_set({"status": "Failed", "error": str(e)[:1000]})
+        frappe.db.commit()
+        raise
+
+
+def get_enrollment_import_response(name, skipped_rows=0):
+    """Progress and results of an import, in the shape `bulk_enroll_students` has always returned."""
+    enrollment_import = frappe.get_doc("Student Enrollment Import", name)
+    rows = json.loads(enrollment_import.rows or "[]")
+    results = json.loads(enrollment_import.results or "[]")
+
+    enrollment_results = {}
+    enrolled_students = []
+    failed_enrollments = []
+    for result in results:
+        enrollment_results[result["student_name"]] = {
+            "email": result["email"],
+            "status": result["status"],
+            "message": result["message"],
+        }
+        if result["status"] == "success":
+            enrolled_students.append(result["student_name"])
+        else:
+            failed_enrollments.append({"student_data": rows[result["row"]], "error": result["message"]})
+
+    if enrollment_import.status == "Completed":
+        message = (
+            f"Enrollment completed: {enrollment_import.successful} successful, "
+            f"{enrollment_import.failed} failed out of {enrollment_import.total_rows} students"
+        )
+    elif enrollment_import.status == "Failed":
+        message = f"Enrollment stopped after {enrollment_import.processed_rows} of {enrollment_import.total_rows} students: {enrollment_import.error}"
+    else:
+        message = f"Enrollment of {enrollment_import.total_rows} students is running in the background"
+
+    return {
+        "success": enrollment_import.status != "Failed",
+        "message": message,
+        "import": enrollment_import.name,
+        "status": enrollment_import.status,
+        "enrollment_results": enrollment_results,
+        "enrolled_students": enrolled_students,
+        "failed_enrollments": failed_enrollments,
+        "summary": {
+            "total_processed": cint(enrollment_import.processed_rows),
+            "total_rows": cint(enrollment_import.total_rows),
+            "skipped_rows": skipped_rows,
+            "successful": cint(enrollment_import.successful),
+            "failed": cint(enrollment_import.failed),
+            "added_to_group": cint(enrollment_import.added_to_group),
+        },
+    }
+
+
+@frappe.whitelist()
+def get_enrollment_import_status(name):
+    frappe.only_for("Administrator")
+    return get_enrollment_import_response(name)
+
+
+@frappe.whitelist()
+def resume_enrollment_import(name):
+    """Re-queue an interrupted or failed import; it continues from its last checkpoint."""
+    frappe.only_for("Administrator")
+    status = frappe.db.get_value("Student Enrollment Import", name, "status")
+    if status == "Completed":
+        frappe.throw(f"Enrollment import {name} is already completed.")
+
+    frappe.db.set_value("Student Enrollment Import", name, "status", "Queued")
+    enqueue_enrollment_import(name)
+    return get_enrollment_import_response(name)
@@ -0,0 +1,328 @@
+"""Sales Invoices (or Orders) for a Fee Schedule, generated by one background job per student group."""
+
+import json
+
+import frappe
+from frappe.utils import add_to_date, cint, now_datetime
+
+
+# invoice jobs of one Fee Schedule that may be queued or running at once
+FEE_INVOICE_CONCURRENCY = 3
+
+# students whose documents are committed together
+FEE_INVOICE_CHUNK_SIZE = 20
+
+# a job with no checkpoint for this long has lost its worker (the job timeout is 3600s)
+STALE_INVOICE_JOB_MINUTES = 65
+
+
+def get_document_type():
+    return "Sales Order" if frappe.db.get_single_value("Education Settings", "create_so") else "Sales Invoice"
+
+
+def create_invoice_jobs(fee_schedule_name, student_exceptions=None):
+    """Create a Fee Schedule Invoice Job per student group of a submitted Fee Schedule and start them.
+
+    :param student_exceptions: `{student_group: {student: [excluded fee category, ...]}}`.
+    """
+    fee_schedule = frappe.get_doc("Fee Schedule", fee_schedule_name)
+    document_type = get_document_type()
+
+    for row in fee_schedule.student_groups:
+        frappe.get_doc(
+            {
+                "doctype": "Fee Schedule Invoice Job",
+                "fee_schedule": fee_schedule_name,
+                "student_group": row.student_group,
+                "document_type": document_type,
+                "status": "Pending",
+                "total_students": cint(row.total_students),
+                "exceptions": json.dumps((student_exceptions or {}).get(row.student_group) or {}),
+                "results": "{}",
+            }
+        ).insert(ignore_permissions=True)
+
+    frappe.db.set_value("Fee Schedule", fee_schedule_name, {"status": "In Process", "error_log": None})
+    start_invoice_jobs(fee_schedule_name)
+
+
+def start_invoice_jobs(fee_schedule):
+    """Queue Pending jobs of a Fee Schedule while fewer than FEE_INVOICE_CONCURRENCY are active."""
+    # serialises the jobs of one schedule that finish at the same time
+    frappe.db.get_value("Fee Schedule", fee_schedule, "name", for_update=True)
+
+    active = frappe.db.count(
+        "Fee Schedule Invoice Job", {"fee_schedule": fee_schedule, "status": ["in", ["Queued", "Running"]]}
+    )
+    pending = frappe.get_all(
+        "Fee Schedule Invoice Job",
+        filters={"fee_schedule": fee_schedule, "status": "Pending"},
+        order_by="creation asc",
+        limit=max(FEE_INVOICE_CONCURRENCY - active, 0),
+        pluck="name",
+    )
+    for name in pending:
+        frappe.db.set_value("Fee Schedule Invoice Job", name, "status", "Queued")
+        enqueue_invoice_job(name)
+
+
+def enqueue_invoice_job(name):
+    frappe.enqueue(
+        "school.al_ummah.fee_invoices.process_invoice_job",
+        queue="long",
+        timeout=3600,
+        job_id=f"fee_schedule_invoice_job::{name}",
+        deduplicate=True,
+        enqueue_after_commit=True,
+        name=name,
+    )
+
+
+def create_document(document_type, fee_schedule, student, excluded_categories, all_fee_categories, item_fee_categories):
+    from school.al_ummah.api5 import (
+        create_and_submit_single_sales_invoice_with_exceptions,
+        create_and_submit_single_sales_order_with_exceptions,
+    )
+
+    if document_type == "Sales Order":
+        return create_and_submit_single_sales_order_with_exceptions(
+            fee_schedule, student, excluded_categories, all_fee_categories, item_fee_categories
+        )
+    return create_and_submit_single_sales_invoice_with_exceptions(
+        fee_schedule, student, excluded_categories, all_fee_categories, item_fee_categories
+    )
+
+
+def process_invoice_job(name):
+    """Create and submit the documents of one student group, committing per chunk.
+
+    Results are kept per student and committed with the chunk's documents,
+    so a rerun (resume or retry) only handles students without a
+    successful result. A failing student is rolled back to its savepoint
+    and reported; the others carry on.
+    """
+    from school.al_ummah.api5 import get_item_fee_category_map, get_students_from_group
+
+    job = frappe.get_doc("Fee Schedule Invoice Job", name)
+    if job.status == "Completed" and not cint(job.failed):
+        finish_invoice_job(job)
+        return
+
+    fee_schedule = frappe.get_doc("Fee Schedule", job.fee_schedule)
+    exceptions = json.loads(job.exceptions or "{}")
+    results = json.loads(job.results or "{}")
+
+    job.db_set({"status": "Running", "error": None})
+    frappe.db.commit()
+
+    try:
+        students = get_students_from_group(
+            job.student_group,
+            fee_schedule.academic_year,
+            fee_schedule.academic_term,
+            fee_schedule.student_category,
+        )
+        all_fee_categories = frappe.get_all(
+            "Fee Component",
+            filters={"parent": fee_schedule.fee_structure, "parenttype": "Fee Structure"},
+            pluck="fees_category",
+        )
+        # only needed to apply exclusions; built once for the whole group
+        item_fee_categories = get_item_fee_category_map(fee_schedule.fee_structure) if exceptions else {}
+        todo = [s for s in students if (results.get(s.student) or {}).get("status") != "success"]
+        save_job_results(job, len(students), results)
+
+        for chunk_start in range(0, len(todo), FEE_INVOICE_CHUNK_SIZE):
+            for student in todo[chunk_start : chunk_start + FEE_INVOICE_CHUNK_SIZE]:
+                result = {"student_name": student.student_name, "status": "error", "document": None, "error": None}
+
+                frappe.db.savepoint("fee_invoice")
+                try:
+                    result["document"] = create_document(
+                        job.document_type,
+                        job.fee_schedule,
+                        student.student,
+                        exceptions.get(student.student) or [],
+                        all_fee_categories,
+                        item_fee_categories,
+                    )
+                    result["status"] = "success"
+                except Exception as e:
+                    frappe.db.rollback(save_point="fee_invoice")
+                    result["error"] = str(e)
+                    frappe.log_error(f"Failed to create {job.document_type} for student {student.student}: {str(e)}")
+
+                results[student.student] = result
+
+            # checkpoint: the chunk's documents and its results are committed together
+            save_job_results(job, len(students), results)
+            frappe.db.commit()
+            publish_progress(job.fee_schedule, job.owner)
+
+        job.db_set("status", "Completed")
+        frappe.db.commit()
+        print(f"✅ {job.document_type}s for {job.student_group}: {job.successful} created, {job.failed} failed")
+
+    except Exception as e:
+        frappe.db.rollback()
+        frappe.log_error(frappe.get_traceback(), "Fee Schedule Invoice Job Failed")
+        job.db_set({"status": "Failed", "error": str(e)[:1000]})
+        frappe.db.commit()
+
+    finish_invoice_job(job)
+
+
+def save_job_results(job, total_students, results):
+    job.db_set(
+        {
+            "total_students": total_students,
+            "processed_students": len(results),
+            "successful": sum(1 for r in results.values() if r["status"] == "success"),
+            "failed": sum(1 for r in results.values() if r["status"] != "success"),
+            "results": json.dumps(results),
+        },
+    )
+
+
+def finish_invoice_job(job):
+    """Start the next Pending job and, once every job has run, settle the Fee Schedule's status."""
+    start_invoice_jobs(job.fee_schedule)
+
+    jobs = frappe.get_all(
+        "Fee Schedule Invoice Job", filters={"fee_schedule": job.fee_schedule}, fields=["status", "failed"]
+    )
+    if all(j.status in ("Completed", "Failed") for j in jobs):
+        failed_jobs = sum(1 for j in jobs if j.status == "Failed")
+        failed_students = sum(cint(j.failed) for j in jobs)
+        if failed_jobs or failed_students:
+            frappe.db.set_value(
+                "Fee Schedule",
+                job.fee_schedule,
+                {
+                    "status": "Failed",
+                    "error_log": f"{failed_students} student(s) and {failed_jobs} student group(s) failed; "
+                    "use retry_failed_invoices to retry them",
+                },
+            )
+        else:
+            status = "Order Created" if job.document_type == "Sales Order" else "Invoice Created"
+            frappe.db.set_value("Fee Schedule", job.fee_schedule, {"status": status, "error_log": None})
+
+    frappe.db.commit()
+    publish_progress(job.fee_schedule, job.owner, reload=True)
+
+
+def get_schedule_progress(fee_schedule):
+    jobs = frappe.get_all(
+        "Fee Schedule Invoice Job",
+        filters={"fee_schedule": fee_schedule},
+        fields=[
+            "name",
+            "student_group",
+            "document_type",
+            "status",
+            "total_students",
+            "processed_students",
+            "successful",
+            "failed",
+            "results",
+            "error",
+        ],
+        order_by="creation asc",
+    )
+    total = sum(cint(j.total_students) for j in jobs)
+    processed = sum(cint(j.processed_students) for j in jobs)
+    return jobs, total, processed
+
+
+def publish_progress(fee_schedule, user, reload=False):
+    # same event (and payload) as Education's own Fee Schedule progress bar
+    jobs, total, processed = get_schedule_progress(fee_schedule)
+    data = {"progress": str(int(processed * 100 / total)) if total else "100"}
+    if reload:
+        data["reload"] = 1
+    frappe.publish_realtime("fee_schedule_progress", data, user=user)
+
+
+def get_invoice_job_response(fee_schedule):
+    jobs, total, processed = get_schedule_progress(fee_schedule)
+    documents = []
+    failed_students = []
+    for job in jobs:
+        for student, result in json.loads(job.pop("results") or "{}").items():
+            if result["status"] == "success":
+                documents.append(result["document"])
+            else:
+                failed_students.append({"student": student, "student_group": job.student_group, **result})
+
+    document_type = jobs[0].document_type if jobs else get_document_type()
+    return {
+        "success": not any(j.status == "Failed" for j in jobs),
+        "fee_schedule": fee_schedule,
+        "status": frappe.db.get_value("Fee Schedule", fee_schedule, "status"),
+        "document_type": document_type,
+        "created_count": len(documents),
+        "failed_count": len(failed_students),
+        "processed": processed,
+        "total_students": total,
+        "submitted_orders" if document_type == "Sales Order" else "submitted_invoices": documents,
+        "failed_students": failed_students,
+        "jobs": jobs,
+    }
+
+
+@frappe.whitelist()
+def get_fee_schedule_invoice_status(fee_schedule):
+    frappe.has_permission("Fee Schedule", "read", doc=fee_schedule, throw=True)
+    return get_invoice_job_response(fee_schedule)
+
+
+@frappe.whitelist()
+def retry_failed_invoices(fee_schedule):
+    """Re-run the failed students and student groups of a Fee Schedule; created documents are kept.
+
+    Only jobs that have finished are retried; a job still running keeps its worker.
+    """
+    frappe.has_permission("Fee Schedule", "write", doc=fee_schedule, throw=True)
+
+    jobs = frappe.get_all(
+        "Fee Schedule Invoice Job",
+        filters={"fee_schedule": fee_schedule, "status": ["in", ["Completed", "Failed"]]},
+        or_filters={"status": "Failed", "failed": [">", 0]},
+        pluck="name",
+    )
+    if not jobs:
+        frappe.throw(f"Fee Schedule {fee_schedule} has nothing to retry.")
+
+    for name in jobs:
+        frappe.db.set_value("Fee Schedule Invoice Job", name, {"status": "Pending", "error": None})
+    frappe.db.set_value("Fee Schedule", fee_schedule, {"status": "In Process", "error_log": None})
+    start_invoice_jobs(fee_schedule)
+    frappe.db.commit()
+    return get_invoice_job_response(fee_schedule)
+
+
+def resume_stale_invoice_jobs():
+    """Scheduler entry point: restart jobs whose worker was killed or lost.
+
+    Every checkpoint updates a job's `modified`, so a Queued or Running job
+    untouched for STALE_INVOICE_JOB_MINUTES is no longer being worked on. It
+    goes back to Pending and resumes after its last checkpoint.
+    """
+    stale_jobs = frappe.get_all(
+        "Fee Schedule Invoice Job",
+        filters={
+            "status": ["in", ["Queued", "Running"]],
+            "modified": ["<", add_to_date(now_datetime(), minutes=-STALE_INVOICE_JOB_MINUTES)],
+        },
+        fields=["name", "fee_schedule"],
+    )
+    for job in stale_jobs:
+        frappe.db.set_value(
+            "Fee Schedule Invoice Job",
+            job.name,
+            {"status": "Pending", "error": f"Resumed after {STALE_INVOICE_JOB_MINUTES} minutes without progress"},
+        )
+    for fee_schedule in {job.fee_schedule for job in stale_jobs}:
+        start_invoice_jobs(fee_schedule)
+    frappe.db.commit()
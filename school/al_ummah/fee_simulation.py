@@ -0,0 +1,179 @@
+"""Dry run of fee schedule and invoice generation: the totals it would produce, with no documents written."""
+
+import json
+from collections import defaultdict
+
+import frappe
+from frappe.utils import flt
+
+
+def get_roster(student_groups, academic_years):
+    """Active members of `student_groups` with a submitted Program Enrollment in `academic_years`, in one query."""
+    if not student_groups or not academic_years:
+        return []
+    return frappe.db.sql(
+        """
+        SELECT sgs.parent AS student_group, pe.student, pe.student_name,
+            pe.academic_year, pe.academic_term, pe.student_category
+        FROM `tabStudent Group Student` sgs
+        INNER JOIN `tabProgram Enrollment` pe ON pe.student = sgs.student
+        WHERE sgs.parent IN %(groups)s AND sgs.parenttype = 'Student Group' AND sgs.active = 1
+            AND pe.docstatus = 1 AND pe.academic_year IN %(years)s
+        ORDER BY sgs.parent, sgs.group_roll_number
+        """,
+        {"groups": tuple(student_groups), "years": tuple(academic_years)},
+        as_dict=True,
+    )
+
+
+def get_installment_shares(structure, components, fee_plan, due_dates=None):
+    """Due date and share of the structure total of each installment of `fee_plan`."""
+    from education.education.doctype.fee_structure.fee_structure import (
+        get_amount_distribution_based_on_fee_plan,
+    )
+
+    distribution = get_amount_distribution_based_on_fee_plan(
+        components=json.dumps(
+            [
+                {"fees_category": c.fees_category, "total": c.total, "amount": c.amount, "discount": c.discount}
+                for c in components
+            ]
+        ),
+        total_amount=structure.total_amount,
+        fee_plan=fee_plan,
+        academic_year=structure.academic_year,
+    )["distribution"]
+
+    if due_dates and len(due_dates) != len(distribution):
+        frappe.throw(
+            f"Number of due dates ({len(due_dates)}) must match number of distributions ({len(distribution)})"
+        )
+
+    total = flt(structure.total_amount) or sum(flt(d.get("amount")) for d in distribution) or 1
+    return [
+        {"due_date": due_dates[i] if due_dates else d.get("due_date"), "share": flt(d.get("amount")) / total}
+        for i, d in enumerate(distribution)
+    ]
+
+
+def simulate(fee_structures, student_groups, student_exceptions=None):
+    """Totals per student, student group and installment for the given fee structures and groups.
+
+    Each structure's fee categories form one amount vector and each
+    installment one share of it; a student's invoices are that vector with
+    their excluded categories masked out. Students with the same
+    exclusions share one computed result, so a school without exceptions
+    costs one calculation per structure however many students it has.
+    """
+    student_exceptions = student_exceptions or {}
+    names = [fs["fee_structure_name"] for fs in fee_structures]
+
+    structures = {
+        s.name: s
+        for s in frappe.get_all(
+            "Fee Structure",
+            filters={"name": ["in", names]},
+            fields=["name", "academic_year", "academic_term", "student_category", "total_amount"],
+        )
+    }
+    components = defaultdict(list)
+    for c in frappe.get_all(
+        "Fee Component",
+        filters={"parent": ["in", names], "parenttype": "Fee Structure"},
+        fields=["parent", "fees_category", "amount", "discount", "total"],
+        order_by="idx asc",
+    ):
+        components[c.parent].append(c)
+
+    roster = get_roster(student_groups, {s.academic_year for s in structures.values()})
+
+    results = []
+    summary = {"students": set(), "invoices": 0, "total_amount": 0.0, "excluded_amount": 0.0}
+    for fs in fee_structures:
+        structure = structures[fs["fee_structure_name"]]
+        categories = [c.fees_category for c in components[structure.name]]
+        amounts = [flt(c.total) or flt(c.amount) for c in components[structure.name]]
+        installments = get_installment_shares(
+            structure, components[structure.name], fs["fee_plan"], fs.get("due_dates")
+        )
+        # installment x category amounts, rounded as each invoice line would be
+        matrix = [[flt(amount * i["share"], 2) for amount in amounts] for i in installments]
+
+        cache = {}
+
+        def charge(excluded):
+            key = frozenset(excluded)
+            if key not in cache:
+                mask = [category not in key for category in categories]
+                per_installment = [flt(sum(a for a, keep in zip(row, mask) if keep), 2) for row in matrix]
+                cache[key] = {
+                    "total": flt(sum(per_installment), 2),
+                    "excluded_amount": flt(sum(a for a, keep in zip(amounts, mask) if not keep), 2),
+                    "installments": per_installment,
+                    "invoices": len(per_installment) if any(mask) else 0,
+                }
+            return cache[key]
+
+        students = []
+        groups = {}
+        installment_totals = [0.0] * len(installments)
+        for member in roster:
+            if member.academic_year != structure.academic_year:
+                continue
+            if structure.academic_term and member.academic_term != structure.academic_term:
+                continue
+            if structure.student_category and member.student_category != structure.student_category:
+                continue
+
+            group_exceptions = student_exceptions.get(member.student_group) or {}
+            excluded = [c for c in group_exceptions.get(member.student) or [] if c in categories]
+            charged = charge(excluded)
+            students.append(
+                {
+                    "student": member.student,
+                    "student_name": member.student_name,
+                    "student_group": member.student_group,
+                    "excluded_categories": excluded,
+                    **charged,
+                }
+            )
+
+            group = groups.setdefault(
+                member.student_group, {"student_group": member.student_group, "students": 0, "total": 0.0}
+            )
+            group["students"] += 1
+            group["total"] = flt(group["total"] + charged["total"], 2)
+            for i, amount in enumerate(charged["installments"]):
+                installment_totals[i] += amount
+
+            summary["students"].add(member.student)
+            summary["invoices"] += charged["invoices"]
+            summary["total_amount"] += charged["total"]
+            summary["excluded_amount"] += charged["excluded_amount"]
+
+        results.append(
+            {
+                "fee_structure": structure.name,
+                "fee_plan": fs["fee_plan"],
+                "fee_categories": dict(zip(categories, amounts)),
+                "installments": [
+                    {"installment": i + 1, "due_date": inst["due_date"], "total": flt(installment_totals[i], 2)}
+                    for i, inst in enumerate(installments)
+                ],
+                "student_groups": [
+                    groups.get(sg) or {"student_group": sg, "students": 0, "total": 0.0} for sg in student_groups
+                ],
+                "students": students,
+                "total": flt(sum(s["total"] for s in students), 2),
+            }
+        )
+
+    return {
+        "fee_structures": results,
+        "summary": {
+            "students": len(summary["students"]),
+            "invoices": summary["invoices"],
+            "total_amount": flt(summary["total_amount"], 2),
+            "excluded_amount": flt(summary["excluded_amount"], 2),
+        },
+    }
@@ -0,0 +1,307 @@
+import base64
+import hashlib
+import os
+from functools import lru_cache
+from io import BytesIO
+from urllib.parse import unquote, urlparse
+
+import frappe
+import requests
+
+
+# bytes read per step when streaming a file into base64; a multiple of 3 so
+# every chunk encodes without padding
+READ_CHUNK_SIZE = 3 * 64 * 1024
+
+THUMBNAIL_CACHE_SIZE = 512
+
+
+def get_site_relative_url(file_url):
+    """Strip this site's host from `file_url`; external URLs come back unchanged."""
+    if not file_url or not file_url.startswith("http"):
+        return file_url
+
+    parsed = urlparse(file_url)
+    site = urlparse(frappe.utils.get_url())
+    if parsed.hostname in (site.hostname, frappe.local.site):
+        return parsed.path
+    return file_url
+
+
+def get_local_file_path(file_url):
+    """Resolve a `/files/...` or `/private/files/...` URL to a path on disk.
+
+    Uses the File doc when there is one, otherwise maps the URL onto the
+    site's public/private files folder. Returns None for anything else.
+    """
+    file_url = get_site_relative_url(file_url)
+    if not file_url or file_url.startswith("http"):
+        return None
+
+    file_name = frappe.db.get_value("File", {"file_url": file_url}, "name")
+    if file_name:
+        try:
+            return frappe.get_doc("File", file_name).get_full_path()
+        except Exception:
+            pass
+
+    file_url = unquote(file_url)
+    if file_url.startswith("/private/files/"):
+        is_private, file_name = 1, file_url[len("/private/files/") :]
+    elif file_url.startswith("/files/"):
+        is_private, file_name = 0, file_url[len("/files/") :]
+    else:
+        return None
+
+    # don't let "../" in a URL escape the public/private files folder it names
+    files_root = os.path.realpath(frappe.utils.get_files_path(is_private=is_private))
+    path = os.path.realpath(frappe.utils.get_files_path(file_name, is_private=is_private))
+    if not path.startswith(files_root + os.sep):
+        return None
+    return path
+
+
+def encode_file_base64(path):
+    """Base64-encode a file by streaming it from disk in fixed-size chunks."""
+    parts = []
+    with open(path, "rb") as f:
+        while chunk := f.read(READ_CHUNK_SIZE):
+            parts.append(base64.b64encode(chunk))
+    return b"".join(parts).decode("utf-8")
+
+
+def read_file_base64(file_url):
+    """Return the base64 content of a site file without any HTTP round trip.
+
+    Only URLs on other hosts are still downloaded (with a timeout).
+    """
+    if not file_url:
+        return None
+
+    path = get_local_file_path(file_url)
+    if path:
+        if not os.path.exists(path):
+            return None
+        return encode_file_base64(path)
+
+    if file_url.startswith("http"):
+        try:
+            response = requests.get(file_url, timeout=10)
+        except requests.exceptions.RequestException:
+            return None
+        if response.status_code == 200:
+            return base64.b64encode(response.content).decode("utf-8")
+
+    return None
+
+
+@lru_cache(maxsize=THUMBNAIL_CACHE_SIZE)
+def build_thumbnail_base64(path, mtime, max_size, quality):
+    # `mtime` is only part of the cache key, so a replaced file is re-encoded
+    from PIL import Image
+
+    with Image.open(path) as img:
+        if img.mode in ("RGBA", "P"):
+            img = img.convert("RGB")
+        img.thumbnail(max_size, Image.Resampling.LANCZOS)
+
+        buffer = BytesIO()
+        img.save(buffer, format="JPEG", optimize=True, quality=quality)
+
+    return base64.b64encode(buffer.getvalue()).decode("utf-8")
+
+
+def get_thumbnail_base64(file_url, max_size=(300, 300), quality=70, data_uri=False):
+    """Return a compressed JPEG thumbnail of a site image as base64.
+
+    Encoded thumbnails are kept in a per-process LRU cache keyed by the
+    file's path and mtime, so repeated requests for the same photo skip
+    both the disk read and the resize.
+    """
+    path = get_local_file_path(file_url)
+    if not path or not os.path.exists(path):
+        return None
+
+    try:
+        encoded = build_thumbnail_base64(path, os.path.getmtime(path), tuple(max_size), quality)
+    except Exception as e:
+        frappe.log_error(f"Thumbnail generation failed for {file_url}: {e}", "get_thumbnail_base64")
+        return None
+
+    return "data:image/jpeg;base64," + encoded if data_uri else encoded
+
+
+
+# Derived thumbnails
+# ------------------
+# Square thumbnails of profile photos are written under the site's public
+# files at upload time, so list APIs can hand out small URLs instead of the
+# original (up to 5MB) uploads.
+
+THUMBNAIL_DOCTYPES = ("Student", "Guardian", "Instructor")
+THUMBNAIL_SIZES = (64, 128, 256)
+DEFAULT_THUMBNAIL_SIZE = 128
+THUMBNAIL_QUALITY = 75
+THUMBNAIL_FOLDER = "thumbnails"
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".gif", ".bmp")
+
+
+@lru_cache(maxsize=1)
+def get_thumbnail_format():
+    """WebP when this PIL build can write it, JPEG otherwise."""
+    from PIL import features
+
+    return ("WEBP", "webp") if features.check("webp") else ("JPEG", "jpg")
+
+
+def get_thumbnail_size(size=None):
+    """Smallest configured size that is at least `size` pixels."""
+    try:
+        size = int(size or DEFAULT_THUMBNAIL_SIZE)
+    except (TypeError, ValueError):
+        size = DEFAULT_THUMBNAIL_SIZE
+    return next((s for s in THUMBNAIL_SIZES if s >= size), THUMBNAIL_SIZES[-1])
+
+
+def get_thumbnail_file_url(file_url, size):
+    """Public URL of the `size` thumbnail of `file_url` (whether it exists or not)."""
+    file_url = get_site_relative_url(file_url)
+    stem = os.path.splitext(os.path.basename(unquote(urlparse(file_url).path)))[0]
+    # the hash keeps thumbnails of same-named uploads in different folders apart
+    digest = hashlib.sha1(file_url.encode("utf-8")).hexdigest()[:10]
+    return f"/files/{THUMBNAIL_FOLDER}/{size}/{stem}-{digest}.{get_thumbnail_format()[1]}"
+
+
+def get_thumbnail_path(file_url, size):
+    return frappe.utils.get_files_path(get_thumbnail_file_url(file_url, size)[len("/files/") :])
+
+
+def is_image_url(file_url):
+    return bool(file_url) and os.path.splitext(urlparse(file_url).path)[1].lower() in IMAGE_EXTENSIONS
+
+
+def is_private_url(file_url):
+    return bool(file_url) and get_site_relative_url(file_url).startswith("/private/")
+
+
+def generate_thumbnails(file_url, force=False):
+    """Write every configured thumbnail size of a public site image.
+
+    Thumbnails are public files, so private images never get one.
+    Thumbnails newer than the source are kept unless `force` is set.
+    Returns the number of thumbnails written.
+    """
+    from PIL import Image, ImageOps
+
+    if is_private_url(file_url):
+        return 0
+
+    source = get_local_file_path(file_url)
+    if not source or not os.path.exists(source) or not is_image_url(file_url):
+        return 0
+
+    source_mtime = os.path.getmtime(source)
+    targets = {}
+    for size in THUMBNAIL_SIZES:
+        path = get_thumbnail_path(file_url, size)
+        if force or not os.path.exists(path) or os.path.getmtime(path) < source_mtime:
+            targets[size] = path
+    if not targets:
+        return 0
+
+    image_format, _ = get_thumbnail_format()
+    with Image.open(source) as img:
+        # phone cameras store rotation in EXIF; bake it in before cropping
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ("RGB", "RGBA") or image_format == "JPEG":
+            img = img.convert("RGB")
+
+        # largest first, each smaller size is resampled from the previous one
+        for size in sorted(targets, reverse=True):
+            img = ImageOps.fit(img, (size, size), Image.Resampling.LANCZOS)
+            path = targets[size]
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            img.save(tmp_path, format=image_format, quality=THUMBNAIL_QUALITY, optimize=True)
+            os.replace(tmp_path, path)
+
+    return len(targets)
+
+
+def get_thumbnail_url(file_url, size=None):
+    """Thumbnail URL for a profile image, or the original URL if none was made yet."""
+    if not file_url or not is_image_url(file_url) or is_private_url(file_url):
+        return file_url
+
+    thumbnail_url = get_thumbnail_file_url(file_url, get_thumbnail_size(size))
+    if os.path.exists(frappe.utils.get_files_path(thumbnail_url[len("/files/") :])):
+        return thumbnail_url
+    return file_url
+
+
+def add_thumbnail_urls(rows, image_field, size=None, target_field="thumbnail_url"):
+    """Set `target_field` on each row to the thumbnail URL of `row[image_field]`."""
+    for row in rows:
+        row[target_field] = get_thumbnail_url(row.get(image_field), size)
+    return rows
+
+
+def is_profile_image_file(doc):
+    """Whether a File is the profile photo of a student, guardian or instructor (not e.g. a QR code)."""
+    if doc.attached_to_doctype not in THUMBNAIL_DOCTYPES or not is_image_url(doc.file_url):
+        return False
+    if doc.attached_to_field:
+        return doc.attached_to_field == "image"
+    return frappe.db.get_value(doc.attached_to_doctype, doc.attached_to_name, "image") == doc.file_url
+
+
+def on_file_insert(doc, method=None):
+    """Generate thumbnails for profile photos of students, guardians and instructors."""
+    if not doc.is_private and is_profile_image_file(doc):
+        frappe.enqueue(
+            "school.al_ummah.files.generate_thumbnails",
+            queue="short",
+            file_url=doc.file_url,
+            enqueue_after_commit=True,
+        )
+
+
+def on_file_trash(doc, method=None):
+    if not is_profile_image_file(doc):
+        return
+    # identical uploads share one file_url (and so one set of thumbnails)
+    if frappe.db.exists("File", {"file_url": doc.file_url, "name": ["!=", doc.name]}):
+        return
+    remove_thumbnails(doc.file_url)
+
+
+def remove_thumbnails(file_url):
+    for size in THUMBNAIL_SIZES:
+        path = get_thumbnail_path(file_url, size)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def backfill_thumbnails():
+    """Generate missing thumbnails for every existing public profile image."""
+    file_urls = set()
+    for doctype in THUMBNAIL_DOCTYPES:
+        file_urls.update(frappe.get_all(doctype, filters={"image": ["is", "set"]}, pluck="image"))
+
+    generated = 0
+    for file_url in file_urls:
+        if is_private_url(file_url):
+            continue
+        try:
+            generated += generate_thumbnails(file_url)
+        except Exception as e:
+            frappe.log_error(f"Thumbnail generation failed for {file_url}: {e}", "backfill_thumbnails")
+    return generated
+
+
+def remove_private_thumbnails():
+    """Delete public thumbnails that earlier versions wrote for private profile images."""
+    for doctype in THUMBNAIL_DOCTYPES:
+        for file_url in frappe.get_all(doctype, filters={"image": ["like", "%/private/%"]}, pluck="image"):
+            if is_private_url(file_url):
+                remove_thumbnails(file_url)
@@ -0,0 +1,242 @@
+import frappe
+
+
+# instructors created between two commits
+INSTRUCTOR_CHUNK_SIZE = 50
+
+ATTENDANCE_DEVICE_FIELD = "Attendance Device ID (Biometric/RF tag ID)"
+
+
+def get_full_name(teacher):
+    return " ".join(
+        filter(None, [teacher.get("First Name", ""), teacher.get("Middle Name", ""), teacher.get("Last Name", "")])
+    ).strip()
+
+
+def load_instructor_lookups(teachers):
+    """Resolve the existing records an upload can collide with, in five queries.
+
+    Returns a dict of
+    - `instructor_names`: full names that already have an Instructor,
+    - `users_by_email` / `users_by_phone`: User name per email / mobile,
+    - `employees_by_device`: `{attendance_device_id: user_id}`,
+    - `instructor_users`: Users that already have the Instructor role,
+    - `groups_by_name`: Student Group name per `student_group_name`.
+    """
+    names = list({get_full_name(t) for t in teachers} - {""})
+    emails = list({t.get("Email") for t in teachers if t.get("Email")})
+    phones = list({t.get("Mobile") for t in teachers if t.get("Mobile")})
+    device_ids = list({t.get(ATTENDANCE_DEVICE_FIELD) for t in teachers if t.get(ATTENDANCE_DEVICE_FIELD)})
+    divisions = list({t.get("Division") for t in teachers if t.get("Division")})
+
+    lookups = frappe._dict(
+        instructor_names=set(),
+        users_by_email={},
+        users_by_phone={},
+        employees_by_device={},
+        instructor_users=set(),
+        groups_by_name={},
+    )
+
+    if names:
+        lookups.instructor_names = set(
+            frappe.get_all("Instructor", filters={"instructor_name": ["in", names]}, pluck="instructor_name")
+        )
+
+    if emails or phones:
+        for user in frappe.db.sql(
+            """
+            SELECT name, email, mobile_no FROM `tabUser`
+            WHERE email IN %(emails)s OR mobile_no IN %(phones)s
+            """,
+            {"emails": emails or [""], "phones": phones or [""]},
+            as_dict=True,
+        ):
+            if user.email:
+                lookups.users_by_email.setdefault(user.email, user.name)
+            if user.mobile_no:
+                lookups.users_by_phone.setdefault(user.mobile_no, user.name)
+
+    if device_ids:
+        for employee in frappe.get_all(
+            "Employee",
+            filters={"attendance_device_id": ["in", device_ids]},
+            fields=["attendance_device_id", "user_id"],
+        ):
+            lookups.employees_by_device.setdefault(employee.attendance_device_id, employee.user_id)
+
+    users = (
+        set(lookups.users_by_email.values())
+        | set(lookups.users_by_phone.values())
+        | set(filter(None, lookups.employees_by_device.values()))
+    )
+    if users:
+        lookups.instructor_users = set(
+            frappe.get_all(
+                "Has Role",
+                filters={"parenttype": "User", "parent": ["in", list(users)], "role": "Instructor"},
+                pluck="parent",
+            )
+        )
+
+    if divisions:
+        for group in frappe.get_all(
+            "Student Group", filters={"student_group_name": ["in", divisions]}, fields=["name", "student_group_name"]
+        ):
+            lookups.groups_by_name.setdefault(group.student_group_name, group.name)
+
+    return lookups
+
+
+def resolve_existing_user(teacher, full_name, lookups):
+    """Apply the duplicate rules of `bulk_enroll_instructors` to one row using `lookups`.
+
+    Returns the existing User to reuse (or None) and raises when the row
+    would duplicate an instructor.
+    """
+    email = teacher.get("Email", "")
+    phone = teacher.get("Mobile", "")
+    device_id = teacher.get(ATTENDANCE_DEVICE_FIELD, "")
+
+    if full_name in lookups.instructor_names:
+        raise Exception(
+            f"❌ Duplicate Instructor found: {full_name}. "
+            f"Existing record already exists in Instructor doctype."
+        )
+
+    email_user = lookups.users_by_email.get(email) if email else None
+    phone_user = lookups.users_by_phone.get(phone) if phone else None
+    has_employee = bool(device_id) and device_id in lookups.employees_by_device
+    employee_user = lookups.employees_by_device.get(device_id) if device_id else None
+    user = email_user or phone_user or employee_user
+
+    if email_user and email_user in lookups.instructor_users:
+        raise Exception(
+            f"❌ Duplicate email found for existing user: {user} ({email}). "
+            f"New record attempted for: {email}"
+        )
+    if phone_user and phone_user in lookups.instructor_users:
+        raise Exception(
+            f"❌ Duplicate phone number found for existing user: {user} ({phone}). "
+            f"New record attempted for: {phone}"
+        )
+    if has_employee and employee_user in lookups.instructor_users:
+        raise Exception(
+            f"❌ Duplicate Attendance Device ID found for existing user: {user} ({device_id}). "
+            f"New record attempted for: {device_id}"
+        )
+
+    return user
+
+
+def remember_instructor(teacher, full_name, user, lookups):
+    """Record a newly created instructor so later rows of the upload see it as existing."""
+    user = user or teacher.get("Email")
+    lookups.instructor_names.add(full_name)
+    lookups.instructor_users.add(user)
+    if teacher.get("Email"):
+        lookups.users_by_email.setdefault(teacher["Email"], user)
+    if teacher.get("Mobile"):
+        lookups.users_by_phone.setdefault(teacher["Mobile"], user)
+    if teacher.get(ATTENDANCE_DEVICE_FIELD):
+        lookups.employees_by_device.setdefault(teacher[ATTENDANCE_DEVICE_FIELD], user)
+
+
+def assign_instructors_to_groups(assignments):
+    """Append instructors to their Student Groups with one save per group.
+
+    :param assignments: `{student_group: [instructor, ...]}`.
+    """
+    for group_name, instructors in assignments.items():
+        try:
+            student_group = frappe.get_doc("Student Group", group_name)
+            assigned = {row.instructor for row in student_group.instructors}
+            new = [i for i in instructors if i not in assigned]
+            if new:
+                for instructor in new:
+                    student_group.append("instructors", {"instructor": instructor})
+                student_group.save()
+                print(f"✅ {len(new)} instructor(s) assigned to division: {group_name}")
+        except Exception as e:
+            print(f"⚠️ Could not add instructors to division '{group_name}': {e}")
+
+
+def onboard_instructors(teachers, commit=True):
+    """Create Users, Employees and Instructors for an upload in chunks.
+
+    Existing records are resolved for the whole upload up front
+    (`load_instructor_lookups`); each row runs inside a savepoint so a
+    failure only undoes that row, and every chunk ends with its Student
+    Group assignments and a commit.
+
+    Returns `(enrollment_results, successful_count, failed_count)` where
+    `enrollment_results` maps full name to `{"email", "status", "message"}`.
+    """
+    from school.al_ummah.api4 import create_user_and_instructor
+
+    lookups = load_instructor_lookups(teachers)
+    enrollment_results = {}
+    successful_count = 0
+    failed_count = 0
+
+    for start in range(0, len(teachers), INSTRUCTOR_CHUNK_SIZE):
+        assignments = {}
+        for teacher in teachers[start : start + INSTRUCTOR_CHUNK_SIZE]:
+            full_name = get_full_name(teacher)
+            email = teacher.get("Email", "")
+            enrollment_results[full_name] = {"email": email, "status": "pending", "message": ""}
+
+            frappe.db.savepoint("onboard_instructor")
+            try:
+                user = resolve_existing_user(teacher, full_name, lookups)
+                instructor = create_user_and_instructor(
+                    full_name,
+                    teacher.get("First Name", ""),
+                    teacher.get("Middle Name", ""),
+                    teacher.get("Last Name", ""),
+                    teacher.get("Gender", ""),
+                    teacher.get("Mobile", ""),
+                    email,
+                    teacher.get("Date of Birth", ""),
+                    # divisions are assigned per chunk below
+                    "",
+                    teacher.get(ATTENDANCE_DEVICE_FIELD, ""),
+                    teacher.get("Date of Joining", ""),
+                    teacher.get("Bank Name", ""),
+                    teacher.get("Bank A/C No.", ""),
+                    teacher.get("Current Address", ""),
+                    teacher.get("Permanent Address", ""),
+                    teacher.get("Blood Group", ""),
+                    teacher.get("Qualification (Education)", ""),
+                    teacher.get("PAN Number", ""),
+                    teacher.get("IFSC Code", ""),
+                    teacher.get("Class", ""),
+                    frappe._dict(name=user) if user else None,
+                )
+
+                division = teacher.get("Division", "")
+                if division and division in lookups.groups_by_name:
+                    assignments.setdefault(lookups.groups_by_name[division], []).append(instructor)
+                elif division:
+                    print(f"⚠️ Could not add instructor to division '{division}': Student Group not found")
+                else:
+                    print(f"⚠️ Skipping group assignment: No Division for {full_name} ({email})")
+
+                remember_instructor(teacher, full_name, user, lookups)
+                enrollment_results[full_name]["status"] = "success"
+                enrollment_results[full_name]["message"] = f"Successfully enrolled instructor {full_name}"
+                successful_count += 1
+                print(f"✅ Bulk enrolled: {full_name} ({email})")
+
+            except Exception as e:
+                frappe.db.rollback(save_point="onboard_instructor")
+                enrollment_results[full_name]["status"] = "error"
+                enrollment_results[full_name]["message"] = str(e)
+                failed_count += 1
+                print(f"❌ Failed to enroll {full_name}: {e}")
+
+        assign_instructors_to_groups(assignments)
+        if commit:
+            frappe.db.commit()
+
+    return enrollment_results, successful_count, failed_count
@@ -0,0 +1,350 @@
+import json
+
+import frappe
+from frappe.utils import add_to_date, now_datetime
+
+
+# Outbox rows are retried with exponential backoff:
+# 1, 2, 4, 8 minutes ... until MAX_ATTEMPTS is reached and the row is marked Failed.
+MAX_ATTEMPTS = 5
+RETRY_BACKOFF_SECONDS = 60
+BATCH_SIZE = 200
+STALE_SENDING_MINUTES = 15
+
+OUTBOX_FIELDS = (
+    "name",
+    "creation",
+    "modified",
+    "owner",
+    "modified_by",
+    "docstatus",
+    "channel",
+    "recipient",
+    "subject",
+    "message",
+    "payload",
+    "status",
+    "attempts",
+    "next_attempt_at",
+    "reference_doctype",
+    "reference_name",
+)
+
+
+def queue_notifications(notifications, reference_doctype=None, reference_name=None):
+    """Write notifications to the outbox and schedule a background drain.
+
+    :param notifications: list of dicts with `channel` (Push/Email/SMS),
+        `recipient`, `subject`, `message` and an optional `payload` dict.
+
+    Rows are inserted in the caller's transaction, so they are committed
+    together with whatever triggered them; the drain job only starts after
+    that commit.
+    """
+    if not notifications:
+        return 0
+
+    now = now_datetime()
+    user = frappe.session.user
+    values = [
+        (
+            frappe.generate_hash(length=10),
+            now,
+            now,
+            user,
+            user,
+            0,
+            n["channel"],
+            n["recipient"],
+            n.get("subject"),
+            n.get("message"),
+            json.dumps(n["payload"]) if n.get("payload") else None,
+            "Queued",
+            0,
+            now,
+            reference_doctype,
+            reference_name,
+        )
+        for n in notifications
+    ]
+    frappe.db.bulk_insert("Notification Outbox", OUTBOX_FIELDS, values)
+    enqueue_outbox()
+    return len(values)
+
+
+def enqueue_outbox():
+    frappe.enqueue(
+        "school.al_ummah.notifications.process_outbox",
+        queue="short",
+        enqueue_after_commit=True,
+    )
+
+
+def get_retry_delay(attempts):
+    return RETRY_BACKOFF_SECONDS * (2 ** max(attempts - 1, 0))
+
+
+def process_outbox(batch_size=BATCH_SIZE):
+    """Send due outbox rows, batch by batch until none are left.
+
+    Runs as a background job (one per `queue_notifications` call) and from
+    the scheduler. Overlapping runs are safe: each sends only the rows its
+    own claim got.
+    """
+    while send_outbox_batch(batch_size) == batch_size:
+        pass
+
+
+def send_outbox_batch(batch_size=BATCH_SIZE):
+    """Claim and send one batch of due rows; returns how many due rows were found."""
+    now = now_datetime()
+    names = frappe.get_all(
+        "Notification Outbox",
+        filters={"status": "Queued", "next_attempt_at": ["<=", now]},
+        order_by="creation asc",
+        limit=batch_size,
+        pluck="name",
+    )
+    if not names:
+        return 0
+
+    # claim the batch under this run's token and send only the rows the claim got,
+    # so an overlapping run doesn't send the same rows twice
+    claim = frappe.generate_hash(length=10)
+    frappe.db.sql(
+        """
+        UPDATE `tabNotification Outbox` SET status='Sending', claim=%s, modified=%s
+        WHERE name IN %s AND status='Queued'
+        """,
+        (claim, now, tuple(names)),
+    )
+    frappe.db.commit()
+
+    rows = frappe.get_all(
+        "Notification Outbox",
+        filters={"claim": claim, "status": "Sending"},
+        fields=["name", "channel", "recipient", "subject", "message", "payload", "attempts"],
+        order_by="creation asc",
+    )
+
+    # push and SMS rows go out together in provider-sized chunks, emails one by one
+    sent = {}
+    push_rows = [row for row in rows if row.channel == "Push"]
+    if push_rows:
+        sent.update(send_push_rows(push_rows))
+
+    sms_rows = [row for row in rows if row.channel == "SMS"]
+    if sms_rows:
+        sent.update(send_sms_rows(sms_rows))
+
+    for row in rows:
+        if row.channel in ("Push", "SMS"):
+            continue
+        try:
+            send_outbox_row(row)
+            sent[row.name] = None
+        except Exception as e:
+            mark_failed_attempt(row, e)
+
+    mark_sent(sent)
+    frappe.db.commit()
+    return len(names)
+
+
+def mark_sent(sent):
+    """Mark rows as sent; `sent` maps row name to the provider reference (or None)."""
+    if not sent:
+        return
+
+    now = now_datetime()
+    references = {name: ref for name, ref in sent.items() if ref}
+    reference_case = "provider_reference"
+    params = []
+    if references:
+        reference_case = "CASE name " + " ".join(["WHEN %s THEN %s"] * len(references)) + " ELSE provider_reference END"
+        params = [v for item in references.items() for v in item]
+
+    frappe.db.sql(
+        f"""
+        UPDATE `tabNotification Outbox`
+        SET status='Sent', sent_at=%s, modified=%s, attempts=attempts + 1, last_error=NULL,
+            provider_reference={reference_case}
+        WHERE name IN %s
+        """,
+        tuple([now, now] + params + [tuple(sent)]),
+    )
+
+
+def mark_failed_attempt(row, error, permanent=False):
+    attempts = (row.attempts or 0) + 1
+    values = {"attempts": attempts, "last_error": str(error)[:1000]}
+    if permanent or attempts >= MAX_ATTEMPTS:
+        values["status"] = "Failed"
+    else:
+        values["status"] = "Queued"
+        values["next_attempt_at"] = add_to_date(now_datetime(), seconds=get_retry_delay(attempts))
+    frappe.db.set_value("Notification Outbox", row.name, values, update_modified=True)
+    print(f"❌ {row.channel} notification to {row.recipient} failed (attempt {attempts}): {error}")
+
+
+def send_push_rows(rows):
+    """Send all push rows of a batch through Expo; returns `{name: ticket_id}` for the accepted ones."""
+    from school.al_ummah.push import build_message, is_device_not_registered, send_push_messages
+
+    messages = []
+    for row in rows:
+        payload = json.loads(row.payload) if row.payload else {}
+        messages.append(build_message(row.recipient, row.subject, row.message, payload.get("data")))
+
+    sent = {}
+    for row, ticket in zip(rows, send_push_messages(messages)):
+        if ticket.get("status") == "ok":
+            sent[row.name] = ticket.get("id")
+        else:
+            # DeviceNotRegistered tokens were just removed from User Device, don't retry them
+            mark_failed_attempt(row, ticket.get("message") or ticket, permanent=is_device_not_registered(ticket))
+    return sent
+
+
+def send_sms_rows(rows):
+    """Send all SMS rows of a batch as MSG91 Flow calls, one per template and chunk.
+
+    The payload may carry `template_id` and `variables`; rows without them
+    use the absence template with the student's name as `var1`.
+    Returns `{name: request_id}` for the accepted rows.
+    """
+    from school.al_ummah.sms import MSG91_ABSENCE_TEMPLATE_ID, get_mobile, send_flow_sms
+
+    by_template = {}
+    for row in rows:
+        payload = json.loads(row.payload) if row.payload else {}
+        template_id = payload.get("template_id") or MSG91_ABSENCE_TEMPLATE_ID
+        variables = payload.get("variables") or {"var1": payload.get("student_name")}
+        by_template.setdefault(template_id, []).append((row, {"mobiles": get_mobile(row.recipient), **variables}))
+
+    sent = {}
+    for template_id, entries in by_template.items():
+        results = send_flow_sms(template_id, [recipient for _, recipient in entries])
+        for (row, _), result in zip(entries, results):
+            if result["status"] == "Sent":
+                sent[row.name] = result["request_id"]
+            else:
+                mark_failed_attempt(row, result["error"])
+    return sent
+
+
+def send_outbox_row(row):
+    """Dispatch one email outbox row; raises when it could not be queued."""
+    if row.channel == "Email":
+        frappe.sendmail(recipients=[row.recipient], subject=row.subject, message=row.message)
+    else:
+        raise Exception(f"Unknown channel {row.channel}")
+
+
+def retry_outbox():
+    """Scheduler entry point: requeue rows stuck in Sending and drain what is due.
+
+    A stuck row counts as an attempt, so a row that keeps killing its worker
+    ends up Failed after MAX_ATTEMPTS instead of being retried forever.
+    """
+    now = now_datetime()
+    stale = add_to_date(now, minutes=-STALE_SENDING_MINUTES)
+    error = f"Still sending after {STALE_SENDING_MINUTES} minutes"
+    frappe.db.sql(
+        """
+        UPDATE `tabNotification Outbox` SET status='Failed', attempts=attempts + 1, last_error=%s, modified=%s
+        WHERE status='Sending' AND modified < %s AND attempts >= %s
+        """,
+        (error, now, stale, MAX_ATTEMPTS - 1),
+    )
+    frappe.db.sql(
+        """
+        UPDATE `tabNotification Outbox` SET status='Queued', attempts=attempts + 1, last_error=%s,
+            next_attempt_at=%s, modified=%s
+        WHERE status='Sending' AND modified < %s
+        """,
+        (error, now, now, stale),
+    )
+    frappe.db.commit()
+    process_outbox()
+
+
+def check_push_receipts():
+    """Scheduler entry point: read Expo receipts for recently sent push rows.
+
+    Expo only reports `DeviceNotRegistered` for some tokens in the receipt,
+    so this is where most stale User Device rows get cleaned up.
+    """
+    from school.al_ummah.push import fetch_push_receipts
+
+    rows = frappe.get_all(
+        "Notification Outbox",
+        filters={
+            "channel": "Push",
+            "status": "Sent",
+            "receipt_checked": 0,
+            "provider_reference": ["is", "set"],
+            "sent_at": ["<=", add_to_date(now_datetime(), minutes=-15)],
+        },
+        fields=["name", "recipient", "provider_reference"],
+        limit=5000,
+    )
+    if not rows:
+        return
+
+    receipts = fetch_push_receipts({row.provider_reference: row.recipient for row in rows})
+    checked = [row.name for row in rows if row.provider_reference in receipts]
+    if checked:
+        frappe.db.sql(
+            "UPDATE `tabNotification Outbox` SET receipt_checked=1 WHERE name IN %s", (tuple(checked),)
+        )
+    frappe.db.commit()
+
+
+def get_guardian_contacts(students):
+    """Resolve the guardians and devices of many students in one query.
+
+    :param students: list of Student names.
+
+    Returns one dict per (student, guardian) with `student`, `student_name`,
+    `guardian`, `email`, `phone` and `device_tokens` (newest device first),
+    ordered like the guardians on each Student.
+    """
+    students = list({s for s in students if s})
+    if not students:
+        return []
+
+    rows = frappe.db.sql(
+        """
+        SELECT
+            s.name AS student, s.student_name, g.name AS guardian,
+            g.email_address AS email, g.mobile_number AS phone, ud.device_id
+        FROM `tabStudent` s
+        INNER JOIN `tabStudent Guardian` sg
+            ON sg.parent = s.name AND sg.parenttype = 'Student'
+        INNER JOIN `tabGuardian` g ON g.name = sg.guardian
+        LEFT JOIN `tabUser Device` ud
+            ON ud.user = g.email_address AND IFNULL(g.email_address, '') != ''
+        WHERE s.name IN %(students)s
+        ORDER BY s.name, sg.idx, ud.modified DESC
+        """,
+        {"students": students},
+        as_dict=True,
+    )
+
+    contacts = {}
+    for row in rows:
+        contact = contacts.get((row.student, row.guardian))
+        if not contact:
+            contact = contacts[(row.student, row.guardian)] = frappe._dict(
+                student=row.student,
+                student_name=row.student_name,
+                guardian=row.guardian,
+                email=row.email,
+                phone=row.phone,
+                device_tokens=[],
+            )
+        if row.device_id and row.device_id not in contact.device_tokens:
+            contact.device_tokens.append(row.device_id)
+
+    return list(contacts.values())
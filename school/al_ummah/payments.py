@@ -0,0 +1,340 @@
+import json
+
+import frappe
+from frappe.utils import cint, flt
+
+
+# payments posted between two commits/checkpoints
+PAYMENT_CHUNK_SIZE = 25
+
+
+def get_rounding_tolerance(total_outstanding):
+    # rounding differences up to 0.10 or 0.1% of the total, whichever is larger
+    return max(0.10, total_outstanding * 0.001)
+
+
+def get_invoice_rows(invoice_names):
+    """Load the fields payment validation needs for many Sales Invoices in one query."""
+    if not invoice_names:
+        return {}
+    rows = frappe.get_all(
+        "Sales Invoice",
+        filters={"name": ["in", list(set(invoice_names))], "docstatus": 1},
+        fields=["name", "student", "customer", "company", "grand_total", "outstanding_amount"],
+    )
+    return {row.name: row for row in rows}
+
+
+def update_invoices_paid(invoice_names):
+    """Mark invoices Paid with no outstanding amount, in one statement."""
+    if not invoice_names:
+        return
+    frappe.db.sql(
+        """
+        UPDATE `tabSales Invoice`
+        SET status='Paid', outstanding_amount=0, modified=%s, modified_by=%s
+        WHERE name IN %s
+        """,
+        (frappe.utils.now_datetime(), frappe.session.user, tuple(invoice_names)),
+    )
+
+
+def parse_payments(payments):
+    """Accept `[{"student", "invoices", "amount", ...}]` or `[(student, invoices, amount), ...]`."""
+    if isinstance(payments, str):
+        payments = json.loads(payments)
+
+    parsed = []
+    for payment in payments:
+        if isinstance(payment, (list, tuple)):
+            payment = dict(zip(("student", "invoices", "amount"), payment))
+        invoices = payment.get("invoices") or []
+        if isinstance(invoices, str):
+            invoices = json.loads(invoices) if invoices.startswith("[") else [invoices]
+        parsed.append(
+            {
+                "student": str(payment.get("student") or "").strip(),
+                "invoices": invoices,
+                "amount": flt(payment.get("amount"), 2),
+                "mode_of_payment": payment.get("mode_of_payment"),
+                "cheque_no": payment.get("cheque_no"),
+                "cheque_date": payment.get("cheque_date"),
+            }
+        )
+    return parsed
+
+
+def validate_payments(payments, mode_of_payment, paid_to_account):
+    """Check every payment of a batch against its invoices, loading all of them in one query.
+
+    Students may be given by Student name or by GR number. Returns
+    `(valid, errors)`: `valid` is the payments that can be posted, with
+    `student` resolved and `invoice_data` filled in for
+    `create_payment_entry`; `errors` is one `{"index", "student", "error"}`
+    per rejected payment.
+    """
+    modes = {mode_of_payment} | {p["mode_of_payment"] for p in payments if p["mode_of_payment"]}
+    existing_modes = set(frappe.get_all("Mode of Payment", filters={"name": ["in", list(modes)]}, pluck="name"))
+    if not frappe.db.exists("Account", paid_to_account):
+        frappe.throw(f"Account {paid_to_account} not found")
+
+    student_keys = {p["student"] for p in payments} | {f"GR-{p['student']}" for p in payments}
+    students = set(frappe.get_all("Student", filters={"name": ["in", list(student_keys)]}, pluck="name"))
+    invoices = get_invoice_rows([name for p in payments for name in p["invoices"]])
+
+    valid = []
+    errors = []
+    claimed = {}
+    for index, payment in enumerate(payments):
+        def reject(error):
+            errors.append({"index": index, "student": payment["student"], "error": error})
+
+        student = payment["student"] if payment["student"] in students else f"GR-{payment['student']}"
+        mode = payment["mode_of_payment"] or mode_of_payment
+        if not payment["student"] or student not in students:
+            reject(f"No student found for ID/GR Number: {payment['student']}")
+            continue
+        if not payment["invoices"]:
+            reject("No invoices given")
+            continue
+        if mode not in existing_modes:
+            reject(f"Mode of Payment {mode} not found")
+            continue
+        if mode == "Cheque" and not (payment["cheque_no"] and payment["cheque_date"]):
+            reject("Cheque number and date are required for cheque payments")
+            continue
+
+        invoice_data = []
+        error = None
+        for name in payment["invoices"]:
+            invoice = invoices.get(name)
+            if not invoice:
+                error = f"Invoice {name} not found"
+            elif invoice.student != student:
+                error = f"Invoice {name} belongs to student '{invoice.student}' but you're trying to pay for student '{student}'"
+            elif flt(invoice.outstanding_amount) <= 0:
+                error = f"Invoice {name} is already paid"
+            elif name in claimed:
+                error = f"Invoice {name} is already part of payment {claimed[name] + 1} in this batch"
+            if error:
+                break
+            invoice_data.append(
+                {
+                    "name": invoice.name,
+                    "customer": invoice.customer,
+                    "company": invoice.company,
+                    "grand_total": invoice.grand_total,
+                    "outstanding_amount": invoice.outstanding_amount,
+                }
+            )
+        if error:
+            reject(error)
+            continue
+
+        total_outstanding = flt(sum(flt(i["outstanding_amount"]) for i in invoice_data), 2)
+        difference = abs(payment["amount"] - total_outstanding)
+        if difference > get_rounding_tolerance(total_outstanding):
+            reject(
+                f"Paid amount ({payment['amount']}) does not match total outstanding amount "
+                f"({total_outstanding}). Difference: {difference}"
+            )
+            continue
+
+        for name in payment["invoices"]:
+            claimed[name] = index
+        valid.append(
+            {
+                **payment,
+                "index": index,
+                "student": student,
+                "mode_of_payment": mode,
+                "invoice_data": invoice_data,
+                "total_outstanding": total_outstanding,
+            }
+        )
+
+    return valid, errors
+
+
+def process_payment_batch(name):
+    """Post the Payment Entries of a Student Payment Batch, committing per chunk.
+
+    Each payment runs inside a savepoint; the batch's checkpoint
+    (`processed_payments`) and per-student results are committed with the
+    chunk, so an interrupted batch resumes where it stopped.
+    """
+    from school.al_ummah.api4 import create_payment_entry, generate_pdf_download_url
+
+    batch = frappe.get_doc("Student Payment Batch", name)
+    if batch.status == "Completed":
+        return
+
+    payments = json.loads(batch.payments or "[]")
+    results = json.loads(batch.results or "[]")
+    counts = {"successful": cint(batch.successful), "failed": cint(batch.failed)}
+
+    batch.db_set({"status": "Running", "error": None})
+    frappe.db.commit()
+
+    try:
+        for chunk_start in range(cint(batch.processed_payments), len(payments), PAYMENT_CHUNK_SIZE):
+            paid_invoices = []
+            for payment in payments[chunk_start : chunk_start + PAYMENT_CHUNK_SIZE]:
+                result = {
+                    "index": payment["index"],
+                    "student": payment["student"],
+                    "invoices": payment["invoices"],
+                    "amount": payment["total_outstanding"],
+                    "status": "error",
+                    "payment_entry": None,
+                    "pdf_download_url": None,
+                    "error": None,
+                }
+
+                frappe.db.savepoint("student_payment")
+                try:
+                    created = create_payment_entry(
+                        invoice_data=payment["invoice_data"],
+                        mode_of_payment=payment["mode_of_payment"],
+                        paid_to_account=batch.paid_to_account,
+                        paid_amount=payment["total_outstanding"],
+                        cheque_no=payment["cheque_no"],
+                        cheque_date=payment["cheque_date"],
+                        student_id=payment["student"],
+                    )
+                    if not created.get("success"):
+                        raise Exception(created.get("message"))
+
+                    paid_invoices.extend(payment["invoices"])
+                    result["status"] = "success"
+                    result["payment_entry"] = created["payment_entry"]
+                    result["pdf_download_url"] = generate_pdf_download_url(created["payment_entry"])
+                except Exception as e:
+                    frappe.db.rollback(save_point="student_payment")
+                    result["error"] = str(e)
+
+                counts["successful" if result["status"] == "success" else "failed"] += 1
+                results.append(result)
+                frappe.publish_realtime(
+                    "student_payment_progress",
+                    {"batch": name, **result, "progress": [len(results), len(payments)]},
+                    user=batch.owner,
+                )
+
+            update_invoices_paid(paid_invoices)
+            batch.db_set(
+                {"processed_payments": len(results), "results": json.dumps(results), **counts},
+                update_modified=False,
+            )
+            frappe.db.commit()
+
+        batch.db_set("status", "Completed")
+        frappe.db.commit()
+        print(f"✅ Payment batch {name} completed. Successful: {counts['successful']}, Failed: {counts['failed']}")
+
+    except Exception as e:
+        frappe.db.rollback()
+        frappe.log_error(frappe.get_traceback(), "Payment Batch Failed")
+        batch.db_set({"status": "Failed", "error": str(e)[:1000]})
+        frappe.db.commit()
+        raise
+
+
+def enqueue_payment_batch(name):
+    frappe.enqueue(
+        "school.al_ummah.payments.process_payment_batch",
+        queue="long",
+        timeout=3600,
+        job_id=f"student_payment_batch::{name}",
+        deduplicate=True,
+        enqueue_after_commit=True,
+        name=name,
+    )
+
+
+def get_payment_batch_response(name, rejected=None):
+    batch = frappe.get_doc("Student Payment Batch", name)
+    return {
+        "success": batch.status != "Failed",
+        "batch": batch.name,
+        "status": batch.status,
+        "message": (
+            f"Payments posted: {batch.successful} successful, {batch.failed} failed out of {batch.total_payments}"
+            if batch.status == "Completed"
+            else f"{batch.processed_payments} of {batch.total_payments} payments posted"
+        ),
+        "results": json.loads(batch.results or "[]"),
+        "rejected": rejected or [],
+        "summary": {
+            "total_payments": cint(batch.total_payments),
+            "processed": cint(batch.processed_payments),
+            "successful": cint(batch.successful),
+            "failed": cint(batch.failed),
+            "total_amount": flt(batch.total_amount),
+        },
+    }
+
+
+@frappe.whitelist()
+def process_batch_payments(payments, mode_of_payment, paid_to_account):
+    """Settle many students' invoices in one call.
+
+    :param payments: list of `{"student", "invoices", "amount"}` (or
+        `[student, invoices, amount]`), optionally with its own
+        `mode_of_payment`, `cheque_no` and `cheque_date`.
+
+    Payments that fail validation come back under `rejected` straight away.
+    The rest are posted by a background job; poll
+    `get_payment_batch_status` (or listen to `student_payment_progress`)
+    for per-student results with Payment Entry and receipt PDF URL.
+    """
+    frappe.has_permission("Payment Entry", "create", throw=True)
+    if not payments or not mode_of_payment or not paid_to_account:
+        frappe.throw("Missing required parameters")
+
+    payments = parse_payments(payments)
+    valid, rejected = validate_payments(payments, mode_of_payment, paid_to_account)
+    if not valid:
+        return {
+            "success": False,
+            "batch": None,
+            "status": None,
+            "message": "No valid payments in batch",
+            "results": [],
+            "rejected": rejected,
+        }
+
+    batch = frappe.get_doc(
+        {
+            "doctype": "Student Payment Batch",
+            "mode_of_payment": mode_of_payment,
+            "paid_to_account": paid_to_account,
+            "status": "Queued",
+            "total_payments": len(valid),
+            "total_amount": sum(p["total_outstanding"] for p in valid),
+            "payments": json.dumps(valid, default=str),
+            "results": "[]",
+        }
+    ).insert(ignore_permissions=True)
+    enqueue_payment_batch(batch.name)
+    frappe.db.commit()
+
+    return get_payment_batch_response(batch.name, rejected)
+
+
+@frappe.whitelist()
+def get_payment_batch_status(name):
+    frappe.has_permission("Student Payment Batch", "read", doc=name, throw=True)
+    return get_payment_batch_response(name)
+
+
+@frappe.whitelist()
+def resume_payment_batch(name):
+    """Re-queue an interrupted or failed batch; it continues from its last checkpoint."""
+    frappe.has_permission("Student Payment Batch", "write", doc=name, throw=True)
+    if frappe.db.get_value("Student Payment Batch", name, "status") == "Completed":
+        frappe.throw(f"Payment batch {name} is already completed.")
+    frappe.db.set_value("Student Payment Batch", name, "status", "Queued")
+    enqueue_payment_batch(name)
+    frappe.db.commit()
+    return get_payment_batch_response(name)
@@ -0,0 +1,74 @@
+"""Next Student Group and Program of a group, from the Program Progression ladder of each level."""
+
+from collections import defaultdict
+
+import frappe
+
+
+PROGRESSION_CACHE_KEY = "school:program_progression"
+
+
+def build_progression_map():
+    """`{level: {"next_level", "next_program", "divisions": {division: next_division}}}` of every Program Progression."""
+    divisions = defaultdict(dict)
+    for row in frappe.get_all(
+        "Program Progression Division",
+        filters={"parenttype": "Program Progression"},
+        fields=["parent", "division", "next_division"],
+    ):
+        divisions[row.parent][row.division] = row.next_division
+
+    return {
+        p.name: {"next_level": p.next_level, "next_program": p.next_program, "divisions": divisions[p.name]}
+        for p in frappe.get_all("Program Progression", fields=["name", "next_level", "next_program"])
+    }
+
+
+def get_progression_map():
+    return frappe.cache.get_value(PROGRESSION_CACHE_KEY, generator=build_progression_map)
+
+
+def clear_progression_cache(doc=None, method=None):
+    frappe.cache.delete_value(PROGRESSION_CACHE_KEY)
+
+
+def split_group_name(group_name, progressions):
+    """`(level, remainder)` of a group name, matching the longest level it starts with.
+
+    The academic year in brackets is dropped first, so `2nd-A (2025-2026)`
+    gives `("2nd", "-A")`. Returns `(None, base name)` when no level matches.
+    """
+    base = group_name.split("(")[0].strip() if "(" in group_name and ")" in group_name else group_name
+    for end in range(len(base), 0, -1):
+        if base[:end] in progressions:
+            return base[:end], base[end:]
+    return None, base
+
+
+def resolve_next_group(group_name):
+    """Next group base name and program of `group_name`, or None at the final level or for an unknown level.
+
+    Returns `{'group_base_name': '2nd-A', 'next_group_base_name': '3rd-A',
+    'next_program_name': '3rd'}`. A division following the level with a
+    dash is kept as it is (`2nd-A` → `3rd-A`), anything else after a space
+    (`FY Bachelors Commerce` → `SY Bachelors Commerce`); the level's
+    Division Mapping renames a division on the way.
+    """
+    progressions = get_progression_map()
+    level, remainder = split_group_name(group_name, progressions)
+    if not level:
+        return None
+
+    progression = progressions[level]
+    if not progression["next_level"]:
+        return None
+
+    separator = "-" if remainder.strip().startswith("-") else " "
+    division = remainder.strip().lstrip("-").strip()
+    next_division = progression["divisions"].get(division, division)
+
+    return {
+        "group_base_name": f"{level}{remainder}",
+        "next_group_base_name": f"{progression['next_level']}{separator}{next_division}".strip(),
+        "next_program_name": progression["next_program"],
+    }
@@ -0,0 +1,296 @@
+import json
+
+import frappe
+from frappe.utils import cint, nowdate
+
+from school.al_ummah.enrollment import add_group_member
+
+
+# students promoted between two commits/checkpoints
+PROMOTION_CHUNK_SIZE = 25
+
+# promotions up to this size run inside the request
+INLINE_PROMOTION_LIMIT = 25
+
+
+def create_student_promotion(
+    students, student_group, next_academic_year, next_academic_term, next_student_group, next_program
+):
+    """Record a promotion of `students` (`[{"student", "student_name"}]`) to be processed."""
+    return frappe.get_doc(
+        {
+            "doctype": "Student Promotion",
+            "student_group": student_group,
+            "next_student_group": next_student_group,
+            "next_program": next_program,
+            "next_academic_year": next_academic_year,
+            "next_academic_term": next_academic_term,
+            "status": "Queued",
+            "total_students": len(students),
+            "students": json.dumps(students),
+            "results": "[]",
+        }
+    ).insert(ignore_permissions=True)
+
+
+def load_promotion_context(promotion, student_ids):
+    """Everything promoting `student_ids` has to check, loaded once for the whole promotion.
+
+    Returns a dict of
+    - `student_names`: `{student: student_name}` of the students that exist,
+    - `enrolled`: students already enrolled in the next program and year,
+    - `courses`: the next program's Program Course rows,
+    - `course_enrollments`: `{(student, course)}` already enrolled for the next year and term,
+    - `group_students` / `next_roll` / `next_idx`: members, last roll number and
+      last row idx of the next group.
+    """
+    context = frappe._dict(
+        student_names=dict(
+            frappe.get_all(
+                "Student", filters={"name": ["in", student_ids]}, fields=["name", "student_name"], as_list=True
+            )
+        ),
+        enrolled=set(
+            frappe.get_all(
+                "Program Enrollment",
+                filters={
+                    "student": ["in", student_ids],
+                    "academic_year": promotion.next_academic_year,
+                    "program": promotion.next_program,
+                    "docstatus": ["<", 2],
+                },
+                pluck="student",
+            )
+        ),
+        courses=frappe.get_all(
+            "Program Course",
+            filters={"parent": promotion.next_program, "parenttype": "Program"},
+            fields=["course", "course_name"],
+            order_by="idx asc",
+        ),
+        course_enrollments=set(),
+    )
+
+    if context.courses:
+        course_filters = {
+            "student": ["in", student_ids],
+            "course": ["in", [c.course for c in context.courses]],
+            "academic_year": promotion.next_academic_year,
+            "docstatus": ["<", 2],
+        }
+        if promotion.next_academic_term:
+            course_filters["academic_term"] = promotion.next_academic_term
+        context.course_enrollments = {
+            (row.student, row.course)
+            for row in frappe.get_all("Course Enrollment", filters=course_filters, fields=["student", "course"])
+        }
+
+    group_students = frappe.get_all(
+        "Student Group Student",
+        filters={"parent": promotion.next_student_group, "parenttype": "Student Group"},
+        fields=["student", "group_roll_number", "idx"],
+    )
+    context.group_students = {d.student for d in group_students}
+    context.next_roll = max([d.group_roll_number or 0 for d in group_students], default=0)
+    context.next_idx = max([d.idx or 0 for d in group_students], default=0)
+    return context
+
+
+def promote_student(promotion, student_id, student_name, context):
+    """Create the Program Enrollment, Course Enrollments and group membership of one student."""
+    program_enrollment = frappe.new_doc("Program Enrollment")
+    program_enrollment.student = student_id
+    program_enrollment.student_name = student_name
+    program_enrollment.program = promotion.next_program
+    program_enrollment.student_batch_name = promotion.next_student_group
+    program_enrollment.academic_year = promotion.next_academic_year
+    program_enrollment.academic_term = promotion.next_academic_term
+    program_enrollment.enrollment_date = nowdate()
+    program_enrollment.insert(ignore_permissions=True)
+
+    courses_created = 0
+    for program_course in context.courses:
+        if (student_id, program_course.course) in context.course_enrollments:
+            continue
+        course_enrollment = frappe.new_doc("Course Enrollment")
+        course_enrollment.student = student_id
+        course_enrollment.student_name = student_name
+        course_enrollment.program_enrollment = program_enrollment.name
+        course_enrollment.course = program_course.course
+        course_enrollment.course_name = program_course.course_name
+        course_enrollment.academic_year = program_enrollment.academic_year
+        course_enrollment.academic_term = program_enrollment.academic_term
+        course_enrollment.enrollment_date = program_enrollment.enrollment_date
+        course_enrollment.insert(ignore_permissions=True)
+        course_enrollment.submit()
+        courses_created += 1
+
+    # after the Course Enrollments, so Education's own on_submit enrollment finds them
+    program_enrollment.submit()
+
+    added_to_group = student_id not in context.group_students
+    if added_to_group:
+        context.next_roll += 1
+        context.next_idx += 1
+        add_group_member(
+            promotion.next_student_group, student_id, student_name, context.next_roll, context.next_idx
+        )
+        context.group_students.add(student_id)
+
+    return program_enrollment.name, courses_created, added_to_group
+
+
+def process_student_promotion(name):
+    """Promote the students of a Student Promotion in chunks.
+
+    Each student runs inside a savepoint; every chunk is committed together
+    with the checkpoint (`processed_students`) and per-student results, so
+    an interrupted promotion resumes at the first uncommitted student.
+    """
+    promotion = frappe.get_doc("Student Promotion", name)
+    if promotion.status == "Completed":
+        return
+
+    students = json.loads(promotion.students or "[]")
+    results = json.loads(promotion.results or "[]")
+    counts = {
+        "promoted": cint(promotion.promoted),
+        "skipped": cint(promotion.skipped),
+        "failed": cint(promotion.failed),
+        "added_to_group": cint(promotion.added_to_group),
+    }
+
+    promotion.db_set({"status": "Running", "error": None})
+    frappe.db.commit()
+
+    try:
+        context = load_promotion_context(promotion, [s.get("student") for s in students if s.get("student")])
+
+        for chunk_start in range(cint(promotion.processed_students), len(students), PROMOTION_CHUNK_SIZE):
+            for student_data in students[chunk_start : chunk_start + PROMOTION_CHUNK_SIZE]:
+                student_id = student_data.get("student")
+                result = {
+                    "student": student_id,
+                    "student_name": student_data.get("student_name") or context.student_names.get(student_id),
+                    "status": "skipped",
+                    "program_enrollment": None,
+                    "message": "",
+                }
+
+                if not student_id:
+                    result["message"] = "Missing student ID"
+                elif student_id not in context.student_names:
+                    result["message"] = f"Student {student_id} not found"
+                elif student_id in context.enrolled:
+                    result["message"] = (
+                        f"Student {student_id} already enrolled in {promotion.next_program} for {promotion.next_academic_year}"
+                    )
+                else:
+                    frappe.db.savepoint("promote_student")
+                    try:
+                        program_enrollment, courses_created, added_to_group = promote_student(
+                            promotion, student_id, result["student_name"], context
+                        )
+                        context.enrolled.add(student_id)
+                        counts["added_to_group"] += added_to_group
+                        result["status"] = "promoted"
+                        result["program_enrollment"] = program_enrollment
+                        result["added_to_group"] = added_to_group
+                        result["message"] = f"Enrolled in {courses_created} course(s)" + (
+                            "" if added_to_group else "; already in target student group"
+                        )
+                    except Exception as e:
+                        frappe.db.rollback(save_point="promote_student")
+                        result["status"] = "failed"
+                        result["message"] = f"Failed to create enrollment for {student_id}: {str(e)}"
+
+                counts[result["status"]] += 1
+                results.append(result)
+                frappe.publish_realtime(
+                    "student_promotion_progress",
+                    {"promotion": name, **result, "progress": [len(results), len(students)]},
+                    user=promotion.owner,
+                )
+
+            # checkpoint: the chunk's documents and its results are committed together
+            promotion.db_set(
+                {"processed_students": len(results), "results": json.dumps(results), **counts},
+                update_modified=False,
+            )
+            frappe.db.commit()
+
+        promotion.db_set("status", "Completed")
+        frappe.db.commit()
+        print(f"✅ Student promotion {name} completed. Promoted: {counts['promoted']}, Skipped: {counts['skipped']}, Failed: {counts['failed']}")
+
+    except Exception as e:
+        frappe.db.rollback()
+        frappe.log_error(frappe.get_traceback(), "Student Promotion Failed")
+        promotion.db_set({"status": "Failed", "error": str(e)[:1000]})
+        frappe.db.commit()
+        raise
+
+
+def enqueue_student_promotion(name):
+    frappe.enqueue(
+        "school.al_ummah.promotion.process_student_promotion",
+        queue="long",
+        timeout=3600,
+        job_id=f"student_promotion::{name}",
+        deduplicate=True,
+        enqueue_after_commit=True,
+        name=name,
+    )
+
+
+def get_promotion_response(name):
+    """Progress and results of a promotion, in the shape `promote_students` has always returned."""
+    promotion = frappe.get_doc("Student Promotion", name)
+    results = json.loads(promotion.results or "[]")
+    not_promoted = [r["message"] for r in results if r["status"] != "promoted"]
+
+    if promotion.status == "Completed":
+        message = f"Successfully promoted {promotion.promoted} student(s) from {promotion.student_group} to {promotion.next_student_group}"
+        if not_promoted:
+            message += f". Skipped {len(not_promoted)} student(s): {', '.join(not_promoted[:5])}"
+            if len(not_promoted) > 5:
+                message += f" and {len(not_promoted) - 5} more"
+    elif promotion.status == "Failed":
+        message = f"Promotion stopped after {promotion.processed_students} of {promotion.total_students} students: {promotion.error}"
+    else:
+        message = f"Promotion of {promotion.total_students} students to {promotion.next_student_group} is running in the background"
+
+    return {
+        "success": promotion.status != "Failed",
+        "message": message,
+        "promotion": promotion.name,
+        "status": promotion.status,
+        "promoted_count": cint(promotion.promoted),
+        "skipped_count": cint(promotion.skipped) + cint(promotion.failed),
+        "failed_count": cint(promotion.failed),
+        "current_student_group": promotion.student_group,
+        "next_student_group": promotion.next_student_group,
+        "next_academic_year": promotion.next_academic_year,
+        "next_program": promotion.next_program,
+        "academic_term": promotion.next_academic_term,
+        "students_added_to_group": cint(promotion.added_to_group),
+        "results": results,
+    }
+
+
+@frappe.whitelist()
+def get_student_promotion_status(name):
+    frappe.has_permission("Student Promotion", "read", doc=name, throw=True)
+    return get_promotion_response(name)
+
+
+@frappe.whitelist()
+def resume_student_promotion(name):
+    """Re-queue an interrupted or failed promotion; it continues from its last checkpoint."""
+    frappe.has_permission("Student Promotion", "write", doc=name, throw=True)
+    if frappe.db.get_value("Student Promotion", name, "status") == "Completed":
+        frappe.throw(f"Student promotion {name} is already completed.")
+    frappe.db.set_value("Student Promotion", name, "status", "Queued")
+    enqueue_student_promotion(name)
+    frappe.db.commit()
+    return get_promotion_response(name)
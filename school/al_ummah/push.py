@@ -0,0 +1,118 @@
+import frappe
+import requests
+from requests.adapters import HTTPAdapter
+
+
+EXPO_PUSH_URL = "https://exp.host/--/api/v2/push/send"
+EXPO_RECEIPTS_URL = "https://exp.host/--/api/v2/push/getReceipts"
+
+# Expo accepts at most 100 messages per send and 1000 ids per receipt lookup
+EXPO_PUSH_CHUNK_SIZE = 100
+EXPO_RECEIPT_CHUNK_SIZE = 1000
+
+# (connect, read) timeouts in seconds
+EXPO_TIMEOUT = (5, 15)
+
+_session = None
+
+
+def get_session():
+    """Return a process-wide keep-alive session for the Expo API."""
+    global _session
+    if _session is None:
+        session = requests.Session()
+        session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=10, max_retries=2))
+        session.headers.update(
+            {
+                "accept": "application/json",
+                "accept-encoding": "gzip, deflate",
+                "content-type": "application/json",
+            }
+        )
+        _session = session
+    return _session
+
+
+def chunk(items, size):
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+def build_message(token, title, body, extra=None):
+    message = {"to": token, "title": title, "body": body}
+    if extra:
+        message["data"] = extra
+    return message
+
+
+def is_device_not_registered(result):
+    return (result.get("details") or {}).get("error") == "DeviceNotRegistered"
+
+
+def send_push_messages(messages):
+    """Send Expo push messages in chunks of 100 over a pooled session.
+
+    :param messages: list of dicts as built by `build_message`.
+
+    Returns one ticket per message, in the same order. A ticket is Expo's
+    `{"status": "ok", "id": ...}` or `{"status": "error", "message": ...}`;
+    when a whole chunk fails the error is copied to each of its tickets.
+    Tokens Expo reports as `DeviceNotRegistered` are removed from User Device.
+    """
+    tickets = []
+    unregistered = []
+
+    for batch in chunk(messages, EXPO_PUSH_CHUNK_SIZE):
+        try:
+            response = get_session().post(EXPO_PUSH_URL, json=batch, timeout=EXPO_TIMEOUT)
+            response.raise_for_status()
+            data = response.json().get("data") or []
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"❌ Error sending push notifications: {e}")
+            tickets.extend({"status": "error", "message": str(e)} for _ in batch)
+            continue
+
+        if len(data) != len(batch):
+            data = list(data) + [{"status": "error", "message": "Missing ticket"}] * (len(batch) - len(data))
+
+        for message, ticket in zip(batch, data):
+            if ticket.get("status") == "error" and is_device_not_registered(ticket):
+                unregistered.append(message["to"])
+            tickets.append(ticket)
+
+    remove_unregistered_devices(unregistered)
+    return tickets
+
+
+def fetch_push_receipts(ticket_tokens):
+    """Look up receipts for sent tickets and drop tokens that are no longer registered.
+
+    :param ticket_tokens: `{ticket_id: device_token}`.
+
+    Returns `{ticket_id: receipt}` for the receipts Expo has ready.
+    """
+    receipts = {}
+    for ids in chunk(list(ticket_tokens), EXPO_RECEIPT_CHUNK_SIZE):
+        try:
+            response = get_session().post(EXPO_RECEIPTS_URL, json={"ids": ids}, timeout=EXPO_TIMEOUT)
+            response.raise_for_status()
+            receipts.update(response.json().get("data") or {})
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"❌ Error fetching push receipts: {e}")
+
+    remove_unregistered_devices(
+        [
+            ticket_tokens[ticket_id]
+            for ticket_id, receipt in receipts.items()
+            if receipt.get("status") == "error" and is_device_not_registered(receipt)
+        ]
+    )
+    return receipts
+
+
+def remove_unregistered_devices(tokens):
+    tokens = list({t for t in tokens if t})
+    if not tokens:
+        return
+    frappe.db.delete("User Device", {"device_id": ["in", tokens]})
+    print(f"🧹 Removed {len(tokens)} unregistered device token(s)")
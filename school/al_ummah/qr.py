@@ -0,0 +1,132 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+import frappe
+
+
+# below this many codes the pool's start-up costs more than it saves
+POOL_THRESHOLD = 20
+QR_BATCH_SIZE = 200
+
+# what a student's QR code encodes; api3 and api4 enrollments have always used different formats
+QR_DATA_FORMAT = "{student} / {student} - {student_name}"
+API3_QR_DATA_FORMAT = "{student} - {student_name}"
+
+
+def get_qr_data(student, student_name, qr_format=QR_DATA_FORMAT):
+    return qr_format.format(student=student, student_name=student_name)
+
+
+def render_qr_png(data):
+    """PNG bytes of a QR code for `data`. Runs in the worker processes, so it must not touch frappe."""
+    import qrcode
+
+    qr = qrcode.QRCode(version=1, box_size=10, border=5)
+    qr.add_data(data)
+    qr.make(fit=True)
+
+    buffer = BytesIO()
+    qr.make_image().save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def render_qr_codes(data, max_workers=None):
+    """Render many QR codes, spreading the work over a process pool for large batches."""
+    if len(data) < POOL_THRESHOLD:
+        return [render_qr_png(d) for d in data]
+
+    # spawn: the workers must not inherit this process's database connection
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return list(pool.map(render_qr_png, data, chunksize=25))
+
+
+def generate_qr_codes(students, max_workers=None, qr_format=QR_DATA_FORMAT):
+    """Create QR code Files for `students` and set Student.qr_code, committing per batch.
+
+    :param students: list of Student names.
+    :param qr_format: what each code encodes, see `get_qr_data`.
+
+    Students that already have a QR code are skipped. Returns the number
+    of codes generated.
+    """
+    generated = 0
+    for i in range(0, len(students), QR_BATCH_SIZE):
+        rows = frappe.get_all(
+            "Student",
+            filters={"name": ["in", students[i : i + QR_BATCH_SIZE]], "qr_code": ["is", "not set"]},
+            fields=["name", "student_name"],
+        )
+        if not rows:
+            continue
+
+        images = render_qr_codes(
+            [get_qr_data(row.name, row.student_name, qr_format) for row in rows], max_workers
+        )
+
+        file_urls = {}
+        for row, image_data in zip(rows, images):
+            file_doc = frappe.get_doc(
+                {
+                    "doctype": "File",
+                    "file_name": f"{row.name}_qr.png",
+                    "content": image_data,
+                    "attached_to_doctype": "Student",
+                    "attached_to_name": row.name,
+                    "attached_to_field": "qr_code",
+                    "is_private": 0,
+                }
+            ).insert(ignore_permissions=True)
+            file_urls[row.name] = file_doc.file_url
+
+        frappe.db.sql(
+            "UPDATE `tabStudent` SET qr_code = CASE name "
+            + " ".join(["WHEN %s THEN %s"] * len(file_urls))
+            + " END WHERE name IN %s",
+            tuple([v for item in file_urls.items() for v in item] + [tuple(file_urls)]),
+        )
+        frappe.db.commit()
+        generated += len(file_urls)
+        print(f"✅ Generated {generated} QR code(s)")
+
+    return generated
+
+
+def enqueue_qr_codes(students, qr_format=QR_DATA_FORMAT):
+    """Generate QR codes for `students` in a background job, after the current transaction commits."""
+    students = [s for s in students if s]
+    if not students:
+        return
+    frappe.enqueue(
+        "school.al_ummah.qr.generate_qr_codes",
+        queue="long",
+        timeout=3600,
+        enqueue_after_commit=True,
+        students=students,
+        qr_format=qr_format,
+    )
+
+
+@frappe.whitelist()
+def generate_missing_qr_codes(student_group):
+    """Queue QR codes for the active students of `student_group` that don't have one yet."""
+    if "Administrator" not in frappe.get_roles(frappe.session.user):
+        frappe.throw("You are not authorized to perform this action.")
+
+    students = frappe.db.sql_list(
+        """
+        SELECT sgs.student
+        FROM `tabStudent Group Student` sgs
+        INNER JOIN `tabStudent` s ON s.name = sgs.student
+        WHERE sgs.parent = %s AND sgs.parenttype = 'Student Group' AND sgs.active = 1
+            AND IFNULL(s.qr_code, '') = ''
+        ORDER BY sgs.group_roll_number
+        """,
+        (student_group,),
+    )
+    enqueue_qr_codes(students)
+    return {
+        "status": "success",
+        "message": f"Generating QR codes for {len(students)} student(s) in {student_group}",
+        "students": len(students),
+    }
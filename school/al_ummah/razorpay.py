@@ -0,0 +1,347 @@
+import hashlib
+import hmac
+import json
+import time
+
+import frappe
+import requests
+from frappe.utils import add_to_date, cint, flt, get_datetime, now_datetime
+from requests.adapters import HTTPAdapter
+
+
+RAZORPAY_API_URL = "https://api.razorpay.com/v1"
+
+# (connect, read) timeouts in seconds
+RAZORPAY_TIMEOUT = (5, 15)
+
+# decrypted credentials are kept per process for this long (and dropped on
+# every Razorpay Settings save in the saving process)
+CREDENTIALS_TTL_SECONDS = 300
+
+_session = None
+_credentials = {}
+
+
+def get_session():
+    """Return a process-wide keep-alive session for the Razorpay API."""
+    global _session
+    if _session is None:
+        session = requests.Session()
+        session.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=10))
+        session.headers.update({"accept": "application/json", "content-type": "application/json"})
+        _session = session
+    return _session
+
+
+def get_credentials():
+    """Return `(key_id, secret)` from Razorpay Settings, decrypting the secret at most once per TTL."""
+    site = frappe.local.site
+    cached = _credentials.get(site)
+    if cached and cached[2] > time.monotonic():
+        return cached[0], cached[1]
+
+    settings = frappe.get_single("Razorpay Settings")
+    key_id = settings.api_key
+    secret = settings.get_password("api_secret", raise_exception=False)
+    _credentials[site] = (key_id, secret, time.monotonic() + CREDENTIALS_TTL_SECONDS)
+    return key_id, secret
+
+
+def clear_credentials(doc=None, method=None):
+    _credentials.pop(frappe.local.site, None)
+
+
+def request(method, path, **kwargs):
+    """Call the Razorpay API; returns the decoded JSON, or None (logged) on any failure."""
+    key_id, secret = get_credentials()
+    try:
+        response = get_session().request(
+            method, f"{RAZORPAY_API_URL}{path}", auth=(key_id, secret), timeout=RAZORPAY_TIMEOUT, **kwargs
+        )
+    except requests.exceptions.RequestException as e:
+        frappe.log_error(f"Razorpay API request failed: {str(e)}")
+        return None
+
+    if response.status_code == 200:
+        return response.json()
+
+    frappe.log_error(f"Razorpay API error: {response.text}")
+    return None
+
+
+def fetch_payment(payment_id):
+    return request("GET", f"/payments/{payment_id}")
+
+
+def fetch_order(order_id):
+    return request("GET", f"/orders/{order_id}")
+
+
+def create_order(order_data):
+    return request("POST", "/orders", json=order_data)
+
+
+def is_valid_signature(order_id, payment_id, signature, secret):
+    generated = hmac.new(secret.encode(), f"{order_id}|{payment_id}".encode(), hashlib.sha256).hexdigest()
+    return hmac.compare_digest(generated, signature or "")
+
+
+# Idempotency
+# -----------
+# Every Razorpay payment id is claimed in Razorpay Payment Log before a
+# Payment Entry is created for it. The claim is committed straight away, so a
+# retried or concurrent callback sees it and gets the stored result instead
+# of calling the API or posting a second Payment Entry. A claim left in
+# Processing by a worker that died can be taken over after
+# CLAIM_TIMEOUT_MINUTES; process_razorpay_payment still finds a Payment
+# Entry the dead worker managed to submit.
+
+CLAIM_TIMEOUT_MINUTES = 10
+
+
+def claim_payment(payment_id, order_id=None):
+    """Claim a payment id for processing.
+
+    Returns `(True, None)` when the caller should process the payment, or
+    `(False, response)` with the stored (or an in-progress) response when it
+    was already handled.
+    """
+    try:
+        frappe.get_doc(
+            {
+                "doctype": "Razorpay Payment Log",
+                "razorpay_payment_id": payment_id,
+                "razorpay_order_id": order_id,
+                "status": "Processing",
+            }
+        ).insert(ignore_permissions=True)
+        frappe.db.commit()
+        return True, None
+    except frappe.DuplicateEntryError:
+        frappe.db.rollback()
+
+    # the row lock lets only one caller retry a failed or abandoned attempt
+    log = frappe.db.get_value(
+        "Razorpay Payment Log", payment_id, ["status", "response", "modified"], as_dict=True, for_update=True
+    )
+    if log and (log.status == "Failed" or is_stale_claim(log)):
+        frappe.db.set_value("Razorpay Payment Log", payment_id, {"status": "Processing", "error": None})
+        frappe.db.commit()
+        return True, None
+    frappe.db.commit()
+
+    if log and log.status == "Processed" and log.response:
+        return False, json.loads(log.response)
+    return False, {"success": False, "message": "Payment is already being processed", "payment_id": payment_id}
+
+
+def is_stale_claim(log):
+    return log.status == "Processing" and get_datetime(log.modified) < add_to_date(
+        now_datetime(), minutes=-CLAIM_TIMEOUT_MINUTES
+    )
+
+
+def record_payment_result(payment_id, result, student=None):
+    """Store the outcome of a claimed payment and commit it."""
+    frappe.db.set_value(
+        "Razorpay Payment Log",
+        payment_id,
+        {
+            "status": "Processed" if result.get("success") else "Failed",
+            "student": student,
+            "payment_entry": result.get("payment_entry") if result.get("success") else None,
+            "amount": result.get("amount"),
+            "response": json.dumps(result, default=str),
+            "error": None if result.get("success") else result.get("message"),
+        },
+    )
+    frappe.db.commit()
+
+
+# Webhooks
+# --------
+# `webhook` only verifies the signature and queues the event in Razorpay
+# Webhook Event; `reconcile_webhook_events` posts the Payment Entries in the
+# background. Both paths claim the payment id through `claim_payment`, so a
+# payment confirmed by the app and by a webhook is posted once.
+
+# events that confirm a captured payment
+RECONCILED_EVENTS = ("payment.captured", "order.paid")
+
+# queued events loaded per query by the reconciler
+WEBHOOK_BATCH_SIZE = 50
+
+# runs an event may wait for a payment claimed elsewhere before it is marked Failed
+MAX_WEBHOOK_ATTEMPTS = 20
+
+
+def get_webhook_secret():
+    return frappe.conf.get("razorpay_webhook_secret")
+
+
+def is_valid_webhook_signature(body, signature, secret):
+    generated = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(generated, signature or "")
+
+
+def queue_webhook_event(body, signature, event_id=None):
+    """Verify a webhook delivery and queue it; returns the Razorpay Webhook Event name.
+
+    Redelivered events (same `X-Razorpay-Event-Id`) are queued once.
+    """
+    secret = get_webhook_secret()
+    if not secret:
+        frappe.throw("Razorpay webhook secret not configured", frappe.AuthenticationError)
+    if not is_valid_webhook_signature(body, signature, secret):
+        frappe.throw("Invalid webhook signature", frappe.AuthenticationError)
+
+    data = json.loads(body)
+    event_id = event_id or hashlib.sha256(body).hexdigest()
+    existing = frappe.db.get_value("Razorpay Webhook Event", {"event_id": event_id}, "name")
+    if existing:
+        return existing
+
+    payment = ((data.get("payload") or {}).get("payment") or {}).get("entity") or {}
+    event = frappe.get_doc(
+        {
+            "doctype": "Razorpay Webhook Event",
+            "event_id": event_id,
+            "event": data.get("event"),
+            "razorpay_payment_id": payment.get("id"),
+            "razorpay_order_id": payment.get("order_id"),
+            "status": "Queued" if data.get("event") in RECONCILED_EVENTS and payment.get("id") else "Ignored",
+            "payload": body.decode(),
+        }
+    ).insert(ignore_permissions=True)
+
+    if event.status == "Queued":
+        enqueue_reconciler()
+    return event.name
+
+
+def enqueue_reconciler():
+    frappe.enqueue(
+        "school.al_ummah.razorpay.reconcile_webhook_events",
+        queue="short",
+        job_id="razorpay_webhook_reconciler",
+        deduplicate=True,
+        enqueue_after_commit=True,
+    )
+
+
+@frappe.whitelist(allow_guest=True, methods=["POST"])
+def webhook():
+    """Razorpay webhook endpoint; set `razorpay_webhook_secret` in site config."""
+    queue_webhook_event(
+        frappe.request.get_data(),
+        frappe.get_request_header("X-Razorpay-Signature"),
+        frappe.get_request_header("X-Razorpay-Event-Id"),
+    )
+    frappe.db.commit()
+    return {"status": "ok"}
+
+
+def get_order_notes(data, order_id):
+    """Notes `create_razorpay_order` put on the order (student, invoices, account)."""
+    order = ((data.get("payload") or {}).get("order") or {}).get("entity")
+    if not order and order_id:
+        order = fetch_order(order_id)
+    return (order or {}).get("notes") or {}
+
+
+def get_note_invoice_names(notes):
+    """Invoice names stored in the order notes as a JSON list.
+
+    Orders created before `create_razorpay_order` parsed its argument hold
+    the list encoded twice; both forms are accepted.
+    """
+    invoice_names = notes.get("invoice_names")
+    for _ in range(2):
+        if not isinstance(invoice_names, str):
+            break
+        try:
+            invoice_names = json.loads(invoice_names)
+        except ValueError:
+            return None
+    if isinstance(invoice_names, list) and all(isinstance(i, str) for i in invoice_names):
+        return invoice_names
+    return None
+
+
+def reconcile_webhook_event(event):
+    """Post the Payment Entry of one queued event; returns the fields to update."""
+    from school.al_ummah.api4 import process_razorpay_payment
+
+    data = json.loads(event.payload)
+    payment = data["payload"]["payment"]["entity"]
+    notes = get_order_notes(data, event.razorpay_order_id)
+    invoice_names = get_note_invoice_names(notes)
+    if not (notes.get("student_id") and invoice_names and notes.get("paid_to_account")):
+        return {"status": "Ignored", "error": "Order has no student invoices in its notes"}
+
+    claimed, stored_result = claim_payment(event.razorpay_payment_id, event.razorpay_order_id)
+    if not claimed:
+        if stored_result.get("success"):
+            return {"status": "Processed", "payment_entry": stored_result.get("payment_entry")}
+        if cint(event.attempts) + 1 >= MAX_WEBHOOK_ATTEMPTS:
+            return {"status": "Failed", "error": stored_result.get("message")}
+        # the app is confirming this payment right now; look again on the next run
+        return {"status": "Queued"}
+
+    result = process_razorpay_payment(
+        event.razorpay_payment_id,
+        event.razorpay_order_id,
+        invoice_names,
+        notes["student_id"],
+        notes["paid_to_account"],
+        flt(payment.get("amount")) / 100,
+        payment_details=payment,
+    )
+    record_payment_result(event.razorpay_payment_id, result, result.get("resolved_student_id"))
+    if result.get("success"):
+        return {"status": "Processed", "payment_entry": result.get("payment_entry")}
+    return {"status": "Failed", "error": result.get("message")}
+
+
+def reconcile_webhook_events():
+    """Drain the webhook queue in batches, oldest first.
+
+    Also runs from the scheduler, which picks up events whose job was lost.
+    """
+    seen = set()
+    while True:
+        filters = {"status": "Queued"}
+        if seen:
+            filters["name"] = ["not in", list(seen)]
+        events = frappe.get_all(
+            "Razorpay Webhook Event",
+            filters=filters,
+            fields=["name", "razorpay_payment_id", "razorpay_order_id", "payload", "attempts"],
+            order_by="creation asc",
+            limit=WEBHOOK_BATCH_SIZE,
+        )
+        if not events:
+            break
+
+        for event in events:
+            seen.add(event.name)
+            try:
+                update = reconcile_webhook_event(event)
+            except Exception as e:
+                frappe.db.rollback()
+                frappe.log_error(frappe.get_traceback(), "Razorpay Webhook Reconciliation Failed")
+                update = {"status": "Failed", "error": str(e)[:1000]}
+
+            frappe.db.set_value(
+                "Razorpay Webhook Event", event.name, {**update, "attempts": cint(event.attempts) + 1}
+            )
+            frappe.db.commit()
+
+
+@frappe.whitelist()
+def requeue_webhook_event(name):
+    """Queue a failed webhook event again."""
+    frappe.only_for("System Manager")
+    frappe.db.set_value("Razorpay Webhook Event", name, {"status": "Queued", "error": None})
+    enqueue_reconciler()
+    frappe.db.commit()
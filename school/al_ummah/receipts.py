@@ -0,0 +1,117 @@
+"""Payment receipt PDFs, rendered once per submitted Payment Entry and kept as private Files."""
+
+import re
+from urllib.parse import urlencode
+
+import frappe
+from frappe.utils import get_url
+
+
+RECEIPT_PRINT_FORMAT = "test"
+RECEIPT_PDF_OPTIONS = {"orientation": "Landscape"}
+
+
+def get_receipt_file_name(payment_entry):
+    return f"{payment_entry}-receipt.pdf"
+
+
+def get_cached_receipt(payment_entry):
+    """Name of the cached receipt File of a Payment Entry, if there is one."""
+    return frappe.db.get_value(
+        "File",
+        {
+            "attached_to_doctype": "Payment Entry",
+            "attached_to_name": payment_entry,
+            "file_name": get_receipt_file_name(payment_entry),
+        },
+        "name",
+    )
+
+
+def render_receipt(payment_entry):
+    return frappe.get_print(
+        "Payment Entry",
+        payment_entry,
+        print_format=RECEIPT_PRINT_FORMAT,
+        as_pdf=True,
+        no_letterhead=1,
+        pdf_options=RECEIPT_PDF_OPTIONS,
+    )
+
+
+def build_receipt(payment_entry):
+    """Render the receipt of a submitted Payment Entry and store it; returns the File name."""
+    if frappe.db.get_value("Payment Entry", payment_entry, "docstatus") != 1:
+        return None
+
+    file_name = get_cached_receipt(payment_entry)
+    if file_name:
+        return file_name
+
+    file_doc = frappe.get_doc(
+        {
+            "doctype": "File",
+            "file_name": get_receipt_file_name(payment_entry),
+            "content": render_receipt(payment_entry),
+            "attached_to_doctype": "Payment Entry",
+            "attached_to_name": payment_entry,
+            "is_private": 1,
+        }
+    ).insert(ignore_permissions=True)
+    return file_doc.name
+
+
+def invalidate_receipt(payment_entry):
+    file_name = get_cached_receipt(payment_entry)
+    if file_name:
+        frappe.delete_doc("File", file_name, ignore_permissions=True)
+
+
+def enqueue_receipt(payment_entry):
+    frappe.enqueue(
+        "school.al_ummah.receipts.build_receipt",
+        queue="default",
+        job_id=f"payment_receipt::{payment_entry}",
+        deduplicate=True,
+        enqueue_after_commit=True,
+        payment_entry=payment_entry,
+    )
+
+
+def on_payment_entry_submit(doc, method=None):
+    enqueue_receipt(doc.name)
+
+
+def on_payment_entry_update_after_submit(doc, method=None):
+    invalidate_receipt(doc.name)
+    enqueue_receipt(doc.name)
+
+
+def on_payment_entry_cancel(doc, method=None):
+    # an amendment is a new Payment Entry and gets its own receipt on submit
+    invalidate_receipt(doc.name)
+
+
+def get_receipt_url(payment_entry):
+    """Download URL of a Payment Entry's receipt (served by `download_receipt`)."""
+    params = urlencode({"payment_entry": payment_entry})
+    full_url = f"{get_url('/api/method/school.al_ummah.receipts.download_receipt')}?{params}"
+    return re.sub(r":\d+", "", full_url)
+
+
+@frappe.whitelist()
+def download_receipt(payment_entry):
+    """Serve the cached receipt PDF, rendering and caching it first if the background job hasn't yet."""
+    frappe.has_permission("Payment Entry", "read", doc=payment_entry, throw=True)
+
+    file_name = build_receipt(payment_entry)
+    if file_name:
+        frappe.db.commit()
+        content = frappe.get_doc("File", file_name).get_content()
+    else:
+        # drafts and cancelled entries are rendered on the fly, never cached
+        content = render_receipt(payment_entry)
+
+    frappe.local.response.filename = get_receipt_file_name(payment_entry)
+    frappe.local.response.filecontent = content
+    frappe.local.response.type = "download"
@@ -0,0 +1,241 @@
+"""Year-end rollover: every Student Group of an academic year promoted to its next group in one go."""
+
+import json
+from collections import defaultdict
+
+import frappe
+from frappe.utils import cint, sbool
+
+from school.al_ummah.progression import resolve_next_group
+from school.al_ummah.promotion import create_student_promotion, enqueue_student_promotion
+
+
+def get_next_group_name(next_group_base_name, next_academic_year):
+    # same naming as api3.fetch_student_group
+    return f"{next_group_base_name} ({next_academic_year})"
+
+
+def plan_rollover(academic_year, next_academic_year):
+    """Resolve the next group and program of every active Student Group of `academic_year`.
+
+    Uses the cached Program Progression ladders and a handful of queries
+    for the whole school. Returns one entry per group with its
+    `status` (`ready`, `no_next_level`, `next_group_missing`,
+    `next_program_missing` or `nothing_to_promote`) and, under `students`,
+    the active members still to be promoted.
+    """
+    groups = frappe.get_all(
+        "Student Group",
+        filters={"academic_year": academic_year, "disabled": 0},
+        fields=["name", "program"],
+        order_by="name asc",
+    )
+    if not groups:
+        return []
+
+    members = defaultdict(list)
+    for row in frappe.get_all(
+        "Student Group Student",
+        filters={"parent": ["in", [g.name for g in groups]], "parenttype": "Student Group", "active": 1},
+        fields=["parent", "student", "student_name"],
+        order_by="group_roll_number asc",
+    ):
+        members[row.parent].append({"student": row.student, "student_name": row.student_name})
+
+    plan = []
+    for group in groups:
+        entry = {
+            "student_group": group.name,
+            "program": group.program,
+            "next_student_group": None,
+            "next_program": None,
+            "status": "ready",
+            "students": members[group.name],
+        }
+        ladder = resolve_next_group(group.name)
+        if ladder:
+            entry["next_student_group"] = get_next_group_name(ladder["next_group_base_name"], next_academic_year)
+            entry["next_program"] = ladder["next_program_name"]
+        else:
+            # the last level of its ladder, or a name no ladder matches
+            entry["status"] = "no_next_level"
+        plan.append(entry)
+
+    ready = [e for e in plan if e["status"] == "ready"]
+    next_groups = [e["next_student_group"] for e in ready] or [""]
+    next_programs = [e["next_program"] for e in ready] or [""]
+    existing_groups = set(frappe.get_all("Student Group", filters={"name": ["in", next_groups]}, pluck="name"))
+    existing_programs = set(frappe.get_all("Program", filters={"name": ["in", next_programs]}, pluck="name"))
+    students = [s["student"] for e in ready for s in e["students"]]
+    enrolled = set()
+    if students:
+        enrolled = {
+            (row.student, row.program)
+            for row in frappe.get_all(
+                "Program Enrollment",
+                filters={"student": ["in", students], "academic_year": next_academic_year, "docstatus": ["<", 2]},
+                fields=["student", "program"],
+            )
+        }
+
+    for entry in ready:
+        if entry["next_student_group"] not in existing_groups:
+            entry["status"] = "next_group_missing"
+        elif entry["next_program"] not in existing_programs:
+            entry["status"] = "next_program_missing"
+        else:
+            entry["students"] = [
+                s for s in entry["students"] if (s["student"], entry["next_program"]) not in enrolled
+            ]
+            if not entry["students"]:
+                entry["status"] = "nothing_to_promote"
+
+    return plan
+
+
+def get_plan_entry_counts(entry):
+    return {**{k: v for k, v in entry.items() if k != "students"}, "students": len(entry["students"])}
+
+
+def get_plan_summary(plan):
+    return {
+        "groups": len(plan),
+        "groups_to_promote": sum(1 for e in plan if e["status"] == "ready"),
+        "students_to_promote": sum(len(e["students"]) for e in plan if e["status"] == "ready"),
+        "groups_by_status": {
+            status: sum(1 for e in plan if e["status"] == status) for status in {e["status"] for e in plan}
+        },
+    }
+
+
+@frappe.whitelist()
+def run_year_end_rollover(academic_year=None, next_academic_year=None, dry_run=1):
+    """Promote every Student Group of `academic_year` to its next group in `next_academic_year`.
+
+    Defaults to Education Settings' current academic year and Admin
+    Settings' next academic year. With `dry_run` (the default) only the
+    counts are returned and nothing is written; otherwise every ready group
+    becomes a Student Promotion on the long queue, so groups are promoted
+    in parallel. Follow the run with `get_rollover_report`.
+    """
+    from school.al_ummah.api6 import get_first_academic_term
+
+    if "Administrator" not in frappe.get_roles(frappe.session.user):
+        frappe.throw("You are not authorized to perform this action.")
+
+    academic_year = academic_year or frappe.db.get_single_value("Education Settings", "current_academic_year")
+    next_academic_year = next_academic_year or frappe.db.get_single_value("Admin Settings", "next_academic_year")
+    if not academic_year or not next_academic_year:
+        frappe.throw("Current and next academic year are required.")
+
+    next_academic_term = get_first_academic_term(next_academic_year)
+    if not next_academic_term:
+        frappe.throw(f"No academic terms found for academic year {next_academic_year}")
+
+    plan = plan_rollover(academic_year, next_academic_year)
+    summary = get_plan_summary(plan)
+    if sbool(dry_run):
+        return {
+            "success": True,
+            "dry_run": True,
+            "academic_year": academic_year,
+            "next_academic_year": next_academic_year,
+            "summary": summary,
+            "groups": [get_plan_entry_counts(e) for e in plan],
+        }
+
+    report_plan = []
+    for entry in plan:
+        promotion = None
+        if entry["status"] == "ready":
+            promotion = create_student_promotion(
+                entry["students"],
+                entry["student_group"],
+                next_academic_year,
+                next_academic_term,
+                entry["next_student_group"],
+                entry["next_program"],
+            ).name
+            enqueue_student_promotion(promotion)
+        report_plan.append({**get_plan_entry_counts(entry), "promotion": promotion})
+
+    rollover = frappe.get_doc(
+        {
+            "doctype": "Year End Rollover",
+            "academic_year": academic_year,
+            "next_academic_year": next_academic_year,
+            "next_academic_term": next_academic_term,
+            "total_groups": summary["groups_to_promote"],
+            "total_students": summary["students_to_promote"],
+            "plan": json.dumps(report_plan),
+        }
+    ).insert(ignore_permissions=True)
+    frappe.db.commit()
+
+    return get_rollover_report(rollover.name)
+
+
+@frappe.whitelist()
+def get_rollover_report(name):
+    """Consolidated progress and results of a rollover, from all of its Student Promotions."""
+    frappe.has_permission("Year End Rollover", "read", doc=name, throw=True)
+
+    rollover = frappe.get_doc("Year End Rollover", name)
+    plan = json.loads(rollover.plan or "[]")
+    promotions = {
+        p.name: p
+        for p in frappe.get_all(
+            "Student Promotion",
+            filters={"name": ["in", [e["promotion"] for e in plan if e["promotion"]] or [""]]},
+            fields=["name", "status", "processed_students", "promoted", "skipped", "failed", "error", "results"],
+        )
+    }
+
+    totals = {"promoted": 0, "skipped": 0, "failed": 0, "processed": 0}
+    groups = []
+    not_promoted = []
+    for entry in plan:
+        promotion = promotions.get(entry["promotion"])
+        if promotion:
+            for key in ("promoted", "skipped", "failed"):
+                totals[key] += cint(promotion[key])
+            totals["processed"] += cint(promotion.processed_students)
+            not_promoted.extend(
+                {"student_group": entry["student_group"], **r}
+                for r in json.loads(promotion.results or "[]")
+                if r["status"] != "promoted"
+            )
+        groups.append(
+            {
+                **entry,
+                "promotion_status": promotion.status if promotion else None,
+                "promoted": cint(promotion.promoted) if promotion else 0,
+                "skipped": cint(promotion.skipped) if promotion else 0,
+                "failed": cint(promotion.failed) if promotion else 0,
+                "error": promotion.error if promotion else None,
+            }
+        )
+
+    statuses = {p.status for p in promotions.values()}
+    if statuses & {"Queued", "Running"}:
+        status = "Running"
+    elif "Failed" in statuses:
+        status = "Failed"
+    else:
+        status = "Completed"
+
+    return {
+        "success": status != "Failed",
+        "rollover": rollover.name,
+        "status": status,
+        "academic_year": rollover.academic_year,
+        "next_academic_year": rollover.next_academic_year,
+        "summary": {
+            "groups": len(plan),
+            "groups_promoted": cint(rollover.total_groups),
+            "students": cint(rollover.total_students),
+            **totals,
+        },
+        "groups": groups,
+        "not_promoted": not_promoted,
+    }
@@ -0,0 +1,92 @@
+import requests
+from requests.adapters import HTTPAdapter
+
+from school.al_ummah.push import chunk
+
+
+MSG91_FLOW_URL = "https://control.msg91.com/api/v5/flow"
+MSG91_ABSENCE_TEMPLATE_ID = "67a9cc85d6fc0568b5678ec2"
+
+# recipients per Flow request and (connect, read) timeouts in seconds
+MSG91_FLOW_BATCH_SIZE = 100
+MSG91_TIMEOUT = (5, 15)
+
+_session = None
+
+
+def get_session():
+    """Return a process-wide keep-alive session for the MSG91 API."""
+    global _session
+    if _session is None:
+        from school.al_ummah.api2 import MSG91_AUTH_KEY
+
+        session = requests.Session()
+        session.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=10))
+        session.mount("http://", HTTPAdapter(pool_connections=2, pool_maxsize=10))
+        session.headers.update(
+            {
+                "accept": "application/json",
+                "authkey": MSG91_AUTH_KEY,
+                "content-type": "application/json",
+            }
+        )
+        _session = session
+    return _session
+
+
+def get_mobile(phone):
+    phone = (phone or "").strip().replace(" ", "").lstrip("+")
+    if phone and not phone.startswith("91"):
+        phone = "91" + phone
+    return phone
+
+
+def send_flow_sms(template_id, recipients):
+    """Send one Flow template to many recipients in as few requests as possible.
+
+    :param template_id: MSG91 Flow template.
+    :param recipients: list of dicts with `mobiles` plus the template variables
+        (e.g. `{"mobiles": "919876543210", "var1": "Ayesha"}`).
+
+    Returns one result per recipient, in order:
+    `{"mobiles", "status": "Sent" | "Failed", "request_id", "error"}`.
+    MSG91 accepts or rejects a Flow request as a whole, so every recipient
+    of a chunk shares its outcome and request id.
+    """
+    results = []
+    for batch in chunk(recipients, MSG91_FLOW_BATCH_SIZE):
+        payload = {
+            "template_id": template_id,
+            "short_url": "0",
+            "realTimeResponse": "1",
+            "recipients": batch,
+        }
+        status, request_id, error = "Failed", None, None
+        try:
+            response = get_session().post(MSG91_FLOW_URL, json=payload, timeout=MSG91_TIMEOUT)
+            data = response.json() if response.content else {}
+            if response.status_code == 200 and data.get("type") == "success":
+                status, request_id = "Sent", data.get("message") or data.get("request_id")
+                print(f"✅ SMS flow accepted for {len(batch)} recipient(s)")
+            else:
+                error = f"Status code {response.status_code}. Response: {data or response.text}"
+        except (requests.exceptions.RequestException, ValueError) as e:
+            error = str(e)
+
+        if error:
+            print(f"❌ SMS flow failed for {len(batch)} recipient(s): {error}")
+
+        results.extend(
+            {"mobiles": r["mobiles"], "status": status, "request_id": request_id, "error": error}
+            for r in batch
+        )
+
+    return results
+
+
+def send_absence_sms_batch(recipients):
+    """Send the absence template; `recipients` is a list of `(phone, student_name)`."""
+    return send_flow_sms(
+        MSG91_ABSENCE_TEMPLATE_ID,
+        [{"mobiles": get_mobile(phone), "var1": student_name} for phone, student_name in recipients],
+    )
@@ -0,0 +1,30 @@
+# Copyright (c) 2026, Yaseen and Contributors
+# See license.txt
+
+import os
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from school.al_ummah import files
+
+
+class TestFiles(FrappeTestCase):
+	def test_local_file_path_stays_in_files_folder(self):
+		self.assertEqual(
+			files.get_local_file_path("/files/photo.jpg"),
+			os.path.realpath(frappe.utils.get_files_path("photo.jpg")),
+		)
+		self.assertEqual(
+			files.get_local_file_path("/private/files/photo.jpg"),
+			os.path.realpath(frappe.utils.get_files_path("photo.jpg", is_private=1)),
+		)
+
+	def test_local_file_path_rejects_traversal(self):
+		self.assertIsNone(files.get_local_file_path("/files/../../site_config.json"))
+		self.assertIsNone(files.get_local_file_path("/files/%2e%2e/%2e%2e/site_config.json"))
+		self.assertIsNone(files.get_local_file_path("/private/files/../../site_config.json"))
+		# the public folder is not reachable through a private URL, nor the other way round
+		self.assertIsNone(files.get_local_file_path("/private/files/../../public/files/photo.jpg"))
+		self.assertIsNone(files.get_local_file_path("/files/../../private/files/photo.jpg"))
+		self.assertIsNone(files.get_local_file_path("/etc/passwd"))
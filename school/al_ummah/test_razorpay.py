@@ -0,0 +1,181 @@
+# Copyright (c) 2026, Yaseen and Contributors
+# See license.txt
+
+import copy
+import hashlib
+import hmac
+import json
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import add_to_date, now_datetime
+
+from school.al_ummah import api4, razorpay
+
+
+WEBHOOK_SECRET = "test-webhook-secret"
+
+# a trimmed `payment.captured` delivery, as Razorpay sends it
+PAYMENT_CAPTURED = {
+	"entity": "event",
+	"account_id": "acc_TestAccount01",
+	"event": "payment.captured",
+	"contains": ["payment"],
+	"payload": {
+		"payment": {
+			"entity": {
+				"id": "pay_TestWebhook0001",
+				"entity": "payment",
+				"amount": 150000,
+				"currency": "INR",
+				"status": "captured",
+				"order_id": "order_TestWebhook01",
+				"method": "upi",
+				"captured": True,
+				"notes": {},
+			}
+		}
+	},
+	"created_at": 1792300000,
+}
+
+
+def sign(body, secret=WEBHOOK_SECRET):
+	return hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+class TestRazorpayWebhook(FrappeTestCase):
+	def setUp(self):
+		conf = patch.dict(frappe.conf, {"razorpay_webhook_secret": WEBHOOK_SECRET})
+		conf.start()
+		self.addCleanup(conf.stop)
+		enqueue = patch.object(razorpay, "enqueue_reconciler")
+		self.enqueue = enqueue.start()
+		self.addCleanup(enqueue.stop)
+
+	def test_signed_event_is_queued_once(self):
+		body = json.dumps(PAYMENT_CAPTURED).encode()
+
+		name = razorpay.queue_webhook_event(body, sign(body), "evt_Test0001")
+		redelivered = razorpay.queue_webhook_event(body, sign(body), "evt_Test0001")
+
+		self.assertEqual(name, redelivered)
+		event = frappe.get_doc("Razorpay Webhook Event", name)
+		self.assertEqual(event.status, "Queued")
+		self.assertEqual(event.razorpay_payment_id, "pay_TestWebhook0001")
+		self.assertEqual(event.razorpay_order_id, "order_TestWebhook01")
+		self.assertEqual(self.enqueue.call_count, 1)
+
+	def test_tampered_body_is_rejected(self):
+		body = json.dumps(PAYMENT_CAPTURED).encode()
+		signature = sign(body)
+		tampered = body.replace(b"150000", b"1500")
+
+		self.assertRaises(frappe.AuthenticationError, razorpay.queue_webhook_event, tampered, signature, "evt_Test0002")
+		self.assertRaises(
+			frappe.AuthenticationError, razorpay.queue_webhook_event, body, sign(body, "wrong-secret"), "evt_Test0002"
+		)
+		self.assertFalse(frappe.db.exists("Razorpay Webhook Event", {"event_id": "evt_Test0002"}))
+
+	def test_other_events_are_kept_but_not_reconciled(self):
+		body = json.dumps({**PAYMENT_CAPTURED, "event": "payment.failed"}).encode()
+
+		name = razorpay.queue_webhook_event(body, sign(body), "evt_Test0003")
+
+		self.assertEqual(frappe.db.get_value("Razorpay Webhook Event", name, "status"), "Ignored")
+		self.enqueue.assert_not_called()
+
+
+class TestRazorpayPaymentClaim(FrappeTestCase):
+	def setUp(self):
+		self.payment_id = "pay_TestClaim0001"
+		frappe.db.delete("Razorpay Payment Log", {"razorpay_payment_id": self.payment_id})
+		self.addCleanup(frappe.db.delete, "Razorpay Payment Log", {"razorpay_payment_id": self.payment_id})
+
+	def test_claim_in_progress_is_not_taken_over(self):
+		self.assertEqual(razorpay.claim_payment(self.payment_id, "order_TestClaim01"), (True, None))
+
+		claimed, response = razorpay.claim_payment(self.payment_id, "order_TestClaim01")
+		self.assertFalse(claimed)
+		self.assertEqual(response["message"], "Payment is already being processed")
+
+	def test_abandoned_claim_is_taken_over(self):
+		razorpay.claim_payment(self.payment_id, "order_TestClaim01")
+		frappe.db.set_value(
+			"Razorpay Payment Log",
+			self.payment_id,
+			"modified",
+			add_to_date(now_datetime(), minutes=-razorpay.CLAIM_TIMEOUT_MINUTES - 1),
+			update_modified=False,
+		)
+
+		self.assertEqual(razorpay.claim_payment(self.payment_id, "order_TestClaim01"), (True, None))
+		self.assertEqual(frappe.db.get_value("Razorpay Payment Log", self.payment_id, "status"), "Processing")
+
+
+class TestRazorpayReconciliation(FrappeTestCase):
+	def setUp(self):
+		conf = patch.dict(frappe.conf, {"razorpay_webhook_secret": WEBHOOK_SECRET})
+		conf.start()
+		self.addCleanup(conf.stop)
+		enqueue = patch.object(razorpay, "enqueue_reconciler")
+		enqueue.start()
+		self.addCleanup(enqueue.stop)
+
+		self.payment_id = "pay_TestReconcile01"
+		for doctype in ("Razorpay Payment Log", "Razorpay Webhook Event"):
+			frappe.db.delete(doctype, {"razorpay_payment_id": self.payment_id})
+			self.addCleanup(frappe.db.delete, doctype, {"razorpay_payment_id": self.payment_id})
+
+		# the invoices, student, account and Payment Entry live outside this test
+		exists = frappe.db.exists
+		patchers = [
+			patch.object(
+				frappe.db,
+				"exists",
+				side_effect=lambda doctype, *args, **kwargs: doctype in ("Student", "Account", "Mode of Payment")
+				or exists(doctype, *args, **kwargs),
+			),
+			patch.object(api4, "get_invoice_rows", side_effect=lambda names: {n: self.get_invoice(n) for n in names}),
+			patch.object(api4, "create_payment_entry", return_value={"success": True, "payment_entry": "ACC-PAY-TEST-0001"}),
+			patch.object(api4, "update_invoice_status"),
+			patch.object(api4, "generate_pdf_download_url"),
+		]
+		for patcher in patchers:
+			patcher.start()
+			self.addCleanup(patcher.stop)
+
+	def get_invoice(self, name):
+		return frappe._dict(
+			name=name,
+			student="GR-1001",
+			customer="Test Customer",
+			company="Test Company",
+			grand_total=750,
+			outstanding_amount=750,
+		)
+
+	def queue_event(self, invoice_names_note):
+		data = copy.deepcopy(PAYMENT_CAPTURED)
+		data["payload"]["payment"]["entity"]["id"] = self.payment_id
+		body = json.dumps(data).encode()
+		name = razorpay.queue_webhook_event(body, sign(body), f"evt_{self.payment_id}")
+
+		order = {
+			"id": "order_TestWebhook01",
+			"notes": {"student_id": "1001", "invoice_names": invoice_names_note, "paid_to_account": "Bank - TC"},
+		}
+		with patch.object(razorpay, "fetch_order", return_value=order):
+			return razorpay.reconcile_webhook_event(frappe.get_doc("Razorpay Webhook Event", name))
+
+	def test_event_with_order_notes_posts_payment_entry(self):
+		update = self.queue_event(json.dumps(["ACC-SINV-TEST-0001", "ACC-SINV-TEST-0002"]))
+
+		self.assertEqual(update, {"status": "Processed", "payment_entry": "ACC-PAY-TEST-0001"})
+		self.assertEqual(frappe.db.get_value("Razorpay Payment Log", self.payment_id, "status"), "Processed")
+
+	def test_double_encoded_invoice_names_are_decoded(self):
+		update = self.queue_event(json.dumps(json.dumps(["ACC-SINV-TEST-0001", "ACC-SINV-TEST-0002"])))
+
+		self.assertEqual(update["status"], "Processed")
@@ -0,0 +1,93 @@
+# Copyright (c) 2026, Yaseen and Contributors
+# See license.txt
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+from frappe.tests.utils import FrappeTestCase
+
+from school.al_ummah import sms
+
+
+class StubMSG91Handler(BaseHTTPRequestHandler):
+	protocol_version = "HTTP/1.1"
+
+	def do_POST(self):
+		body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+		self.server.requests.append(
+			{"body": body, "authkey": self.headers.get("authkey"), "client": self.client_address}
+		)
+
+		if body["template_id"] == "rejected-template":
+			status, data = 400, {"type": "error", "message": "Template not approved"}
+		else:
+			status, data = 200, {"type": "success", "message": f"REQ-{len(self.server.requests)}"}
+
+		content = json.dumps(data).encode()
+		self.send_response(status)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(content)))
+		self.end_headers()
+		self.wfile.write(content)
+
+	def log_message(self, *args):
+		pass
+
+
+class TestSMS(FrappeTestCase):
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		cls.server = ThreadingHTTPServer(("127.0.0.1", 0), StubMSG91Handler)
+		cls.server.requests = []
+		threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+		cls.url = f"http://127.0.0.1:{cls.server.server_address[1]}/api/v5/flow"
+
+	@classmethod
+	def tearDownClass(cls):
+		cls.server.shutdown()
+		cls.server.server_close()
+		super().tearDownClass()
+
+	def setUp(self):
+		self.server.requests.clear()
+		sms._session = None
+		patcher = patch.object(sms, "MSG91_FLOW_URL", self.url)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+
+	def test_recipients_are_sent_in_chunks(self):
+		recipients = [(f"98765{i:05d}", f"Student {i}") for i in range(250)]
+
+		results = sms.send_absence_sms_batch(recipients)
+
+		self.assertEqual([len(r["body"]["recipients"]) for r in self.server.requests], [100, 100, 50])
+		self.assertEqual(len(results), 250)
+		self.assertTrue(all(r["status"] == "Sent" for r in results))
+		self.assertEqual(results[0]["request_id"], "REQ-1")
+		self.assertEqual(results[-1]["request_id"], "REQ-3")
+		self.assertEqual(self.server.requests[0]["body"]["recipients"][1], {"mobiles": "919876500001", "var1": "Student 1"})
+
+	def test_requests_share_one_connection(self):
+		sms.send_absence_sms_batch([(f"98765{i:05d}", "Student") for i in range(300)])
+
+		self.assertEqual(len({r["client"] for r in self.server.requests}), 1)
+		self.assertTrue(all(r["authkey"] for r in self.server.requests))
+
+	def test_rejected_flow_fails_every_recipient(self):
+		results = sms.send_flow_sms(
+			"rejected-template", [{"mobiles": "919876500000"}, {"mobiles": "919876500001"}]
+		)
+
+		self.assertEqual(len(self.server.requests), 1)
+		self.assertEqual([r["status"] for r in results], ["Failed", "Failed"])
+		self.assertIn("Template not approved", results[0]["error"])
+
+	def test_unreachable_server_is_reported(self):
+		with patch.object(sms, "MSG91_FLOW_URL", "http://127.0.0.1:9/api/v5/flow"):
+			results = sms.send_flow_sms(sms.MSG91_ABSENCE_TEMPLATE_ID, [{"mobiles": "919876500000"}])
+
+		self.assertEqual(results[0]["status"], "Failed")
+		self.assertTrue(results[0]["error"])
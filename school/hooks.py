@@ -147,6 +147,29 @@ override_response_cookies = "school.al_ummah.api3.override_response_cookies"
 # 	}
 # }
 
+doc_events = {
+	"Student Attendance": {
+		"on_submit": "school.al_ummah.attendance.on_attendance_submit",
+		"on_cancel": "school.al_ummah.attendance.on_attendance_cancel",
+	},
+	"Student Leave Application": {
+		"on_submit": "school.al_ummah.attendance.on_leave_application_change",
+		"on_cancel": "school.al_ummah.attendance.on_leave_application_change",
+	},
+	"File": {
+		"after_insert": "school.al_ummah.files.on_file_insert",
+		"on_trash": "school.al_ummah.files.on_file_trash",
+	},
+	"Payment Entry": {
+		"on_submit": "school.al_ummah.receipts.on_payment_entry_submit",
+		"on_update_after_submit": "school.al_ummah.receipts.on_payment_entry_update_after_submit",
+		"on_cancel": "school.al_ummah.receipts.on_payment_entry_cancel",
+	},
+	"Razorpay Settings": {
+		"on_update": "school.al_ummah.razorpay.clear_credentials",
+	},
+}
+
 # Scheduled Tasks
 # ---------------
 
@@ -168,6 +191,17 @@ override_response_cookies = "school.al_ummah.api3.override_response_cookies"
 # 	],
 # }
 
+scheduler_events = {
+	"all": [
+		"school.al_ummah.notifications.retry_outbox",
+		"school.al_ummah.razorpay.reconcile_webhook_events",
+		"school.al_ummah.fee_invoices.resume_stale_invoice_jobs",
+	],
+	"hourly": [
+		"school.al_ummah.notifications.check_push_receipts",
+	],
+}
+
 # Testing
 # -------
 
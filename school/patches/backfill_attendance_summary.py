@@ -0,0 +1,5 @@
+from school.al_ummah.attendance import recount_attendance_summary
+
+
+def execute():
+	recount_attendance_summary()
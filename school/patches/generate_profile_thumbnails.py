@@ -0,0 +1,5 @@
+import frappe
+
+
+def execute():
+	frappe.enqueue("school.al_ummah.files.backfill_thumbnails", queue="long", timeout=3600)
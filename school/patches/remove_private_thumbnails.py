@@ -0,0 +1,5 @@
+from school.al_ummah.files import remove_private_thumbnails
+
+
+def execute():
+	remove_private_thumbnails()
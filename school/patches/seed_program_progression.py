@@ -0,0 +1,33 @@
+import frappe
+
+# the ladders api3.promote_student_group used to hard-code: (program of the whole ladder or None, levels)
+LADDERS = [
+	(None, ["Nursery", "Jr KG", "Sr KG", "1st", "2nd", "3rd", "4th", "5th", "6th", "7th", "8th", "9th", "10th", "11th", "12th"]),
+	("Bachelors", ["FY Bachelors", "SY Bachelors", "TY Bachelors", "Final Year Bachelors"]),
+	("BTech", ["FY BTech", "SY BTech", "TY BTech", "Final Year BTech"]),
+	("Masters", ["FY Masters", "SY Masters"]),
+	("PhD", ["PhD Year 1", "PhD Year 2", "PhD Year 3", "PhD Year 4", "PhD Year 5"]),
+	("Diploma", ["FY Diploma", "SY Diploma", "Final Year Diploma"]),
+]
+
+
+def execute():
+	if frappe.db.count("Program Progression"):
+		return
+
+	for program, levels in LADDERS:
+		for idx, level in enumerate(levels):
+			next_level = levels[idx + 1] if idx + 1 < len(levels) else None
+			doc = frappe.get_doc(
+				{
+					"doctype": "Program Progression",
+					"level": level,
+					# school levels are programs of their own
+					"program": program or level,
+					"next_level": next_level,
+					"next_program": (program or next_level) if next_level else None,
+				}
+			)
+			# same names as before, whether or not the Programs exist yet
+			doc.flags.ignore_links = True
+			doc.insert(ignore_permissions=True)